@@ -29,16 +29,49 @@
 import cherrypy
 from cherrypy.process import plugins
 import os
-import io
-import csv
 import json
 import MySQLdb
 from MySQLdb.cursors import DictCursor
+from MySQLdb.cursors import SSDictCursor
 import logging
 import logging.config
 import datetime
 import configparser
+import contextlib
+import queue
+import threading
+import time
+import collections
+import hashlib
+import email.utils
+import bisect
+import re
+import math
+import operator
+import itertools
+import heapq
+import base64
+import urllib.parse
+import zlib
 from typing import Union
+from xml.sax.saxutils import quoteattr
+
+# Optional content codings. gzip (zlib) is always available
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Optional faster JSON encoder. The standard library is used if it is not installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Logging configuration (hardcoded!)
 LOG_CONF = {
@@ -88,6 +121,11 @@ LOG_CONF = {
             'level': 'DEBUG',
             'propagate': False
         },
+        'SC3dbpool': {
+            'handlers': ['sc3microapilog'],
+            'level': 'INFO',
+            'propagate': False
+        },
         'AccessAPI': {
             'handlers': ['sc3microapilog'],
             'level': 'INFO',
@@ -103,6 +141,11 @@ LOG_CONF = {
             'level': 'INFO',
             'propagate': False
         },
+        'Inventory': {
+            'handlers': ['sc3microapilog'],
+            'level': 'INFO',
+            'propagate': False
+        },
         'SC3MicroAPI': {
             'handlers': ['sc3microapilog'],
             'level': 'INFO',
@@ -122,6 +165,10 @@ LOG_CONF = {
 }
 
 
+# Mean radius of the Earth in km
+EARTHRADIUS = 6371.0
+
+
 def str2date(dateiso: str) -> Union[datetime.datetime, None]:
     """Transform a string to a datetime.
 
@@ -145,24 +192,345 @@ def str2date(dateiso: str) -> Union[datetime.datetime, None]:
     return result.replace(tzinfo=datetime.timezone.utc)
 
 
+def naivedate(dateiso: str) -> Union[datetime.datetime, None]:
+    """Transform a string to a naive datetime comparable with the ones from the DB.
+
+    :param dateiso: A datetime in ISO format or None.
+    :type dateiso: string
+    :return: A datetime in UTC without timezone information or None.
+    :rtype: datetime
+    """
+    if dateiso is None:
+        return None
+
+    result = str2date(dateiso)
+    return result.replace(tzinfo=None) if result is not None else None
+
+
+def distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points.
+
+    :param lat1: Latitude of the first point in degrees
+    :type lat1: float
+    :param lon1: Longitude of the first point in degrees
+    :type lon1: float
+    :param lat2: Latitude of the second point in degrees
+    :type lat2: float
+    :param lon2: Longitude of the second point in degrees
+    :type lon2: float
+    :return: Distance in km
+    :rtype: float
+    """
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    hav = (math.sin((phi2 - phi1) / 2) ** 2 +
+           math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTHRADIUS * math.asin(min(1.0, math.sqrt(hav)))
+
+
+def radiusbox(lat: float, lon: float, maxradius: float) -> tuple:
+    """Bounding box of all the points within a distance of a given point.
+
+    :param lat: Latitude of the centre in degrees
+    :type lat: float
+    :param lon: Longitude of the centre in degrees
+    :type lon: float
+    :param maxradius: Distance in km
+    :type maxradius: float
+    :return: minlat, maxlat, minlon, maxlon. minlon > maxlon if the box crosses the dateline
+    :rtype: tuple
+    """
+    radius = maxradius / EARTHRADIUS
+    minlat = lat - math.degrees(radius)
+    maxlat = lat + math.degrees(radius)
+    if minlat <= -90.0 or maxlat >= 90.0 or radius >= math.pi / 2:
+        # One of the poles is inside the circle. All longitudes are possible
+        return max(minlat, -90.0), min(maxlat, 90.0), -180.0, 180.0
+
+    dlon = math.degrees(math.asin(min(1.0, math.sin(radius) / math.cos(math.radians(lat)))))
+    minlon = lon - dlon
+    maxlon = lon + dlon
+    if minlon < -180.0:
+        minlon += 360.0
+    if maxlon > 180.0:
+        maxlon -= 360.0
+    return minlat, maxlat, minlon, maxlon
+
+
+def inbox(lat: float, lon: float, minlat: float = None, maxlat: float = None,
+          minlon: float = None, maxlon: float = None) -> bool:
+    """Check whether a point lies inside a box. minlon > maxlon if the box crosses the dateline."""
+    if lat is None or lon is None:
+        return False
+    if minlat is not None and lat < minlat:
+        return False
+    if maxlat is not None and lat > maxlat:
+        return False
+    if minlon is not None and maxlon is not None and minlon > maxlon:
+        return lon >= minlon or lon <= maxlon
+    if minlon is not None and lon < minlon:
+        return False
+    if maxlon is not None and lon > maxlon:
+        return False
+    return True
+
+
+def istemporary(code: str) -> bool:
+    """Check whether a network code belongs to a temporary network."""
+    return code[0] in '0123456789XYZ'
+
+
+def extendedcode(code: str, start: datetime.datetime) -> str:
+    """Network code including the start year if the network is temporary (e.g. 4C_2011)."""
+    return '%s_%d' % (code, start.year) if istemporary(code) else code
+
+
+def encodetoken(key: list) -> str:
+    """Opaque continuation token pointing after the row with the given key."""
+    return base64.urlsafe_b64encode(json.dumps(key, default=datetime.datetime.isoformat).encode('utf-8')).decode('ascii')
+
+
+def decodetoken(token: str, keyfields: list) -> list:
+    """Key of the last row returned, decoded from a continuation token.
+
+    :param token: Token received in the "after" parameter
+    :type token: str
+    :param keyfields: Fields of the key of the rows
+    :type keyfields: list
+    :return: Values of the key with the start times as datetime and the _oid as int
+    :rtype: list
+    :raises: ValueError
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+    except Exception:
+        raise ValueError('Wrong continuation token')
+    if not isinstance(key, list) or len(key) != len(keyfields):
+        raise ValueError('Wrong continuation token')
+    for field, value in zip(keyfields, key):
+        if not isinstance(value, int if field == '_oid' else str) or isinstance(value, bool):
+            raise ValueError('Wrong continuation token')
+    return [datetime.datetime.fromisoformat(value) if field in ('start', 'netstart') else value
+            for field, value in zip(keyfields, key)]
+
+
+def nextpage(token: str) -> dict:
+    """Headers pointing to the next page of the current request."""
+    params = [(k, v) for k, v in urllib.parse.parse_qsl(cherrypy.request.query_string) if k != 'after']
+    params.append(('after', token))
+    return {'X-Continuation-Token': token,
+            'Link': '<%s>; rel="next"' % cherrypy.url(qs=urllib.parse.urlencode(params))}
+
+
+def projection(selector: str, available: list) -> list:
+    """Fields requested in a "fields" parameter, in the order given.
+
+    :param selector: Names of the fields separated by commas
+    :type selector: str
+    :param available: Fields which can be requested
+    :type available: list
+    :return: Fields requested without duplicates
+    :rtype: list
+    :raises: ValueError
+    """
+    result = list()
+    for field in selector.split(','):
+        field = field.strip()
+        if field not in available:
+            raise ValueError('Unknown field (%s)' % field)
+        if field not in result:
+            result.append(field)
+    return result
+
+
+# Encoders in JSON of the types found in the rows, to skip the dispatch of json.dumps
+JSONENCODERS = {str: json.encoder.encode_basestring_ascii,
+                int: int.__repr__,
+                float: lambda value: float.__repr__(value) if math.isfinite(value) else json.dumps(value),
+                bool: lambda value: 'true' if value else 'false',
+                type(None): lambda value: 'null',
+                datetime.datetime: lambda value: '"%s"' % value.isoformat()}
+
+
+def jsonvalue(value) -> str:
+    """Encode a value in JSON like json.dumps does with datetimes in ISO format."""
+    encoder = JSONENCODERS.get(value.__class__)
+    if encoder is not None:
+        return encoder(value)
+    return json.dumps(value, default=datetime.datetime.isoformat)
+
+
+def textvalue(value) -> str:
+    """Encode a value for the text format like csv.writer does with "|" as delimiter."""
+    if value is None:
+        return ''
+    text = value if value.__class__ is str else str(value)
+    if '|' in text or '"' in text or '\n' in text or '\r' in text:
+        return '"%s"' % text.replace('"', '""')
+    return text
+
+
+def accessdecision(networks: list, grants: list, sta: str = '', loc: str = '', cha: str = '',
+                   starttime: datetime.datetime = None, endtime: datetime.datetime = None) -> str:
+    """Decide whether a user has access to a stream from rows already retrieved.
+
+    Same rules as in AccessAPI.decide, but evaluated in memory.
+
+    :param networks: Epochs of the network (start, end and restricted)
+    :type networks: list
+    :param grants: Rows from Access for the network and user
+    :type grants: list
+    :returns: 'open', 'network', 'station', 'channel', 'denied', 'notfound' or 'ambiguous'
+    :rtype: str
+    """
+    restricted = {net['restricted'] for net in networks
+                  if (starttime is None or net['start'] <= starttime) and
+                  (endtime is None or net['end'] is None or net['end'] >= endtime)}
+
+    if len(restricted) != 1:
+        return 'ambiguous' if len(restricted) else 'notfound'
+
+    if 0 in restricted:
+        return 'open'
+
+    levels = set()
+    for grant in grants:
+        if starttime is not None and grant['start'] > starttime:
+            continue
+        if endtime is not None and grant['end'] is not None and grant['end'] < endtime:
+            continue
+
+        if grant['stationCode'] == '' and grant['locationCode'] == '' and grant['streamCode'] == '':
+            levels.add('network')
+        elif len(sta) and grant['stationCode'] == sta and grant['locationCode'] == '' and \
+                grant['streamCode'] == '':
+            levels.add('station')
+        elif len(cha) and grant['stationCode'] == sta and grant['locationCode'] == loc and \
+                grant['streamCode'] == cha:
+            levels.add('channel')
+
+    for level in ('network', 'station', 'channel'):
+        if level in levels:
+            return level
+
+    return 'denied'
+
+
+class Compressor(object):
+    """Incremental compressor for the content codings supported by the service."""
+
+    # Supported codings in order of preference (zstd and br only if the modules are installed)
+    codings = [coding for coding, module in (('zstd', zstandard), ('br', brotli), ('gzip', zlib))
+               if module is not None]
+
+    def __init__(self, coding: str):
+        """Constructor of the Compressor class.
+
+        :param coding: Content coding (one of Compressor.codings)
+        :type coding: str
+        """
+        if coding == 'gzip':
+            # wbits=31 for a gzip header and trailer
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            self.compress = compressor.compress
+            self.flush = compressor.flush
+        elif coding == 'zstd':
+            compressor = zstandard.ZstdCompressor().compressobj()
+            self.compress = compressor.compress
+            self.flush = compressor.flush
+        elif coding == 'br':
+            compressor = brotli.Compressor()
+            self.compress = compressor.process
+            self.flush = compressor.finish
+        else:
+            raise ValueError('Unsupported content coding (%s)' % coding)
+
+    def chunks(self, chunks):
+        """Compress a body given in chunks."""
+        for chunk in chunks:
+            data = self.compress(chunk)
+            if len(data):
+                yield data
+        yield self.flush()
+
+    @classmethod
+    def negotiate(cls, acceptencoding: str) -> Union[str, None]:
+        """Choose the content coding for a response.
+
+        :param acceptencoding: Value of the Accept-Encoding header
+        :type acceptencoding: str
+        :returns: The preferred coding accepted by the client or None (identity)
+        :rtype: str
+        """
+        weights = dict()
+        for item in acceptencoding.split(','):
+            coding, _, params = item.partition(';')
+            coding = coding.strip().lower()
+            if not len(coding):
+                continue
+            try:
+                weight = float(params.strip()[2:]) if params.strip().startswith('q=') else 1.0
+            except ValueError:
+                weight = 0.0
+            weights[coding] = weight
+
+        best = None
+        bestweight = 0.0
+        for coding in cls.codings:
+            weight = weights.get(coding, weights.get('*', 0.0))
+            if weight > bestweight:
+                best = coding
+                bestweight = weight
+        return best
+
+    @classmethod
+    def accepted(cls) -> Union[str, None]:
+        """Content coding for the response to the current request."""
+        return cls.negotiate(cherrypy.request.headers.get('Accept-Encoding', ''))
+
+
 class SC3dbconnection(object):
     def __init__(self, host: str, user: str, password: str, db: str = 'seiscomp3'):
-        """Constructor of the AccessAPI class."""
+        """Constructor of the SC3dbconnection class."""
         self.host = host
         self.user = user
         self.password = password
         self.db = db
         self.conn = None
         self.cursor = None
+        self.log = logging.getLogger('SC3dbconnection')
         # Save connection
         self.connect()
-        self.log = logging.getLogger('SC3dbconnection')
 
     def connect(self):
         # Save connection
         self.conn = MySQLdb.connect(self.host, self.user, self.password,
                                     self.db, cursorclass=DictCursor)
 
+    def ping(self):
+        """Check that the connection is still alive and reconnect if it is not."""
+        try:
+            self.conn.ping()
+        except MySQLdb.OperationalError:
+            self.log.warning('Connection lost. Trying to reconnect.')
+            self.connect()
+
+    def release(self):
+        """Close the cursor of the current request."""
+        if self.cursor is not None:
+            try:
+                self.cursor.close()
+            except MySQLdb.Error:
+                pass
+            self.cursor = None
+
+    def close(self):
+        self.release()
+        try:
+            self.conn.close()
+        except MySQLdb.Error:
+            pass
+
     def fetchone(self):
         if self.cursor is None:
             raise Exception('Cursor has not been created!')
@@ -175,57 +543,1867 @@ class SC3dbconnection(object):
 
         return self.cursor.fetchall()
 
-    def execute(self, query: str, variables):
+    def fetchmany(self, size: int):
+        if self.cursor is None:
+            raise Exception('Cursor has not been created!')
+
+        return self.cursor.fetchmany(size)
+
+    def iterrows(self, batch_size: int = 1000):
+        """Iterate over the rows of the last query reading them in batches.
+
+        :param batch_size: Number of rows read at once
+        :type batch_size: int
+        :returns: Iterator over the rows as dictionaries
+        :rtype: generator
+        """
+        while True:
+            rows = self.fetchmany(batch_size)
+            if not len(rows):
+                return
+            yield from rows
+
+    def execute(self, query: str, variables, serverside: bool = False):
+        """Execute a query in a new cursor.
+
+        With serverside=True the result stays in the server and is transferred
+        while it is read (SSDictCursor). No other query can be executed in this
+        connection until all rows are read or the cursor is released.
+
+        :param query: Query to execute
+        :type query: str
+        :param variables: Values of the parameters of the query
+        :type variables: list
+        :param serverside: Use an unbuffered cursor
+        :type serverside: bool
+        """
+        self.release()
+        cursorclass = SSDictCursor if serverside else DictCursor
         try:
-            self.cursor = self.conn.cursor()
+            self.cursor = self.conn.cursor(cursorclass)
             self.cursor.execute(query, variables)
         except MySQLdb.OperationalError:
             self.log.error('OperationalError exception. Trying to reconnect.')
             self.connect()
-            self.cursor = self.conn.cursor()
+            self.cursor = self.conn.cursor(cursorclass)
             self.cursor.execute(query, variables)
             self.log.warning('Reconnection successful: {}.'.format(self.conn))
 
         return
 
 
+class SC3dbpool(object):
+    """Bounded pool of connections to the SC3 database shared by all the APIs.
+
+    Every request checks out its own connection (and therefore its own cursor)
+    with the :meth:`connection` context manager and returns it to the pool at
+    the end. At most ``maxsize`` connections are open at the same time and at
+    most ``maxstreams`` of them are held while a response is sent to a client.
+    """
+
+    def __init__(self, host: str, user: str, password: str, db: str = 'seiscomp3',
+                 minsize: int = 1, maxsize: int = 10, timeout: float = 30.0, maxstreams: int = None):
+        """Constructor of the SC3dbpool class.
+
+        :param minsize: Number of connections opened at startup
+        :type minsize: int
+        :param maxsize: Maximum number of connections open at the same time
+        :type maxsize: int
+        :param timeout: Seconds to wait for a free connection before giving up
+        :type timeout: float
+        :param maxstreams: Maximum number of connections streaming rows to clients (half of maxsize by default)
+        :type maxstreams: int
+        """
+        if maxstreams is None:
+            maxstreams = maxsize // 2
+        if minsize < 0 or maxsize < 1 or minsize > maxsize or not 0 <= maxstreams < maxsize:
+            raise ValueError('Wrong pool size (min={}, max={}, streams={}).'.format(minsize, maxsize, maxstreams))
+
+        self.host = host
+        self.user = user
+        self.password = password
+        self.db = db
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.maxstreams = maxstreams
+        self.timeout = timeout
+        self.log = logging.getLogger('SC3dbpool')
+
+        # Idle connections. LIFO to reuse the most recently used (warm) ones
+        self.__idle = queue.LifoQueue()
+        # One slot per connection which can be checked out
+        self.__slots = threading.BoundedSemaphore(maxsize)
+        # Slots to stream rows while the response is sent. A slow client could
+        # hold its connection for a long time, so some are always left for the rest
+        self.__streams = threading.BoundedSemaphore(maxstreams) if maxstreams else None
+
+        for _ in range(minsize):
+            self.__idle.put(self.__newconnection())
+
+    def __newconnection(self) -> SC3dbconnection:
+        self.log.debug('Opening a new connection to {}.'.format(self.host))
+        return SC3dbconnection(self.host, self.user, self.password, self.db)
+
+    def __checkout(self) -> SC3dbconnection:
+        if not self.__slots.acquire(timeout=self.timeout):
+            # Send Error 503
+            messdict = {'code': 0,
+                        'message': 'No connection to the DB available after {} seconds.'.format(self.timeout)}
+            message = json.dumps(messdict)
+            self.log.error(message)
+            raise cherrypy.HTTPError(503, message)
+
+        conn = None
+        try:
+            try:
+                conn = self.__idle.get_nowait()
+                # Health check before handing it over
+                conn.ping()
+            except queue.Empty:
+                conn = self.__newconnection()
+        except BaseException:
+            self.__checkin(conn, discard=True)
+            raise
+        return conn
+
+    def __checkin(self, conn: SC3dbconnection, discard: bool = False):
+        try:
+            if conn is not None and discard:
+                conn.close()
+            elif conn is not None:
+                conn.release()
+                self.__idle.put(conn)
+        finally:
+            self.__slots.release()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Check out a connection for the duration of a request.
+
+        :returns: A healthy connection for exclusive use of the caller
+        :rtype: SC3dbconnection
+        :raises: cherrypy.HTTPError
+        """
+        conn = self.__checkout()
+        discard = False
+        try:
+            yield conn
+        except MySQLdb.Error:
+            # Do not give back a connection in an unknown state
+            discard = True
+            raise
+        finally:
+            self.__checkin(conn, discard)
+
+    def rows(self, query: str, variables: list, size: int = 1000, stream: bool = True, rowfilter=None,
+             limit: int = None):
+        """Run a query and return its rows, streaming them from the DB only if they are many.
+
+        The query is executed before returning, so that errors can still be sent
+        to the client. If the result fits in one chunk, if it must not be
+        streamed or if all the slots for streaming are in use, all rows are read
+        and the connection goes back to the pool at once. Otherwise, the rows are
+        read in chunks from a server-side cursor while the response is sent and
+        the connection goes back to the pool when the iterator is exhausted. If
+        the iterator is closed before (e.g. the client disconnected), the
+        connection still has rows pending and is closed instead.
+
+        Rows can also be filtered while they are read. Once "limit" rows are
+        accepted, the rest of the result is discarded with the cursor.
+
+        :param query: Query to execute
+        :type query: str
+        :param variables: Values of the parameters of the query
+        :type variables: list
+        :param size: Number of rows read from the DB at once
+        :type size: int
+        :param stream: Stream large results instead of reading them at once
+        :type stream: bool
+        :param rowfilter: Function returning whether a row must be returned
+        :type rowfilter: function
+        :param limit: Maximum number of rows to return
+        :type limit: int
+        :returns: List of rows or iterator over them
+        :rtype: list or generator
+        :raises: cherrypy.HTTPError
+        """
+        conn = self.__checkout()
+        streaming = False
+        try:
+            conn.execute(query, variables, serverside=True)
+            rows = conn.iterrows(size)
+            if rowfilter is not None:
+                rows = filter(rowfilter, rows)
+            if limit is not None:
+                rows = itertools.islice(rows, limit)
+            first = list(itertools.islice(rows, size))
+            streaming = (stream and len(first) == size and self.__streams is not None and
+                         self.__streams.acquire(blocking=False))
+            if not streaming:
+                first.extend(rows)
+        except BaseException as e:
+            self.__checkin(conn, discard=isinstance(e, MySQLdb.Error))
+            raise
+
+        if not streaming:
+            self.__checkin(conn)
+            return first
+
+        result = self.__stream(conn, first, rows)
+        next(result)
+        return result
+
+    def __stream(self, conn: SC3dbconnection, first: list, rows):
+        finished = False
+        try:
+            # Started. From now on the connection is given back even if the rows are never requested
+            yield
+            yield from first
+            yield from rows
+            finished = True
+        finally:
+            self.__checkin(conn, discard=not finished)
+            self.__streams.release()
+
+    def close(self):
+        """Close all idle connections."""
+        while True:
+            try:
+                self.__idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class LRUCache(object):
+    """Thread-safe LRU cache with expiration time and limits in entries and bytes."""
+
+    def __init__(self, maxentries: int = 1000, maxbytes: int = 64 * 1024 * 1024, ttl: float = 300.0):
+        """Constructor of the LRUCache class.
+
+        :param maxentries: Maximum number of entries in the cache
+        :type maxentries: int
+        :param maxbytes: Maximum size of all entries together
+        :type maxbytes: int
+        :param ttl: Default seconds before an entry expires
+        :type ttl: float
+        """
+        self.maxentries = maxentries
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Incremented every time the cache is invalidated
+        self.generation = 0
+        self.__entries = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        """Return the value of a valid entry or None if it is not in the cache."""
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires, size, value = entry
+            if expires < time.monotonic():
+                del self.__entries[key]
+                self.bytes -= size
+                self.misses += 1
+                return None
+
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: float = None, size: int = 0):
+        """Add an entry to the cache evicting the least recently used ones if needed."""
+        if size > self.maxbytes:
+            return
+
+        expires = time.monotonic() + (ttl if ttl is not None else self.ttl)
+        with self.__lock:
+            old = self.__entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+
+            self.__entries[key] = (expires, size, value)
+            self.bytes += size
+
+            while len(self.__entries) > self.maxentries or self.bytes > self.maxbytes:
+                _, (_, oldsize, _) = self.__entries.popitem(last=False)
+                self.bytes -= oldsize
+                self.evictions += 1
+
+    def invalidate(self):
+        """Remove all entries from the cache."""
+        with self.__lock:
+            self.__entries.clear()
+            self.bytes = 0
+            self.generation += 1
+
+    def stats(self) -> dict:
+        """Return the counters of the cache."""
+        with self.__lock:
+            return {'entries': len(self.__entries), 'bytes': self.bytes, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
+
+
+class Serializer(object):
+    """Encoder of rows in one output format compiled for a list of fields.
+
+    The field names, separators and the access to the values are prepared
+    once, so that encoding a row only dispatches on the type of each value.
+    Serializers are kept in a registry by endpoint, fields and format and
+    reused by all the requests asking for the same representation.
+
+    The JSON formats are encoded by the standard library by default. orjson
+    can be selected if it is installed. Its output is equivalent, but without
+    spaces after the separators and with non-ASCII characters not escaped.
+    """
+
+    # Content type of every output format
+    contenttypes = {'json': 'application/json',
+                    'text': 'text/plain',
+                    'ndjson': 'application/x-ndjson',
+                    'geojson': 'application/geo+json'}
+    # Library encoding the JSON formats. The same bytes (and ETags) as json.dumps by default
+    backend = 'json'
+    # Serializers already compiled by endpoint, fields and format
+    registry = LRUCache(maxentries=256, ttl=24 * 3600.0)
+
+    def __init__(self, fields: list, outformat: str, backend: str = None):
+        """Constructor of the Serializer class.
+
+        :param fields: Fields to include in the output in this order
+        :type fields: list
+        :param outformat: Output format (json, text, ndjson, geojson)
+        :type outformat: str
+        :param backend: Library encoding JSON (json, orjson). By default the one of the class
+        :type backend: str
+        :raises: ValueError
+        """
+        if outformat not in self.contenttypes:
+            raise ValueError('Unknown output format %s' % outformat)
+        if backend is not None:
+            if backend not in ('json', 'orjson') or (backend == 'orjson' and orjson is None):
+                raise ValueError('JSON backend %s not available' % backend)
+            self.backend = backend
+
+        self.fields = list(fields)
+        self.outformat = outformat
+        self.contenttype = self.contenttypes[outformat]
+
+        # Values of the fields in order with one call
+        if len(self.fields) == 1:
+            field = self.fields[0]
+            self.values = lambda row: (row[field],)
+        else:
+            self.values = operator.itemgetter(*self.fields)
+
+        # Template of the JSON object with the fields
+        self.template = '{%s}' % ', '.join('%s: %%s' % json.dumps(field).replace('%', '%%')
+                                            for field in self.fields)
+        separator = ',' if self.backend == 'orjson' else ', '
+        # Encoder of the rows which have exactly the fields, in the same order
+        self.direct = None
+        if outformat in ('json', 'ndjson') and self.backend == 'json':
+            self.direct = json.JSONEncoder(default=datetime.datetime.isoformat).encode
+
+        if outformat == 'json':
+            self.header, self.separator, self.footer = '[', separator, ']'
+            self.empty = '[]'
+            self.encode = self.__orjsonrow if self.backend == 'orjson' else self.__jsonrow
+        elif outformat == 'ndjson':
+            self.header, self.separator, self.footer = '', '\n', '\n'
+            self.empty = ''
+            self.encode = self.__orjsonrow if self.backend == 'orjson' else self.__jsonrow
+        elif outformat == 'geojson':
+            self.header = '{"type": "FeatureCollection", "features": ['
+            self.separator, self.footer = separator, ']}'
+            self.empty = self.header + self.footer
+            self.encode = self.__orjsonfeature if self.backend == 'orjson' else self.__jsonfeature
+        elif outformat == 'text':
+            self.header = '|'.join(textvalue(field) for field in self.fields) + '\r\n'
+            self.separator, self.footer = '\r\n', '\r\n'
+            self.empty = self.header
+            self.encode = self.__textrow
+
+    @classmethod
+    def get(cls, endpoint: str, fields: list, outformat: str) -> 'Serializer':
+        """Return the serializer of an endpoint for some fields and format, compiling it once."""
+        key = (endpoint, tuple(fields), outformat)
+        serializer = cls.registry.get(key)
+        if serializer is None:
+            serializer = cls(fields, outformat)
+            cls.registry.set(key, serializer)
+        return serializer
+
+    def __jsonrow(self, row: dict) -> str:
+        # Most values are encoded directly by the encoder of their type
+        return self.template % tuple([JSONENCODERS.get(value.__class__, jsonvalue)(value)
+                                      for value in self.values(row)])
+
+    def __orjsonrow(self, row: dict) -> str:
+        return orjson.dumps(dict(zip(self.fields, self.values(row)))).decode('utf-8')
+
+    def __jsonfeature(self, row: dict) -> str:
+        return '{"type": "Feature", "geometry": %s, "properties": %s}' % (self.__geometry(row),
+                                                                         self.__jsonrow(row))
+
+    def __orjsonfeature(self, row: dict) -> str:
+        return '{"type":"Feature","geometry":%s,"properties":%s}' % (self.__geometry(row),
+                                                                    self.__orjsonrow(row))
+
+    @staticmethod
+    def __geometry(row: dict) -> str:
+        # Point with the elevation as third coordinate if present
+        if row.get('latitude') is None or row.get('longitude') is None:
+            return 'null'
+        coordinates = [row['longitude'], row['latitude']]
+        if row.get('elevation') is not None:
+            coordinates.append(row['elevation'])
+        return '{"type": "Point", "coordinates": [%s]}' % ', '.join(map(jsonvalue, coordinates))
+
+    def __textrow(self, row: dict) -> str:
+        line = '|'.join(map(textvalue, self.values(row)))
+        # A row with only an empty field is quoted to distinguish it from an empty line
+        return line if len(line) else '""'
+
+    def chunks(self, rows, size: int = 1000):
+        """Encode rows in chunks of bytes.
+
+        Only a chunk of rows is kept in memory, so that the whole output never
+        exists as one string.
+
+        :param rows: Rows to encode
+        :type rows: iterable
+        :param size: Number of rows in every chunk
+        :type size: int
+        :returns: Generator of the encoded chunks
+        """
+        rows = iter(rows)
+        separator = self.separator
+
+        # All rows come from the same query, so the first one tells whether
+        # they can be given as they are to the encoder of the standard library
+        first = list(itertools.islice(rows, 1))
+        direct = self.direct is not None and len(first) and list(first[0]) == self.fields
+        if direct and self.outformat == 'json':
+            # A whole batch at once without the brackets of the list
+            def encode(batch: list) -> str:
+                return self.direct(batch)[1:-1]
+        elif direct:
+            def encode(batch: list) -> str:
+                return separator.join(map(self.direct, batch))
+        else:
+            def encode(batch: list) -> str:
+                return separator.join(map(self.encode, batch))
+        rows = itertools.chain(first, rows)
+
+        started = False
+        while True:
+            batch = list(itertools.islice(rows, size))
+            if len(batch) < size:
+                break
+            yield ((separator if started else self.header) + encode(batch)).encode('utf-8')
+            started = True
+
+        if len(batch):
+            yield ((separator if started else self.header) + encode(batch) + self.footer).encode('utf-8')
+        else:
+            yield (self.footer if started else self.empty).encode('utf-8')
+
+    def dumps(self, rows) -> bytes:
+        """Encode all rows at once."""
+        return b''.join(self.chunks(rows))
+
+
+class RoutingXML(object):
+    """Renderer of the XML documents for a Routing Service.
+
+    The services of the data center (type, address and priority) are compiled
+    once into the template of a route, so that rendering a route is a single
+    string formatting with the codes and the time window. The same renderer
+    is shared by networks, stations and virtual networks.
+    """
+
+    # Services of GEOFON, used if none is configured
+    defaultservices = [('station', 'https://geofon.gfz.de/fdsnws/station/1/query', 1),
+                       ('wfcatalog', 'https://geofon.gfz.de/eidaws/wfcatalog/1/query', 1),
+                       ('dataselect', 'https://geofon.gfz.de/fdsnws/dataselect/1/query', 1),
+                       ('availability', 'https://geofon.gfz.de/fdsnws/availability/1/query', 1)]
+
+    # Headers and footers of the documents
+    header = """<?xml version="1.0" encoding="utf-8"?>
+  <ns0:routing xmlns:ns0="http://geofon.gfz-potsdam.de/ns/Routing/1.0/">
+            """
+    vheader = """<?xml version="1.0" encoding="utf-8"?>
+     <ns0:routing xmlns:ns0="http://geofon.gfz-potsdam.de/ns/Routing/1.0/">
+               """
+    vnetheader = """<?xml version="1.0" encoding="utf-8"?>
+     <ns0:routing xmlns:ns0="http://geofon.gfz-potsdam.de/ns/Routing/1.0/">
+     <ns0:vnetwork networkCode="%s">
+               """
+    footer = """</ns0:routing>"""
+
+    def __init__(self, services: list = None):
+        """Constructor of the RoutingXML class.
+
+        :param services: Type, address and priority of the services in every route
+        :type services: list
+        :raises: ValueError
+        """
+        self.services = list()
+        for service, address, priority in (services if services is not None else self.defaultservices):
+            if re.fullmatch(r'[A-Za-z_][\w.-]*', service) is None:
+                raise ValueError('Wrong type of service: %s' % service)
+            self.services.append((service, address, int(priority)))
+        if not len(self.services):
+            raise ValueError('At least one service is needed in the routes')
+
+        self.template = self.__compile()
+        self.repeat = len(self.services)
+        # Templates with the priority of all services changed (e.g. by the rules of the routing document)
+        self.__templates = {None: self.template}
+
+    def __compile(self, priority: int = None) -> str:
+        # Template of a route with the codes in the first two positions and the
+        # time window repeated for every service
+        lines = ['  <ns0:%s address=%s priority="%d" start="%%s" end="%%s" />\n' %
+                 (service, quoteattr(address).replace('%', '%%'), priority if priority is not None else prio)
+                 for service, address, prio in self.services]
+        return ('\n <ns0:route networkCode="%s" stationCode="%s" locationCode="*" streamCode="*">\n' +
+                ''.join(lines) + ' </ns0:route>\n ')
+
+    @classmethod
+    def fromconfig(cls, config: configparser.RawConfigParser) -> 'RoutingXML':
+        """Compile the renderer from the "services" option in the [Routing] section.
+
+        Every line of the option has the type of service, its address and
+        optionally its priority (1 by default).
+
+        :raises: ValueError
+        """
+        lines = config.get('Routing', 'services', fallback='').strip()
+        if not len(lines):
+            return cls()
+
+        services = []
+        for line in lines.splitlines():
+            parts = line.split()
+            if len(parts) not in (2, 3):
+                raise ValueError('Wrong service in the routing configuration: %s' % line)
+            services.append((parts[0], parts[1], int(parts[2]) if len(parts) == 3 else 1))
+        return cls(services)
+
+    def route(self, netcode: str, stacode: str, start: datetime.datetime, end: datetime.datetime,
+              priority: int = None) -> str:
+        """Render the route to a network (stacode="*") or to a station.
+
+        If priority is given, it replaces the priorities of all the services.
+        """
+        template = self.__templates.get(priority)
+        if template is None:
+            template = self.__templates.setdefault(priority, self.__compile(priority))
+        window = (start.isoformat(), end.isoformat() if end is not None else '')
+        return template % ((netcode, stacode) + window * self.repeat)
+
+    def routes(self, rows, stations: bool = False, size: int = 1000):
+        """Render a document with the routes to networks or stations in chunks of bytes.
+
+        :param rows: Networks (code, start, end) or stations (network, code, start, end)
+        :type rows: iterable
+        :param stations: Whether the rows are stations
+        :type stations: bool
+        :param size: Number of routes in every chunk
+        :type size: int
+        """
+        outxml = [self.header]
+        for row in rows:
+            if stations:
+                outxml.append(self.route(row['network'], row['code'], row['start'], row['end']))
+            else:
+                outxml.append(self.route(row['code'], '*', row['start'], row['end']))
+            if len(outxml) >= size:
+                yield ''.join(outxml).encode('utf-8')
+                outxml = []
+
+        outxml.append(self.footer)
+        yield ''.join(outxml).encode('utf-8')
+
+    def vnetworks(self, rows):
+        """Render a document with the virtual networks in chunks of bytes."""
+        outxml = [self.vheader]
+        for row in rows:
+            outxml.append('\n    <ns0:vnetwork networkCode="%s">\n    </ns0:vnetwork>\n    ' % row['code'])
+
+        outxml.append(self.footer)
+        yield ''.join(outxml).encode('utf-8')
+
+    @staticmethod
+    def stream(row: dict) -> str:
+        """Render a stream of a virtual network (network, station and start) without end."""
+        return ('<ns0:stream networkCode="%s" stationCode="%s" locationCode="*" streamCode="*" '
+                'start="%s" end="" />\n' % (row['network'], row['station'], row['start'].isoformat()))
+
+    def vnetwork(self, code: str, rows) -> str:
+        """Render a virtual network with its streams to be included in a document."""
+        return '\n<ns0:vnetwork networkCode="%s">\n%s</ns0:vnetwork>\n' % (code, ''.join(map(self.stream, rows)))
+
+    def vnetstreams(self, net: str, rows, size: int = 1000):
+        """Render a document with the streams of a virtual network in chunks of bytes.
+
+        The streams are listed without end.
+        """
+        outxml = [self.vnetheader % net]
+        for row in rows:
+            outxml.append(self.stream(row))
+            if len(outxml) >= size:
+                yield ''.join(outxml).encode('utf-8')
+                outxml = []
+
+        outxml.append('</ns0:vnetwork>\n' + self.footer)
+        yield ''.join(outxml).encode('utf-8')
+
+
+class RoutingRules(object):
+    """Rules to adapt the routing document, in the format of the rules.cfg of routesfromSC3.
+
+    [Networks] "skip", "priority2" and "priority3" list network codes (with
+    the start year if temporary, e.g. ZS_2017). [Stations] "include" lists
+    stations (NET.STA, where STA can be "*") to add routes to them, and
+    "skip", "priority2" and "priority3" stations to modify those routes.
+    [Virtualnets] "skip" lists virtual networks to leave out.
+    """
+
+    def __init__(self, text: str = ''):
+        """Constructor of the RoutingRules class.
+
+        :param text: Content of a rules.cfg file
+        :type text: str
+        :raises: ValueError
+        """
+        config = configparser.RawConfigParser()
+        try:
+            config.read_string(text)
+        except configparser.Error as e:
+            raise ValueError('Rules could not be parsed: %s' % e)
+
+        def codes(section: str, option: str) -> list:
+            if not config.has_option(section, option):
+                return []
+            return [x.strip() for x in config.get(section, option).split(',') if len(x.strip())]
+
+        self.nets2skip = set(codes('Networks', 'skip'))
+        self.priority2 = set(codes('Networks', 'priority2') + codes('Stations', 'priority2'))
+        self.priority3 = set(codes('Networks', 'priority3') + codes('Stations', 'priority3'))
+        self.stations2skip = set(codes('Stations', 'skip'))
+        self.vnets2skip = set(codes('Virtualnets', 'skip'))
+
+        # Stations to include with the matchers of their network and station codes
+        self.stations2add = list()
+        for netsta in codes('Stations', 'include'):
+            parts = netsta.split('.')
+            if len(parts) != 2:
+                raise ValueError('Wrong station to include: %s' % netsta)
+            netmatcher = CodeMatcher(parts[0], extended=True)
+            if any(istemporary(code) and year is None for code, year in netmatcher.exact):
+                raise ValueError('Temporary network without start year: %s' % netsta)
+            self.stations2add.append((netsta, netmatcher, CodeMatcher(parts[1])))
+
+        # Identifies the rules in the cache
+        self.digest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def fromfile(cls, filename: str) -> 'RoutingRules':
+        """Read the rules from a file."""
+        with open(filename, encoding='utf-8') as fin:
+            return cls(fin.read())
+
+    def priority(self, code: str) -> Union[int, None]:
+        """Priority of the routes to a network or station, or None to keep the configured one."""
+        if code in self.priority3:
+            return 3
+        if code in self.priority2:
+            return 2
+        return None
+
+
+class ResponseCache(LRUCache):
+    """Cache of the rendered responses of the listing methods.
+
+    Entries are indexed by method and parameters of the request and expire
+    after a time configured per method. All of them are removed when the
+    inventory changes.
+    """
+
+    def __init__(self, maxentries: int = 1000, maxbytes: int = 64 * 1024 * 1024, ttl: float = 300.0,
+                 ttls: dict = None):
+        """Constructor of the ResponseCache class.
+
+        :param ttls: Seconds before an entry expires for every method
+        :type ttls: dict
+        """
+        super().__init__(maxentries, maxbytes, ttl)
+        self.ttls = ttls if ttls is not None else dict()
+
+    @staticmethod
+    def key(endpoint: str, **params) -> tuple:
+        """Build a canonical key from the method and the parameters of a request."""
+        return (endpoint,) + tuple(sorted((k, str(v)) for k, v in params.items() if v is not None))
+
+    def setresponse(self, key: tuple, contenttype: str, body: bytes, headers: dict = None):
+        """Save a rendered response (and its extra headers) with the expiration time of its method."""
+        self.set(key, (contenttype, body, headers if headers is not None else dict()),
+                 ttl=self.ttls.get(key[0], self.ttl), size=len(body))
+
+    def tee(self, key: tuple, contenttype: str, chunks, headers: dict = None):
+        """Pass through the chunks of a streamed response and save it when it is complete.
+
+        The response is not saved if it is larger than the cache or if the
+        cache was invalidated while it was being sent.
+        """
+        generation = self.generation
+        body = list()
+        size = 0
+        for chunk in chunks:
+            if body is not None:
+                size += len(chunk)
+                if size <= self.maxbytes:
+                    body.append(chunk)
+                else:
+                    # Too large to be saved
+                    body = None
+            yield chunk
+
+        if body is not None and generation == self.generation:
+            self.setresponse(key, contenttype, b''.join(body), headers)
+
+
+class AccessCache(LRUCache):
+    """Cache of access decisions with a different expiration time per result.
+
+    Decisions granting access, denying it and the ones about networks not
+    found (or ambiguous) expire after independent periods. All of them are
+    removed when the Access or Network tables change.
+    """
+
+    def __init__(self, maxentries: int = 10000, allow: float = 300.0, deny: float = 60.0,
+                 notfound: float = 60.0):
+        """Constructor of the AccessCache class.
+
+        :param maxentries: Maximum number of decisions in the cache
+        :type maxentries: int
+        :param allow: Seconds before a decision granting access expires
+        :type allow: float
+        :param deny: Seconds before a decision denying access expires
+        :type deny: float
+        :param notfound: Seconds before a decision about an unknown network expires
+        :type notfound: float
+        """
+        super().__init__(maxentries=maxentries, ttl=allow)
+        self.ttls = {'denied': deny, 'notfound': notfound, 'ambiguous': notfound}
+
+    def setdecision(self, key: tuple, decision: str):
+        """Save a decision with the expiration time corresponding to its result."""
+        self.set(key, decision, ttl=self.ttls.get(decision, self.ttl))
+
+
+class CodeMatcher(object):
+    """Selector of codes given as a comma-separated list with FDSN wildcards.
+
+    Every item is an exact code or a pattern where "*" stands for any
+    sequence of characters and "?" for exactly one character. If extended
+    is True, items with an underscore select temporary networks by their
+    code and start year (e.g. 4C_2011, ZS_201?).
+    """
+
+    def __init__(self, selector: str, extended: bool = False):
+        """Constructor of the CodeMatcher class.
+
+        :param selector: List of codes and patterns separated by commas
+        :type selector: str
+        :param extended: Split the items in code and start year
+        :type extended: bool
+        :raises: ValueError
+        """
+        # Pairs (code, year) without wildcards. year is None if not given
+        self.exact = list()
+        # Pairs (code, year) with wildcards and their regular expressions
+        self.patterns = list()
+        self.regexes = list()
+        for item in selector.split(','):
+            item = item.strip()
+            code, year = item.split('_', 1) if extended and '_' in item else (item, None)
+            if not len(code) or (year is not None and not re.fullmatch('[0-9*?]+', year)):
+                raise ValueError('Wrong code in selector (%s)' % item)
+            # Only temporary networks have a year in their code
+            if year is not None and not istemporary(code) and not self.iswildcard(code):
+                code, year = item, None
+            if year is not None and not self.iswildcard(year):
+                year = str(int(year))
+                if not 0 < int(year) < 9999:
+                    raise ValueError('Wrong year in selector (%s)' % item)
+            if self.iswildcard(code) or (year is not None and self.iswildcard(year)):
+                self.patterns.append((code, year))
+                self.regexes.append((self.__regex(code), self.__regex(year) if year is not None else None))
+            else:
+                self.exact.append((code, year))
+
+    @staticmethod
+    def iswildcard(code: str) -> bool:
+        """Check whether a code includes a wildcard."""
+        return '*' in code or '?' in code
+
+    @staticmethod
+    def __regex(pattern: str):
+        return re.compile(''.join('.*' if c == '*' else '.' if c == '?' else re.escape(c) for c in pattern))
+
+    @staticmethod
+    def __like(pattern: str) -> str:
+        return ''.join('%' if c == '*' else '_' if c == '?' else '!' + c if c in '!%_' else c for c in pattern)
+
+    def match(self, code: str, year: int = None) -> bool:
+        """Check whether a code (and start year) is selected.
+
+        :param code: Code to check
+        :type code: str
+        :param year: Start year of the network
+        :type year: int
+        :returns: True if any of the items matches
+        :rtype: bool
+        """
+        year = str(year) if year is not None else None
+        for excode, exyear in self.exact:
+            if excode == code and (exyear is None or exyear == year):
+                return True
+        for regcode, regyear in self.regexes:
+            if regcode.fullmatch(code) and (regyear is None or (year is not None and regyear.fullmatch(year))):
+                return True
+        return False
+
+    def codes(self, available) -> list:
+        """Return the codes from an index which could be selected, sorted.
+
+        :param available: Codes to choose from (e.g. the keys of an index by code)
+        :type available: iterable
+        :returns: Codes selected by the exact items or matching a pattern
+        :rtype: list
+        """
+        result = set(code for code, year in self.exact if code in available)
+        if len(self.patterns):
+            result.update(code for code in available if any(regcode.fullmatch(code) for regcode, _ in self.regexes))
+        return sorted(result)
+
+    def sqlclause(self, codecol: str, startcol: str = None) -> tuple:
+        """Build a single SQL condition selecting the same codes.
+
+        :param codecol: Column with the code
+        :type codecol: str
+        :param startcol: Column with the start time (for items with a year)
+        :type startcol: str
+        :returns: Condition and the variables it needs
+        :rtype: tuple
+        """
+        clauses = list()
+        variables = list()
+        plain = [code for code, year in self.exact if year is None]
+        if len(plain) == 1:
+            clauses.append('%s=%%s' % codecol)
+            variables.extend(plain)
+        elif len(plain):
+            clauses.append('%s in (%s)' % (codecol, ', '.join(['%s'] * len(plain))))
+            variables.extend(plain)
+
+        for code, year in self.exact:
+            if year is None:
+                continue
+            # Range of the start year instead of YEAR() to be able to use an index
+            clauses.append('(%s=%%s and %s>=%%s and %s<%%s)' % (codecol, startcol, startcol))
+            variables.extend([code, datetime.datetime(int(year), 1, 1), datetime.datetime(int(year) + 1, 1, 1)])
+
+        for code, year in self.patterns:
+            clause = ["%s like %%s escape '!'" % codecol]
+            variables.append(self.__like(code))
+            if year is not None and self.iswildcard(year):
+                clause.append('YEAR(%s) like %%s' % startcol)
+                variables.append(self.__like(year))
+            elif year is not None:
+                clause.append('%s>=%%s and %s<%%s' % (startcol, startcol))
+                variables.extend([datetime.datetime(int(year), 1, 1), datetime.datetime(int(year) + 1, 1, 1)])
+            clauses.append(clause[0] if len(clause) == 1 else '(%s)' % ' and '.join(clause))
+
+        if len(clauses) == 1:
+            return clauses[0], variables
+        return '(%s)' % ' or '.join(clauses), variables
+
+
+class EpochIndex(object):
+    """Static interval tree over epochs, including open-ended ones.
+
+    Epochs are sorted by start and kept as an implicit balanced binary tree
+    (the middle element of every range is the root of its subtree). Every
+    node knows the maximum end in its subtree, so that whole branches ending
+    before the time window can be skipped. Finding the k epochs overlapping
+    a window takes O(log n + k).
+    """
+
+    def __init__(self, epochs: list):
+        """Constructor of the EpochIndex class.
+
+        :param epochs: Tuples (start, end, oid). end is None for open epochs
+        :type epochs: list
+        """
+        epochs = sorted((start, end if end is not None else datetime.datetime.max, oid)
+                        for start, end, oid in epochs)
+        self.starts = [epoch[0] for epoch in epochs]
+        self.ends = [epoch[1] for epoch in epochs]
+        self.oids = [epoch[2] for epoch in epochs]
+        self.maxends = list(self.ends)
+        self.__build(0, len(epochs))
+
+    def __build(self, lo: int, hi: int) -> datetime.datetime:
+        if lo >= hi:
+            return datetime.datetime.min
+        mid = (lo + hi) // 2
+        self.maxends[mid] = max(self.ends[mid], self.__build(lo, mid), self.__build(mid + 1, hi))
+        return self.maxends[mid]
+
+    def overlap(self, starttime: datetime.datetime = None, endtime: datetime.datetime = None) -> list:
+        """Return the oids of the epochs overlapping a time window, sorted.
+
+        :param starttime: Start of the window (None for no limit)
+        :type starttime: datetime
+        :param endtime: End of the window (None for no limit)
+        :type endtime: datetime
+        :returns: Identifiers of the epochs with start<=endtime and end>=starttime
+        :rtype: list
+        """
+        starttime = starttime if starttime is not None else datetime.datetime.min
+        # Only epochs starting before the end of the window can overlap
+        hi = bisect.bisect_right(self.starts, endtime) if endtime is not None else len(self.starts)
+
+        result = list()
+        pending = [(0, len(self.starts))]
+        while len(pending):
+            lo, top = pending.pop()
+            if lo >= top:
+                continue
+            mid = (lo + top) // 2
+            if self.maxends[mid] < starttime:
+                continue
+            pending.append((lo, mid))
+            if mid < hi:
+                if self.ends[mid] >= starttime:
+                    result.append(self.oids[mid])
+                pending.append((mid + 1, top))
+        return sorted(result)
+
+    def active(self, when: datetime.datetime) -> list:
+        """Return the oids of the epochs active at a given time, sorted."""
+        return self.overlap(when, when)
+
+
+class GeoIndex(object):
+    """Grid of cells of one degree with the stations located in each of them.
+
+    A geographic query only visits the cells intersecting the requested box,
+    so its cost depends on the size of the answer and not on the total
+    number of stations.
+    """
+
+    def __init__(self, points: list):
+        """Constructor of the GeoIndex class.
+
+        :param points: Tuples (latitude, longitude, oid)
+        :type points: list
+        """
+        self.cells = dict()
+        for lat, lon, oid in points:
+            if lat is None or lon is None:
+                continue
+            self.cells.setdefault(self.__cell(lat, lon), []).append((lat, lon, oid))
+
+    @staticmethod
+    def __cell(lat: float, lon: float) -> tuple:
+        return min(int(math.floor(lat)), 89), min(int(math.floor(lon)), 179)
+
+    def __points(self, minlat: float, maxlat: float, minlon: float, maxlon: float) -> list:
+        lat1, lon1 = self.__cell(minlat if minlat is not None else -90.0, minlon if minlon is not None else -180.0)
+        lat2, lon2 = self.__cell(maxlat if maxlat is not None else 90.0, maxlon if maxlon is not None else 180.0)
+        if minlon is None or maxlon is None or minlon <= maxlon:
+            lonrange = list(range(lon1, lon2 + 1))
+        elif lon1 <= lon2:
+            # The box crosses the dateline and both ends are in the same column. All columns are visited
+            lonrange = list(range(-180, 180))
+        else:
+            # The box crosses the dateline. From the west end to 180 and from -180 to the east end
+            lonrange = list(range(lon1, 180)) + list(range(-180, lon2 + 1))
+
+        if (lat2 - lat1 + 1) * len(lonrange) > len(self.cells):
+            # Cheaper to visit the cells with stations than the ones in the box
+            cells = self.cells.values()
+        else:
+            cells = [self.cells[(x, y)] for x in range(lat1, lat2 + 1) for y in lonrange if (x, y) in self.cells]
+
+        return [point for cell in cells for point in cell
+                if inbox(point[0], point[1], minlat, maxlat, minlon, maxlon)]
+
+    def box(self, minlat: float = None, maxlat: float = None, minlon: float = None, maxlon: float = None) -> list:
+        """Return the oids of the points inside a box, sorted.
+
+        :param minlat: Minimum latitude
+        :type minlat: float
+        :param maxlat: Maximum latitude
+        :type maxlat: float
+        :param minlon: Minimum longitude
+        :type minlon: float
+        :param maxlon: Maximum longitude (smaller than minlon if the box crosses the dateline)
+        :type maxlon: float
+        :returns: Identifiers of the points inside the box
+        :rtype: list
+        """
+        return sorted(oid for lat, lon, oid in self.__points(minlat, maxlat, minlon, maxlon))
+
+    def near(self, lat: float, lon: float, maxradius: float) -> list:
+        """Return the oids of the points within a distance of a given point, sorted.
+
+        :param lat: Latitude of the centre
+        :type lat: float
+        :param lon: Longitude of the centre
+        :type lon: float
+        :param maxradius: Distance in km
+        :type maxradius: float
+        :returns: Identifiers of the points within the distance
+        :rtype: list
+        """
+        return sorted(oid for pointlat, pointlon, oid in self.__points(*radiusbox(lat, lon, maxradius))
+                      if distance(lat, lon, pointlat, pointlon) <= maxradius)
+
+
+class InventorySnapshot(object):
+    """Read-only copy of the inventory tables kept in memory.
+
+    Networks, stations and virtual networks are indexed by their code, so that
+    the filters of the API can be answered without querying the DB. A snapshot
+    is never modified after being created. A new one replaces it when the
+    inventory is refreshed.
+    """
+
+    netfields = ['code', 'start', 'end', 'netClass', 'archive', 'restricted', 'shared']
+    stafields = ['network', 'code', 'latitude', 'longitude', 'elevation',
+                 'place', 'country', 'start', 'end', 'restricted', 'shared']
+    vnetfields = ['code', 'start', 'end', 'type']
+    vnetstafields = ['network', 'station', 'start', 'end']
+
+    # Table in the DB, attribute where its rows are kept and query to read them
+    tables = {
+        'Network': ('netrows', 'select T._oid, code, start, end, netClass, archive, restricted, shared '
+                               'from Network as T'),
+        'Station': ('starows', 'select T._oid, T._parent_oid, code, latitude, longitude, elevation, place, '
+                               'country, start, end, restricted, shared, archive from Station as T'),
+        'StationGroup': ('vnetrows', 'select T._oid, code, start, end, type from StationGroup as T'),
+        'StationReference': ('refrows', 'select T._oid, T._parent_oid as vnet, po._oid as station '
+                                        'from StationReference as T join PublicObject as po '
+                                        'on po.publicID = T.stationID'),
+    }
+
+    def __init__(self, netrows: dict, starows: dict, vnetrows: dict, refrows: dict):
+        """Constructor of the InventorySnapshot class.
+
+        :param netrows: Rows from the Network table indexed by _oid
+        :type netrows: dict
+        :param starows: Rows from the Station table indexed by _oid
+        :type starows: dict
+        :param vnetrows: Rows from the StationGroup table indexed by _oid
+        :type vnetrows: dict
+        :param refrows: Rows from the StationReference table (vnet and station _oids) indexed by _oid
+        :type refrows: dict
+        """
+        self.netrows = netrows
+        self.starows = starows
+        self.vnetrows = vnetrows
+        self.refrows = refrows
+        self.loaded = datetime.datetime.now(datetime.timezone.utc)
+
+        # Indexes by code and by parent in the order of the DB (_oid). Stations are sorted by key below
+        self.netoids = sorted(netrows)
+        self.netbycode = dict()
+        # Extended codes (e.g. 4C_2011) for a direct lookup of temporary networks
+        self.netbyext = dict()
+        for oid in self.netoids:
+            self.netbycode.setdefault(netrows[oid]['code'], []).append(oid)
+            self.netbyext.setdefault(extendedcode(netrows[oid]['code'], netrows[oid]['start']), []).append(oid)
+
+        self.staoids = sorted(starows)
+        self.stabynet = dict()
+        self.stabycode = dict()
+        for oid in self.staoids:
+            self.stabynet.setdefault(starows[oid]['_parent_oid'], []).append(oid)
+            self.stabycode.setdefault(starows[oid]['code'], []).append(oid)
+
+        self.vnetoids = sorted(vnetrows)
+        self.vnetbycode = dict()
+        for oid in self.vnetoids:
+            self.vnetbycode.setdefault(vnetrows[oid]['code'], []).append(oid)
+
+        # Keys of the keyset pagination (same as the "order by" of the queries) and
+        # the _oids sorted by them, so that a page is found with a binary search.
+        # The _oid makes every key unique. The lists of stations by network and by
+        # code are also kept in this order
+        self.netkeys = {oid: (row['code'], row['start'], oid) for oid, row in netrows.items()}
+        self.netorder = sorted(netrows, key=self.netkeys.__getitem__)
+        self.stakeys = dict()
+        for oid, row in starows.items():
+            parent = netrows.get(row['_parent_oid'])
+            self.stakeys[oid] = (parent['code'] if parent is not None else '', row['code'], row['start'],
+                                 parent['start'] if parent is not None else None, oid)
+        self.staorder = sorted(starows, key=self.stakeys.__getitem__)
+        for oids in itertools.chain(self.stabynet.values(), self.stabycode.values()):
+            oids.sort(key=self.stakeys.__getitem__)
+        self.vnetkeys = {oid: (row['code'], row['start'], oid) for oid, row in vnetrows.items()}
+        self.vnetorder = sorted(vnetrows, key=self.vnetkeys.__getitem__)
+
+        # Epochs to find the ones overlapping a time window
+        self.netepochs = EpochIndex([(row['start'], row['end'], oid) for oid, row in netrows.items()])
+        self.staepochs = EpochIndex([(row['start'], row['end'], oid) for oid, row in starows.items()])
+        self.vnetepochs = EpochIndex([(row['start'], row['end'], oid) for oid, row in vnetrows.items()])
+
+        # Location of the stations for geographic queries
+        self.stagrid = GeoIndex([(row['latitude'], row['longitude'], oid) for oid, row in starows.items()])
+
+        # Stations in every virtual network
+        self.members = dict()
+        for oid in sorted(refrows):
+            self.members.setdefault(refrows[oid]['vnet'], []).append(refrows[oid]['station'])
+
+    @classmethod
+    def load(cls, conn: SC3dbconnection):
+        """Read the inventory tables from the DB and create a snapshot.
+
+        :param conn: Connection to the SC3 database
+        :type conn: SC3dbconnection
+        :returns: A new snapshot with the current content of the DB
+        :rtype: InventorySnapshot
+        """
+        rows = dict()
+        for table, (attr, query) in cls.tables.items():
+            conn.execute(query, [], serverside=True)
+            rows[attr] = {row['_oid']: row for row in conn.iterrows()}
+
+        return cls(**rows)
+
+    def update(self, conn: SC3dbconnection, changes: dict):
+        """Create a new snapshot applying only the rows which changed in the DB.
+
+        Only the rows modified or added after the previous signature of every
+        table are read. The list of _oids is read only if rows were deleted.
+
+        :param conn: Connection to the SC3 database
+        :type conn: SC3dbconnection
+        :param changes: Previous and current signatures of the modified tables
+        :type changes: dict
+        :returns: A new snapshot with the changes applied
+        :rtype: InventorySnapshot
+        """
+        rows = {attr: getattr(self, attr) for attr, query in self.tables.values()}
+
+        for table, (old, new) in changes.items():
+            attr, query = self.tables[table]
+            # Copy on write. The current snapshot could be in use
+            rows[attr] = dict(rows[attr])
+
+            if old is None or old['lastmod'] is None:
+                conn.execute(query, [])
+                rows[attr] = {row['_oid']: row for row in conn.fetchall()}
+                continue
+
+            conn.execute(query + ' where T._last_modified>=%s or T._oid>%s',
+                         [old['lastmod'], old['maxoid'] or 0])
+            delta = conn.fetchall()
+            for row in delta:
+                rows[attr][row['_oid']] = row
+
+            deleted = set()
+            if len(rows[attr]) != new['howmany']:
+                conn.execute('select _oid from {}'.format(table), [])
+                deleted = set(rows[attr]) - {row['_oid'] for row in conn.fetchall()}
+                for oid in deleted:
+                    del rows[attr][oid]
+
+            logging.getLogger('Inventory').debug('{}: {} rows updated, {} deleted'.format(
+                table, len(delta), len(deleted)))
+
+        return InventorySnapshot(**rows)
+
+    @staticmethod
+    def _inwindow(row: dict, starttime: datetime.datetime, endtime: datetime.datetime,
+                  overlap: bool = False) -> bool:
+        if overlap:
+            # Same semantic as "start<=%s and (end>=%s or end is NULL)" in SQL
+            if endtime is not None and row['start'] > endtime:
+                return False
+            if starttime is not None and row['end'] is not None and row['end'] < starttime:
+                return False
+            return True
+
+        # Same semantic as "start>=%s and end<=%s" in SQL (NULL never matches)
+        if starttime is not None and row['start'] < starttime:
+            return False
+        if endtime is not None and (row['end'] is None or row['end'] > endtime):
+            return False
+        return True
+
+    @staticmethod
+    def _merged(groups: list, keys: dict, after: tuple = None):
+        """Iterate over lists of _oids sorted by key, merged and starting after a given key."""
+        iterators = list()
+        for group in groups:
+            # Binary search of the first _oid with a key greater than "after"
+            lo, hi = 0, len(group)
+            while after is not None and lo < hi:
+                mid = (lo + hi) // 2
+                if keys[group[mid]] <= after:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            iterators.append(map(group.__getitem__, range(lo, len(group))))
+        return iterators[0] if len(iterators) == 1 else heapq.merge(*iterators, key=keys.__getitem__)
+
+    @staticmethod
+    def _keyorder(oids: list, keys: dict, after: tuple = None):
+        """Iterate over unsorted _oids in the order of their keys, starting after a given key.
+
+        A heap is used, so only the _oids actually consumed are sorted.
+        """
+        heap = [(keys[oid], oid) for oid in oids if after is None or keys[oid] > after]
+        heapq.heapify(heap)
+        while heap:
+            yield heapq.heappop(heap)[1]
+
+    def _ordered(self, oids: list, groups: list, keys: dict, after: list = None):
+        """Iterate over the candidates in the order of the keyset pagination after a given key.
+
+        :param oids: Candidates in any order
+        :type oids: list
+        :param groups: Lists sorted by key with the same _oids as the candidates or None
+        :type groups: list
+        """
+        after = tuple(after) if after is not None else None
+        if groups is not None:
+            return self._merged(groups, keys, after)
+        return self._keyorder(oids, keys, after)
+
+    @staticmethod
+    def _page(rows, limit: int = None) -> list:
+        # One extra row is returned to know whether there is a next page
+        return list(itertools.islice(rows, limit + 1)) if limit is not None else list(rows)
+
+    def _netoids(self, matcher: CodeMatcher) -> list:
+        oids = set()
+        for code, year in matcher.exact:
+            # Temporary networks are found by their extended code
+            oids.update(self.netbycode.get(code, []) if year is None else self.netbyext.get('%s_%s' % (code, year), []))
+        if len(matcher.patterns):
+            oids.update(oid for code in matcher.codes(self.netbycode) for oid in self.netbycode[code]
+                        if matcher.match(code, self.netrows[oid]['start'].year))
+        return sorted(oids)
+
+    def getnetworks(self, code: CodeMatcher = None, restricted: int = None, archive: str = None,
+                    netclass: str = None, shared: int = None, starttime: datetime.datetime = None,
+                    endtime: datetime.datetime = None, overlap: bool = False, after: list = None,
+                    limit: int = None) -> list:
+        """Return the networks matching the filters with the same fields as the Network table.
+
+        The networks are sorted by (code, start, _oid). If "after" or "limit" are
+        given, only the page after the key "after" is returned, with one extra
+        network, and the _oid is included in the rows.
+        """
+        groups = None
+        if code is not None:
+            oids = self._netoids(code)
+        elif overlap and (starttime is not None or endtime is not None):
+            oids = self.netepochs.overlap(starttime, endtime)
+        else:
+            oids = self.netoids
+            groups = [self.netorder]
+
+        # Always in the order of the key, as in the queries
+        oids = self._ordered(oids, groups, self.netkeys, after)
+        paged = after is not None or limit is not None
+
+        return self._page(self.__networks(oids, restricted, archive, netclass, shared, starttime, endtime,
+                                          overlap, paged), limit)
+
+    def __networks(self, oids, restricted: int, archive: str, netclass: str, shared: int,
+                   starttime: datetime.datetime, endtime: datetime.datetime, overlap: bool, paged: bool):
+        for oid in oids:
+            net = self.netrows[oid]
+            if restricted is not None and net['restricted'] != restricted:
+                continue
+            if archive is not None and net['archive'] != archive:
+                continue
+            if netclass is not None and net['netClass'] != netclass:
+                continue
+            if shared is not None and net['shared'] != shared:
+                continue
+            if not self._inwindow(net, starttime, endtime, overlap):
+                continue
+            row = {field: net[field] for field in self.netfields}
+            if paged:
+                row['_oid'] = oid
+            yield row
+
+    def getstations(self, net: CodeMatcher = None, sta: CodeMatcher = None, restricted: int = None,
+                    archive: str = None, shared: int = None, starttime: datetime.datetime = None,
+                    endtime: datetime.datetime = None, overlap: bool = False, region: tuple = None,
+                    circle: tuple = None, netstart: bool = False, after: list = None,
+                    limit: int = None) -> list:
+        """Return the stations matching the filters with the fields of the "station" method.
+
+        region is a tuple (minlat, maxlat, minlon, maxlon) and circle a tuple (lat, lon, maxradius).
+        The stations are sorted by (network, code, start, netstart, _oid). If "after"
+        or "limit" are given, only the page after the key "after" is returned, with
+        one extra station, and the netstart and _oid are included in the rows.
+
+        :param netstart: Include also the start of the network epoch the station belongs to
+        :type netstart: bool
+        """
+        groups = None
+        if net is not None:
+            groups = [self.stabynet.get(netoid, []) for netoid in self._netoids(net)]
+            oids = sorted(oid for group in groups for oid in group)
+        elif sta is not None:
+            groups = [self.stabycode[code] for code in sta.codes(self.stabycode)]
+            oids = sorted(oid for group in groups for oid in group)
+        elif circle is not None:
+            oids = self.stagrid.near(*circle)
+        elif region is not None:
+            oids = self.stagrid.box(*region)
+        elif overlap and (starttime is not None or endtime is not None):
+            oids = self.staepochs.overlap(starttime, endtime)
+        else:
+            oids = self.staoids
+            groups = [self.staorder]
+
+        # Always in the order of the key, as in the queries
+        oids = self._ordered(oids, groups, self.stakeys, after)
+        paged = after is not None or limit is not None
+
+        return self._page(self.__stations(oids, sta, restricted, archive, shared, starttime, endtime, overlap,
+                                          region, circle, netstart or paged, paged), limit)
+
+    def __stations(self, oids, sta: CodeMatcher, restricted: int, archive: str, shared: int,
+                   starttime: datetime.datetime, endtime: datetime.datetime, overlap: bool, region: tuple,
+                   circle: tuple, netstart: bool, paged: bool):
+        for oid in oids:
+            station = self.starows[oid]
+            network = self.netrows.get(station['_parent_oid'])
+            if network is None:
+                continue
+            if sta is not None and not sta.match(station['code']):
+                continue
+            if restricted is not None and station['restricted'] != restricted:
+                continue
+            if archive is not None and station['archive'] != archive:
+                continue
+            if shared is not None and station['shared'] != shared:
+                continue
+            if not self._inwindow(station, starttime, endtime, overlap):
+                continue
+            if region is not None and not inbox(station['latitude'], station['longitude'], *region):
+                continue
+            if circle is not None and (not inbox(station['latitude'], station['longitude']) or
+                                       distance(circle[0], circle[1], station['latitude'],
+                                                station['longitude']) > circle[2]):
+                continue
+            row = {field: (network['code'] if field == 'network' else station[field]) for field in self.stafields}
+            if netstart:
+                row['netstart'] = network['start']
+            if paged:
+                row['_oid'] = oid
+            yield row
+
+    def getvnets(self, code: CodeMatcher = None, typevn: str = None, starttime: datetime.datetime = None,
+                 endtime: datetime.datetime = None, overlap: bool = False, after: list = None,
+                 limit: int = None) -> list:
+        """Return the virtual networks matching the filters.
+
+        The virtual networks are sorted by (code, start, _oid). If "after" or "limit"
+        are given, only the page after the key "after" is returned, with one extra
+        virtual network, and the _oid is included in the rows.
+        """
+        groups = None
+        if code is not None:
+            oids = sorted(oid for vnet in code.codes(self.vnetbycode) for oid in self.vnetbycode[vnet])
+        elif overlap and (starttime is not None or endtime is not None):
+            oids = self.vnetepochs.overlap(starttime, endtime)
+        else:
+            oids = self.vnetoids
+            groups = [self.vnetorder]
+
+        # Always in the order of the key, as in the queries
+        oids = self._ordered(oids, groups, self.vnetkeys, after)
+        paged = after is not None or limit is not None
+
+        return self._page(self.__vnets(oids, typevn, starttime, endtime, overlap, paged), limit)
+
+    def __vnets(self, oids, typevn: str, starttime: datetime.datetime, endtime: datetime.datetime,
+                overlap: bool, paged: bool):
+        for oid in oids:
+            vnet = self.vnetrows[oid]
+            if typevn is not None and vnet['type'] != typevn:
+                continue
+            if not self._inwindow(vnet, starttime, endtime, overlap):
+                continue
+            row = {field: vnet[field] for field in self.vnetfields}
+            if paged:
+                row['_oid'] = oid
+            yield row
+
+    def getvnetstations(self, code: str, coordinates: bool = False) -> list:
+        """Return the stations which are members of a virtual network.
+
+        :param coordinates: Include also the latitude and longitude of the stations
+        :type coordinates: bool
+        """
+        result = []
+        for oid in self.vnetbycode.get(code, []):
+            for staoid in self.members.get(oid, []):
+                station = self.starows.get(staoid)
+                if station is None or station['_parent_oid'] not in self.netrows:
+                    continue
+                row = {'network': self.netrows[station['_parent_oid']]['code'],
+                       'station': station['code'],
+                       'start': station['start'],
+                       'end': station['end']}
+                if coordinates:
+                    row['latitude'] = station['latitude']
+                    row['longitude'] = station['longitude']
+                result.append(row)
+        return result
+
+
+class Entitlements(object):
+    """In-memory index of the Access table to decide about access without the DB.
+
+    Grants are indexed by the "user" column, lowercased because LIKE is case
+    insensitive in MySQL. As a grant applies if the user is a substring of
+    the email, the candidates for an email are found by looking up all its
+    substrings with the lengths present in the index. Users with LIKE
+    wildcards are kept apart as compiled patterns.
+
+    For each user and N.S.L.C code the time windows are sorted by start and
+    keep the maximum end seen so far, so that a check is a binary search.
+    """
+
+    def __init__(self, networks: list, grants: list):
+        """Constructor of the Entitlements class.
+
+        :param networks: Rows from Network (code, start, end, restricted)
+        :type networks: list
+        :param grants: Rows from Access
+        :type grants: list
+        """
+        self.networks = dict()
+        for net in networks:
+            self.networks.setdefault(net['code'], []).append(net)
+
+        byuser = dict()
+        for grant in grants:
+            key = (grant['networkCode'], grant['stationCode'], grant['locationCode'], grant['streamCode'])
+            user = (grant['user'] or '').lower()
+            byuser.setdefault(user, dict()).setdefault(key, []).append(grant)
+
+        self.byuser = dict()
+        self.patterns = list()
+        for user, keys in byuser.items():
+            index = {key: self.__intervals(rows) for key, rows in keys.items()}
+            if '%' in user or '_' in user:
+                regex = '.*'.join('.'.join(re.escape(part) for part in chunk.split('_'))
+                                  for chunk in user.split('%'))
+                self.patterns.append((re.compile(regex), index))
+            else:
+                self.byuser[user] = index
+
+        self.lengths = sorted({len(user) for user in self.byuser})
+        self.grants = grants
+
+    @staticmethod
+    def __intervals(rows: list) -> tuple:
+        rows = sorted(rows, key=lambda row: row['start'])
+        starts = [row['start'] for row in rows]
+        maxends = list()
+        maxend = None
+        for row in rows:
+            end = row['end'] if row['end'] is not None else datetime.datetime.max
+            maxend = end if maxend is None else max(maxend, end)
+            maxends.append(maxend)
+        return starts, maxends, rows
+
+    @staticmethod
+    def _granted(intervals: tuple, starttime: datetime.datetime, endtime: datetime.datetime) -> bool:
+        # Is there a grant with start<=starttime and end>=endtime?
+        starts, maxends, rows = intervals
+        pos = bisect.bisect_right(starts, starttime) if starttime is not None else len(starts)
+        if not pos:
+            return False
+        return endtime is None or maxends[pos - 1] >= endtime
+
+    @classmethod
+    def load(cls, conn: SC3dbconnection):
+        """Read the Access and Network tables from the DB and build the index.
+
+        :param conn: Connection to the SC3 database
+        :type conn: SC3dbconnection
+        :returns: A new index with the current content of the DB
+        :rtype: Entitlements
+        """
+        conn.execute('select code, start, end, restricted from Network', [])
+        networks = conn.fetchall()
+        conn.execute('select networkCode, stationCode, locationCode, streamCode, user, start, end '
+                     'from Access', [])
+        grants = conn.fetchall()
+        return cls(networks, grants)
+
+    def indexes(self, email: str) -> list:
+        """Return the grants (indexed by N.S.L.C) of all users matching an email."""
+        email = email.lower()
+        result = list()
+        for length in self.lengths:
+            for user in {email[pos:pos + length] for pos in range(len(email) - length + 1)}:
+                if user in self.byuser:
+                    result.append(self.byuser[user])
+        result.extend(index for regex, index in self.patterns if regex.search(email))
+        return result
+
+    def decide(self, email: str, net: str, sta: str = '', loc: str = '', cha: str = '',
+               starttime: datetime.datetime = None, endtime: datetime.datetime = None) -> str:
+        """Decide whether a user has access to a stream.
+
+        :returns: 'open', 'network', 'station', 'channel', 'denied', 'notfound' or 'ambiguous'
+        :rtype: str
+        """
+        # Check the epochs of the network first
+        decision = accessdecision(self.networks.get(net, []), [], starttime=starttime, endtime=endtime)
+        if decision != 'denied':
+            return decision
+
+        keys = [('network', (net, '', '', ''))]
+        if len(sta):
+            keys.append(('station', (net, sta, '', '')))
+        if len(cha):
+            keys.append(('channel', (net, sta, loc, cha)))
+
+        indexes = self.indexes(email)
+        for level, key in keys:
+            for index in indexes:
+                if key in index and self._granted(index[key], starttime, endtime):
+                    return level
+
+        return 'denied'
+
+
+class ChangeDetector(object):
+    """Detect changes in tables of the SC3 database with one aggregate query per table.
+
+    The signature of a table is the number of rows, the maximum _oid and the
+    maximum _last_modified timestamp. Only max(_oid) is resolved with an index
+    (the primary key). The SC3 schema has no index on _last_modified, so every
+    poll scans the watched tables. They are small (networks, stations, virtual
+    networks and Access), but the interval between polls should grow with
+    them. An index on _last_modified in each watched table (e.g. "create index
+    Station_lastmod on Station (_last_modified)") makes the maximum a lookup.
+    """
+
+    def __init__(self, tables: list):
+        """Constructor of the ChangeDetector class.
+
+        :param tables: Names of the tables to watch
+        :type tables: list
+        """
+        self.tables = tables
+        self.signatures = dict()
+
+    @staticmethod
+    def signature(conn: SC3dbconnection, table: str) -> dict:
+        conn.execute('select count(*) as howmany, max(_oid) as maxoid, max(_last_modified) as lastmod '
+                     'from {}'.format(table), [])
+        return conn.fetchone()
+
+    def poll(self, conn: SC3dbconnection) -> dict:
+        """Return the previous and current signatures of the tables which changed.
+
+        :param conn: Connection to the SC3 database
+        :type conn: SC3dbconnection
+        :returns: A tuple (old, new) for every table with changes
+        :rtype: dict
+        """
+        changes = dict()
+        for table in self.tables:
+            new = self.signature(conn, table)
+            old = self.signatures.get(table)
+            if old != new:
+                changes[table] = (old, new)
+        return changes
+
+    def commit(self, changes: dict):
+        """Save the current signatures once the changes have been applied."""
+        for table, (old, new) in changes.items():
+            self.signatures[table] = new
+
+
+class Inventory(object):
+    """Keep track of the changes in the inventory and optionally a snapshot of it.
+
+    The tables are checked periodically in a background thread and only the
+    rows which changed are read from the DB. Readers take a reference to the
+    current snapshot, which is replaced atomically by the new one after each
+    refresh, so they never have to wait. Without snapshot, only the changes
+    are detected and notified to the registered listeners. An index of the
+    Access table can also be kept and is rebuilt when Access or Network change.
+    """
+
+    def __init__(self, pool: SC3dbpool, interval: float = 300.0, snapshot: bool = True,
+                 entitlements: bool = False):
+        """Constructor of the Inventory class.
+
+        :param pool: Pool of connections to the SC3 database
+        :type pool: SC3dbpool
+        :param interval: Seconds between two checks of the inventory tables
+        :type interval: float
+        :param snapshot: Keep a snapshot of the inventory in memory
+        :type snapshot: bool
+        :param entitlements: Keep an index of the Access table in memory
+        :type entitlements: bool
+        """
+        self.pool = pool
+        self.interval = interval
+        self.keepsnapshot = snapshot
+        self.keepentitlements = entitlements
+        self.entitlements = None
+        self.log = logging.getLogger('Inventory')
+        # Access is watched to notify changes in the permissions
+        self.detector = ChangeDetector(list(InventorySnapshot.tables) + ['Access'])
+        self.listeners = list()
+        self.snapshot = None
+        self.started = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+        self.refresh()
+
+    def register(self, callback, tables: list = None):
+        """Call a function every time the inventory changes.
+
+        :param callback: Function to call without parameters
+        :type callback: function
+        :param tables: Call it only if one of these tables changed (default: inventory tables)
+        :type tables: list
+        """
+        self.listeners.append((callback, set(tables if tables is not None else InventorySnapshot.tables)))
+
+    def refresh(self):
+        """Apply the changes in the DB to a new snapshot and replace the current one."""
+        try:
+            with self.pool.connection() as conn:
+                changes = self.detector.poll(conn)
+                if not len(changes):
+                    return
+
+                invchanges = {table: change for table, change in changes.items()
+                              if table in InventorySnapshot.tables}
+                if not self.keepsnapshot:
+                    snapshot = None
+                elif self.snapshot is None:
+                    snapshot = InventorySnapshot.load(conn)
+                elif len(invchanges):
+                    snapshot = self.snapshot.update(conn, invchanges)
+                else:
+                    snapshot = self.snapshot
+
+                entitlements = self.entitlements
+                if self.keepentitlements and ('Access' in changes or 'Network' in changes):
+                    entitlements = Entitlements.load(conn)
+        except Exception as e:
+            # Keep serving the previous snapshot
+            self.log.error('Error refreshing the inventory: {}'.format(e))
+            if (self.keepsnapshot and self.snapshot is None) or \
+                    (self.keepentitlements and self.entitlements is None):
+                raise
+            return
+
+        self.detector.commit(changes)
+        self.snapshot = snapshot
+        self.entitlements = entitlements
+        if snapshot is not None:
+            self.log.info('Inventory updated ({}): {} networks, {} stations, {} virtual networks.'.format(
+                ', '.join(changes), len(snapshot.netrows), len(snapshot.starows), len(snapshot.vnetrows)))
+        else:
+            self.log.info('Inventory changed ({}).'.format(', '.join(changes)))
+
+        for callback, tables in self.listeners:
+            if len(tables.intersection(changes)):
+                callback()
+
+    def versionof(self, tables: list = None) -> tuple:
+        """Return an identifier and the modification time of the current content of some tables.
+
+        :param tables: Tables to consider (default: inventory tables)
+        :type tables: list
+        :returns: A hash of the signatures of the tables and the most recent modification
+        :rtype: tuple
+        """
+        tables = tables if tables is not None else InventorySnapshot.tables
+        signatures = sorted((table, sig) for table, sig in self.detector.signatures.items()
+                            if table in tables)
+        if not len(signatures):
+            return None, None
+
+        version = hashlib.sha1(repr(signatures).encode('utf-8')).hexdigest()
+
+        # Most recent modification in the tables (the DB is expected to be in UTC)
+        lastmod = [sig['lastmod'] for table, sig in signatures if isinstance(sig['lastmod'], datetime.datetime)]
+        if len(lastmod):
+            lastmodified = max(lastmod).replace(tzinfo=datetime.timezone.utc, microsecond=0)
+        else:
+            lastmodified = self.started
+        return version, lastmodified
+
+    def validate(self, key: tuple, tables: list = None):
+        """Add the ETag and Last-Modified headers for a request and check its conditions.
+
+        The ETag is derived from the version of the tables used to build the
+        response and the key of the request (method, parameters and format).
+        If the client already has the current version of the response, a 304
+        is sent right away.
+
+        The version is the one of the last check of the tables, so that it only
+        identifies responses built from the copies in memory (the snapshot for
+        the inventory tables and the entitlements for Access). Responses read
+        from the DB could be newer and are sent without validators.
+
+        :param key: Canonical key of the request as built by ResponseCache.key
+        :type key: tuple
+        :param tables: Tables the response depends on (default: inventory tables)
+        :type tables: list
+        :raises: cherrypy.HTTPRedirect
+        """
+        tables = tables if tables is not None else InventorySnapshot.tables
+        if (self.entitlements if 'Access' in tables else self.snapshot) is None:
+            return
+
+        version, lastmodified = self.versionof(tables)
+        if version is None:
+            return
+
+        etag = '"{}"'.format(hashlib.sha1((version + repr(key)).encode('utf-8')).hexdigest())
+        cherrypy.response.headers['ETag'] = etag
+        cherrypy.response.headers['Last-Modified'] = email.utils.format_datetime(lastmodified, usegmt=True)
+
+        # If-None-Match has precedence over If-Modified-Since
+        nonematch = cherrypy.request.headers.get('If-None-Match')
+        if nonematch is not None:
+            tags = [tag.strip() for tag in nonematch.split(',')]
+            tags = [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+            if etag in tags:
+                raise cherrypy.HTTPRedirect([], 304)
+            return
+
+        modifiedsince = cherrypy.request.headers.get('If-Modified-Since')
+        if modifiedsince is not None:
+            try:
+                since = email.utils.parsedate_to_datetime(modifiedsince)
+            except (TypeError, ValueError):
+                return
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=datetime.timezone.utc)
+            if lastmodified <= since:
+                raise cherrypy.HTTPRedirect([], 304)
+
+    def subscribe(self, bus):
+        """Refresh the snapshot periodically while the engine is running."""
+        plugins.Monitor(bus, self.refresh, frequency=self.interval, name='InventoryRefresh').subscribe()
+
+
 @cherrypy.expose
 class AccessAPI(object):
     """Object dispatching methods related to access to streams."""
 
-    def __init__(self, host: str, user: str, password: str, db: str):
+    def __init__(self, pool: SC3dbpool, cache: AccessCache = None, inventory: Inventory = None):
         """Constructor of the AccessAPI class."""
-        # Save connection
-        self.conn = SC3dbconnection(host, user, password, db)
+        # Save the pool of connections
+        self.pool = pool
+        # Cache of decisions (if configured)
+        self.cache = cache
+        # Index of the Access table in memory (if configured)
+        self.inventory = inventory
         self.log = logging.getLogger('AccessAPI')
 
-    def __access(self, email: str, net: str = '', sta: str = '', loc: str = '', cha: str = '',
-                 starttime: datetime.datetime = None, endtime: datetime.datetime = None):
-        # Check network access
-        # self.cursor = self.conn.cursor()
-        whereclause = ['networkCode=%s',
-                       'stationCode=%s',
-                       'locationCode=%s',
-                       'streamCode=%s',
-                       '%s LIKE concat("%%", user, "%%")']
-        variables = [net, sta, loc, cha, email]
+    def decide(self, conn: SC3dbconnection, email: str, net: str, sta: str = '', loc: str = '', cha: str = '',
+               starttime: str = None, endtime: str = None) -> str:
+        """Decide whether a user has access to a stream with one query.
 
+        The restricted flag of the network and the grants at network, station
+        and channel level are evaluated together by joining Network and Access.
+
+        :returns: 'open', 'network', 'station' or 'channel' if access is
+                  granted (indicating the reason), 'denied' if not, 'notfound'
+                  if the network does not exist and 'ambiguous' if restricted
+                  and open epochs of the network match the time window.
+        :rtype: str
+        """
+        # Grants which could give access to the stream
+        grants = ["(A.stationCode='' and A.locationCode='' and A.streamCode='')"]
+        variables = [email]
+        if len(sta):
+            grants.append("(A.stationCode=%s and A.locationCode='' and A.streamCode='')")
+            variables.append(sta)
+        if len(cha):
+            grants.append('(A.stationCode=%s and A.locationCode=%s and A.streamCode=%s)')
+            variables.extend([sta, loc, cha])
+
+        joinclause = ['A.networkCode=N.code',
+                      '%s LIKE concat("%%", A.user, "%%")',
+                      '(' + ' or '.join(grants) + ')']
         if starttime is not None:
-            whereclause.append('start<=%s')
+            joinclause.append('A.start<=%s')
             variables.append(starttime)
 
         if endtime is not None:
-            whereclause.append('(end>=%s or end is NULL)')
+            joinclause.append('(A.end>=%s or A.end is NULL)')
             variables.append(endtime)
 
-        query = 'select count(*) as howmany from Access where ' + ' and '.join(whereclause)
-        self.conn.execute(query, variables)
-        result = self.conn.fetchone()
+        whereclause = ['N.code=%s']
+        variables.append(net)
+        if starttime is not None:
+            whereclause.append('N.start<=%s')
+            variables.append(starttime)
 
-        if result is not None:
-            return result['howmany']
+        if endtime is not None:
+            whereclause.append('(N.end>=%s or N.end is NULL)')
+            variables.append(endtime)
+
+        query = ("select N.restricted as restricted, "
+                 "max(A.stationCode='' and A.streamCode='') as network, "
+                 "max(A.stationCode<>'' and A.streamCode='') as station, "
+                 "max(A.streamCode<>'') as channel "
+                 "from Network as N left join Access as A on " + ' and '.join(joinclause) +
+                 " where " + ' and '.join(whereclause) + " group by N.restricted")
+        conn.execute(query, variables)
+        result = conn.fetchall()
+
+        if len(result) != 1:
+            return 'ambiguous' if len(result) else 'notfound'
+
+        if result[0]['restricted'] == 0:
+            return 'open'
+
+        for level in ('network', 'station', 'channel'):
+            if result[0][level]:
+                return level
 
-        raise Exception('No result querying the DB ({})'.format(query % variables))
+        return 'denied'
 
     @cherrypy.expose
     def index(self, nslc: str, email: str, starttime: str = None, endtime: str = None):
@@ -286,27 +2464,22 @@ class AccessAPI(object):
                 cherrypy.response.headers['Content-Type'] = 'application/json'
                 raise cherrypy.HTTPError(400, message)
 
-        # Check if network is restricted
-        whereclause = ['code=%s']
-        variables = [nslc2[0]]
-
-        if starttime is not None:
-            whereclause.append('start<=%s')
-            variables.append(starttime)
-
-        if endtime is not None:
-            whereclause.append('(end>=%s or end is NULL)')
-            variables.append(endtime)
-
-        # self.cursor = self.conn.cursor()
-        query = 'select distinct restricted from Network where '
-        query = query + ' and '.join(whereclause)
-
-        self.conn.execute(query, variables)
-        result = self.conn.fetchall()
-
-        if len(result) != 1:
-            if len(result):
+        key = (email, '.'.join(nslc2), starttime, endtime)
+        entitlements = self.inventory.entitlements if self.inventory is not None else None
+        if entitlements is not None:
+            decision = entitlements.decide(email, nslc2[0], nslc2[1], nslc2[2], nslc2[3],
+                                           naivedate(starttime), naivedate(endtime))
+        else:
+            decision = self.cache.get(key) if self.cache is not None else None
+
+        if decision is None:
+            with self.pool.connection() as conn:
+                decision = self.decide(conn, email, nslc2[0], nslc2[1], nslc2[2], nslc2[3], starttime, endtime)
+            if self.cache is not None:
+                self.cache.setdecision(key, decision)
+
+        if decision in ('ambiguous', 'notfound'):
+            if decision == 'ambiguous':
                 mess = 'Restricted and non-restricted streams found. More filters are needed.'
             else:
                 mess = 'Network not found!'
@@ -318,23 +2491,9 @@ class AccessAPI(object):
             cherrypy.response.headers['Content-Type'] = 'application/json'
             raise cherrypy.HTTPError(400, message)
 
-        if (result[0] is not None) and (result[0]['restricted'] == 0):
-            cherrypy.response.headers['Content-Type'] = 'text/plain'
-            return ''.encode('utf-8')
-
-        # Check network access
-        if self.__access(email, net=nslc2[0], starttime=starttime, endtime=endtime):
-            cherrypy.response.headers['Content-Type'] = 'text/plain'
-            return ''.encode('utf-8')
-
-        # Check station access
-        if len(nslc2[1]) and self.__access(email, net=nslc2[0], sta=nslc2[1], starttime=starttime, endtime=endtime):
-            cherrypy.response.headers['Content-Type'] = 'text/plain'
-            return ''.encode('utf-8')
-
-        # Check channel access
-        if len(nslc2[3]) and self.__access(email, net=nslc2[0], sta=nslc2[1], loc=nslc2[2], cha=nslc2[3],
-                                           starttime=starttime, endtime=endtime):
+        if decision != 'denied':
+            # Level at which the access was granted (or "open")
+            cherrypy.response.headers['X-Access-Level'] = decision
             cherrypy.response.headers['Content-Type'] = 'text/plain'
             return ''.encode('utf-8')
 
@@ -346,16 +2505,207 @@ class AccessAPI(object):
         cherrypy.response.headers['Content-Type'] = 'application/json'
         raise cherrypy.HTTPError(403, message)
 
+    @cherrypy.expose
+    def batch(self, **kwargs):
+        """Check if a user has access to many streams at once.
+
+        The body of the POST request is a JSON object with the email of the
+        user and a list of items with the keys "nslc" and optionally
+        "starttime" and "endtime", e.g.
+        {"email": "user@domain.org", "items": [{"nslc": "GE.APE..BHZ"}]}.
+        All items are resolved with two queries to the DB at most.
+
+        :returns: For each item, the same keys plus "access" (true/false) and
+                  "level" (open, network, station, channel, denied, notfound or
+                  ambiguous).
+        :rtype: utf-8 encoded string
+        :raises: cherrypy.HTTPError
+        """
+        if len(kwargs):
+            # Send Error 400
+            messdict = {'code': 0,
+                        'message': 'Unknown parameter(s) "{}".'.format(kwargs.items())}
+            message = json.dumps(messdict)
+            self.log.error(message)
+            raise cherrypy.HTTPError(400, message)
+
+        if cherrypy.request.method != 'POST':
+            # Send Error 405
+            messdict = {'code': 0,
+                        'message': 'Items to check must be sent with a POST request.'}
+            message = json.dumps(messdict)
+            self.log.error(message)
+            cherrypy.response.headers['Allow'] = 'POST'
+            raise cherrypy.HTTPError(405, message)
+
+        try:
+            request = json.loads(cherrypy.request.body.read().decode('utf-8'))
+            email = request['email']
+            # Check the types before using them in the decisions and the queries
+            if not isinstance(email, str) or not len(email.strip()):
+                raise ValueError('Wrong email')
+            if not isinstance(request['items'], list):
+                raise ValueError('Wrong list of items')
+
+            items = list()
+            for item in request['items']:
+                if not isinstance(item, dict) or not isinstance(item.get('nslc'), str) or not len(item['nslc']):
+                    raise ValueError('Wrong item')
+                if any(not isinstance(item.get(key), (str, type(None))) for key in ('starttime', 'endtime')):
+                    raise ValueError('Wrong time window')
+                auxnslc = item['nslc'].split('.')
+                nslc2 = [auxnslc[pos] if len(auxnslc) > pos else '' for pos in range(4)]
+                starttime = item.get('starttime')
+                endtime = item.get('endtime')
+                items.append((item, nslc2, starttime, naivedate(starttime), endtime, naivedate(endtime)))
+        except Exception:
+            # Send Error 400
+            messdict = {'code': 0,
+                        'message': 'Wrong formatted request. A JSON object with "email" and a list of '
+                                   '"items" (with "nslc" and optionally "starttime" and "endtime") is expected.'}
+            message = json.dumps(messdict)
+            self.log.error(message)
+            cherrypy.response.headers['Content-Type'] = 'application/json'
+            raise cherrypy.HTTPError(400, message)
+
+        # Decisions from the index in memory or already in the cache
+        decisions = dict()
+        pending = list()
+        entitlements = self.inventory.entitlements if self.inventory is not None else None
+        for pos, (item, nslc2, starttime, start, endtime, end) in enumerate(items):
+            if entitlements is not None:
+                decisions[pos] = entitlements.decide(email, nslc2[0], nslc2[1], nslc2[2], nslc2[3], start, end)
+                continue
+
+            key = (email, '.'.join(nslc2), starttime, endtime)
+            decision = self.cache.get(key) if self.cache is not None else None
+            if decision is None:
+                pending.append(pos)
+            else:
+                decisions[pos] = decision
+
+        # Read the networks and grants of the user for the rest with two queries
+        if len(pending):
+            netcodes = sorted({items[pos][1][0] for pos in pending})
+            placeholders = ', '.join(['%s'] * len(netcodes))
+            with self.pool.connection() as conn:
+                conn.execute('select code, start, end, restricted from Network '
+                             'where code in ({})'.format(placeholders), netcodes)
+                networks = dict()
+                for row in conn.fetchall():
+                    networks.setdefault(row['code'], []).append(row)
+
+                conn.execute('select networkCode, stationCode, locationCode, streamCode, start, end '
+                             'from Access where networkCode in ({}) and '
+                             '%s LIKE concat("%%", user, "%%")'.format(placeholders), netcodes + [email])
+                grants = dict()
+                for row in conn.fetchall():
+                    grants.setdefault(row['networkCode'], []).append(row)
+
+            for pos in pending:
+                item, nslc2, starttime, start, endtime, end = items[pos]
+                decision = accessdecision(networks.get(nslc2[0], []), grants.get(nslc2[0], []),
+                                          nslc2[1], nslc2[2], nslc2[3], start, end)
+                decisions[pos] = decision
+                if self.cache is not None:
+                    self.cache.setdecision((email, '.'.join(nslc2), starttime, endtime), decision)
+
+        result = list()
+        for pos, (item, nslc2, starttime, _, endtime, _) in enumerate(items):
+            decision = decisions[pos]
+            result.append({'nslc': item['nslc'], 'starttime': starttime, 'endtime': endtime,
+                           'access': decision not in ('denied', 'notfound', 'ambiguous'),
+                           'level': decision})
+
+        serializer = Serializer.get('accessbatch', ['nslc', 'starttime', 'endtime', 'access', 'level'], 'json')
+        cherrypy.response.headers['Content-Type'] = serializer.contenttype
+        return serializer.dumps(result)
+
+    @cherrypy.expose
+    def bundle(self, email: str, **kwargs):
+        """Return everything a user has access to.
+
+        The response includes the time windows of all the open networks and of
+        all the grants (at network, station or channel level) matching the email
+        of the user. It supports conditional requests based on the version of the
+        Access and Network tables.
+
+        :param email: Email address from the user
+        :type email: str
+        :returns: Open networks and grants of the user
+        :rtype: utf-8 encoded string
+        :raises: cherrypy.HTTPError
+        """
+        if len(kwargs):
+            # Send Error 400
+            messdict = {'code': 0,
+                        'message': 'Unknown parameter(s) "{}".'.format(kwargs.items())}
+            message = json.dumps(messdict)
+            self.log.error(message)
+            raise cherrypy.HTTPError(400, message)
+
+        # Answer with a 304 if the client already has the current version
+        if self.inventory is not None:
+            self.inventory.validate(('bundle', email), ['Access', 'Network'])
+
+        entitlements = self.inventory.entitlements if self.inventory is not None else None
+        if entitlements is not None:
+            opennets = [net for nets in entitlements.networks.values() for net in nets if net['restricted'] == 0]
+            grants = [grant for index in entitlements.indexes(email)
+                      for intervals in index.values() for grant in intervals[2]]
+        else:
+            # Open networks and grants of the user in one pass
+            query = ('select "open" as kind, code as networkCode, "" as stationCode, "" as locationCode, '
+                     '"" as streamCode, start, end from Network where restricted=0 '
+                     'union all '
+                     'select "grant" as kind, networkCode, stationCode, locationCode, streamCode, start, end '
+                     'from Access where %s LIKE concat("%%", user, "%%")')
+            with self.pool.connection() as conn:
+                conn.execute(query, [email])
+                rows = conn.fetchall()
+            opennets = [{'code': row['networkCode'], 'start': row['start'], 'end': row['end']}
+                        for row in rows if row['kind'] == 'open']
+            grants = [row for row in rows if row['kind'] == 'grant']
+
+        opennets = [{'network': net['code'], 'start': net['start'], 'end': net['end']}
+                    for net in sorted(opennets, key=lambda net: (net['code'], net['start']))]
+        grants = sorted(({'network': grant['networkCode'], 'station': grant['stationCode'],
+                          'location': grant['locationCode'], 'channel': grant['streamCode'],
+                          'start': grant['start'], 'end': grant['end']} for grant in grants),
+                        key=lambda grant: (grant['network'], grant['station'], grant['location'],
+                                           grant['channel'], grant['start']))
+
+        # Lists of open networks and grants encoded by their serializers
+        openserializer = Serializer.get('bundle', ['network', 'start', 'end'], 'json')
+        grantserializer = Serializer.get('bundle', ['network', 'station', 'location', 'channel', 'start', 'end'],
+                                         'json')
+        result = '{"email": %s, "open": ' % jsonvalue(email)
+        cherrypy.response.headers['Content-Type'] = openserializer.contenttype
+        return (result.encode('utf-8') + openserializer.dumps(opennets) + b', "grants": ' +
+                grantserializer.dumps(grants) + b'}')
+
 
 @cherrypy.expose
 @cherrypy.popargs('net', 'sta')
 class StationsAPI(object):
     """Object dispatching methods related to stations."""
 
-    def __init__(self, host: str, user: str, password: str, db: str):
+    # Key of the rows to page through the results and its columns in the query.
+    # The start of the network and the _oid tell apart reused codes of temporary networks
+    pagekey = ['network', 'code', 'start', 'netstart', '_oid']
+    pagecolumns = ['N.code', 'S.code', 'S.start', 'N.start', 'S._oid']
+
+    def __init__(self, pool: SC3dbpool, inventory: Inventory = None, cache: ResponseCache = None,
+                 routing: RoutingXML = None):
         """Constructor of the StationsAPI class."""
-        # Save connection
-        self.conn = SC3dbconnection(host, user, password, db)
+        # Save the pool of connections
+        self.pool = pool
+        # Snapshot of the inventory in memory (if configured)
+        self.inventory = inventory
+        # Cache of rendered responses (if configured)
+        self.cache = cache
+        # Renderer of the XML output with the services of the data center
+        self.routing = routing if routing is not None else RoutingXML()
         self.log = logging.getLogger('StationsAPI')
 
         # Get extra fields from the cfg file
@@ -369,14 +2719,17 @@ class StationsAPI(object):
 
     @cherrypy.expose
     def index(self, net: str = None, sta: str = None, outformat: str = 'json', restricted: str = None,
-              archive: str = None, shared: str = None, starttime: str = None, endtime: str = None, **kwargs):
+              archive: str = None, shared: str = None, starttime: str = None, endtime: str = None,
+              timematch: str = 'contained', minlat: str = None, maxlat: str = None, minlon: str = None,
+              maxlon: str = None, lat: str = None, lon: str = None, maxradius: str = None, limit: str = None,
+              after: str = None, fields: str = None, **kwargs):
         """List available stations in the system.
 
-        :param net: Network code
+        :param net: Network codes separated by commas (wildcards "*" and "?" are allowed)
         :type net: str
-        :param sta: Station code
+        :param sta: Station codes separated by commas (wildcards "*" and "?" are allowed)
         :type sta: str
-        :param outformat: Output format (json, text, xml)
+        :param outformat: Output format (json, text, xml, ndjson, geojson)
         :type outformat: str
         :param restricted: Restricted status of the Station ('0' or '1')
         :type restricted: str
@@ -388,6 +2741,28 @@ class StationsAPI(object):
         :type starttime: str
         :param endtime: End time in isoformat
         :type endtime: str
+        :param timematch: Epochs contained in the time window ('contained') or overlapping it ('overlap')
+        :type timematch: str
+        :param minlat: Minimum latitude of the stations
+        :type minlat: str
+        :param maxlat: Maximum latitude of the stations
+        :type maxlat: str
+        :param minlon: Minimum longitude of the stations
+        :type minlon: str
+        :param maxlon: Maximum longitude of the stations (smaller than minlon to cross the dateline)
+        :type maxlon: str
+        :param lat: Latitude of the centre of the search radius
+        :type lat: str
+        :param lon: Longitude of the centre of the search radius
+        :type lon: str
+        :param maxradius: Maximum distance in km from the point given by lat and lon
+        :type maxradius: str
+        :param limit: Maximum number of stations to return
+        :type limit: str
+        :param after: Continuation token received with the previous page
+        :type after: str
+        :param fields: Fields to include in the output separated by commas (not in XML)
+        :type fields: str
         :returns: Data related to the available stations.
         :rtype: utf-8 encoded string
         :raises: cherrypy.HTTPError
@@ -429,7 +2804,7 @@ class StationsAPI(object):
                 self.log.error(message)
                 raise cherrypy.HTTPError(400, message)
 
-        if outformat not in ['json', 'text', 'xml']:
+        if outformat not in ['json', 'text', 'xml', 'ndjson', 'geojson']:
             # Send Error 400
             messdict = {'code': 0,
                         'message': 'Wrong value in the "outformat" parameter.'}
@@ -454,42 +2829,248 @@ class StationsAPI(object):
             except Exception:
                 # Send Error 400
                 messdict = {'code': 0,
-                            'message': 'Error converting the "endtime" parameter (%s).' % endtime}
+                            'message': 'Error converting the "endtime" parameter (%s).' % endtime}
+                message = json.dumps(messdict)
+                self.log.error(message)
+                raise cherrypy.HTTPError(400, message)
+
+        if timematch not in ['contained', 'overlap']:
+            # Send Error 400
+            messdict = {'code': 0,
+                        'message': 'Wrong value in the "timematch" parameter.'}
+            message = json.dumps(messdict)
+            self.log.error(message)
+            raise cherrypy.HTTPError(400, message)
+
+        # Check the geographic parameters
+        coords = {'minlat': minlat, 'maxlat': maxlat, 'minlon': minlon, 'maxlon': maxlon,
+                  'lat': lat, 'lon': lon, 'maxradius': maxradius}
+        limits = {'minlat': (-90.0, 90.0), 'maxlat': (-90.0, 90.0), 'lat': (-90.0, 90.0),
+                  'minlon': (-180.0, 180.0), 'maxlon': (-180.0, 180.0), 'lon': (-180.0, 180.0),
+                  'maxradius': (0.0, math.pi * EARTHRADIUS)}
+        for param, value in coords.items():
+            if value is None:
+                continue
+            try:
+                coords[param] = float(value)
+                if not limits[param][0] <= coords[param] <= limits[param][1]:
+                    raise Exception
+            except Exception:
+                # Send Error 400
+                messdict = {'code': 0,
+                            'message': 'Wrong value in the "%s" parameter (%s).' % (param, value)}
+                message = json.dumps(messdict)
+                self.log.error(message)
+                raise cherrypy.HTTPError(400, message)
+        minlat, maxlat, minlon, maxlon = coords['minlat'], coords['maxlat'], coords['minlon'], coords['maxlon']
+        lat, lon, maxradius = coords['lat'], coords['lon'], coords['maxradius']
+
+        if (lat is None) != (lon is None) or (lat is None) != (maxradius is None):
+            # Send Error 400
+            messdict = {'code': 0,
+                        'message': 'Parameters "lat", "lon" and "maxradius" must be used together.'}
+            message = json.dumps(messdict)
+            self.log.error(message)
+            raise cherrypy.HTTPError(400, message)
+
+        if limit is not None:
+            try:
+                limit = int(limit)
+                if limit < 1:
+                    raise Exception
+            except Exception:
+                # Send Error 400
+                messdict = {'code': 0,
+                            'message': 'Wrong value in the "limit" parameter (%s).' % limit}
+                message = json.dumps(messdict)
+                self.log.error(message)
+                raise cherrypy.HTTPError(400, message)
+
+        afterkey = None
+        if after is not None:
+            try:
+                afterkey = decodetoken(after, self.pagekey)
+            except ValueError:
+                # Send Error 400
+                messdict = {'code': 0,
+                            'message': 'Wrong value in the "after" parameter.'}
+                message = json.dumps(messdict)
+                self.log.error(message)
+                raise cherrypy.HTTPError(400, message)
+
+        region = None
+        if any(x is not None for x in (minlat, maxlat, minlon, maxlon)):
+            region = (minlat, maxlat, minlon, maxlon)
+        circle = (lat, lon, maxradius) if maxradius is not None else None
+
+        # try:
+        available = ['network', 'code', 'latitude', 'longitude', 'elevation',
+                     'place', 'country', 'start', 'end', 'restricted', 'shared']
+        # available.extend(self.extrafields)
+
+        if fields is not None and outformat != 'xml':
+            try:
+                fields = projection(fields, available)
+            except ValueError:
+                # Send Error 400
+                messdict = {'code': 0,
+                            'message': 'Wrong value in the "fields" parameter (%s).' % fields}
+                message = json.dumps(messdict)
+                self.log.error(message)
+                raise cherrypy.HTTPError(400, message)
+        else:
+            # XML always needs the same fields
+            fields = available
+
+        # Select also the fields needed to page through the results and to check the distance
+        needed = set(fields)
+        if limit is not None or afterkey is not None:
+            needed.update(self.pagekey)
+        if circle is not None or outformat == 'geojson':
+            needed.update(['latitude', 'longitude'])
+        if outformat == 'geojson':
+            needed.add('elevation')
+
+        netmatcher = None
+        if net is not None:
+            # List of codes and patterns (e.g. GE,4C_2011,Z*)
+            try:
+                netmatcher = CodeMatcher(net, extended=True)
+                if any(istemporary(code) and year is None for code, year in netmatcher.exact):
+                    raise ValueError
+            except ValueError:
+                # Send Error 400
+                messdict = {'code': 0,
+                            'message': 'Wrong network code (%s). Temporary codes must include the start year (e.g. 4C_2011).' % net}
+                message = json.dumps(messdict)
+                self.log.error(message)
+                raise cherrypy.HTTPError(400, message)
+
+        stamatcher = None
+        if sta is not None:
+            try:
+                stamatcher = CodeMatcher(sta)
+            except ValueError:
+                # Send Error 400
+                messdict = {'code': 0,
+                            'message': 'Wrong station code (%s).' % sta}
                 message = json.dumps(messdict)
                 self.log.error(message)
                 raise cherrypy.HTTPError(400, message)
 
-        # try:
-        query = ('select N.code as network, S.code as code, latitude, longitude, '
-                 'elevation, place, country, S.start, S.end, S.restricted, S.shared '
-                 'from Station as S join Network as N')
-        fields = ['network', 'code', 'latitude', 'longitude', 'elevation',
-                  'place', 'country', 'start', 'end', 'restricted', 'shared']
-        # fields.extend(self.extrafields)
+        query, variables = self.query(needed, net=netmatcher, sta=stamatcher, restricted=restricted, archive=archive,
+                                      shared=shared, starttime=starttime, endtime=endtime,
+                                      overlap=(timematch == 'overlap'), region=region, circle=circle, after=afterkey,
+                                      limit=limit)
+
+        # Content coding accepted by the client. Every coding is a different representation
+        coding = Compressor.accepted()
+        # Canonical key of the request for the cache and the ETag
+        cachekey = ResponseCache.key('station', net=net, sta=sta, outformat=outformat, restricted=restricted,
+                                     archive=archive, shared=shared, starttime=starttime, endtime=endtime,
+                                     timematch=timematch, region=region, circle=circle, limit=limit,
+                                     after=after, fields=','.join(fields),
+                                     encoding=coding)
+        # Answer with a 304 if the client already has the current version
+        if self.inventory is not None:
+            self.inventory.validate(cachekey)
+
+        # Serve the response from the cache if it was already rendered
+        if self.cache is not None:
+            cached = self.cache.get(cachekey)
+            if cached is not None:
+                cherrypy.response.headers['Content-Type'] = cached[0]
+                cherrypy.response.headers.update(cached[2])
+                return cached[1]
+
+        # Only large results read from the DB while the response is sent are streamed
+        streamed = False
+        snapshot = self.inventory.snapshot if self.inventory is not None else None
+        if snapshot is not None:
+            result = snapshot.getstations(net=netmatcher, sta=stamatcher, restricted=restricted, archive=archive,
+                                          shared=shared, starttime=naivedate(starttime),
+                                          endtime=naivedate(endtime), overlap=(timematch == 'overlap'),
+                                          region=region, circle=circle, after=afterkey, limit=limit)
+        else:
+            def inradius(row: dict) -> bool:
+                return distance(lat, lon, row['latitude'], row['longitude']) <= maxradius
+
+            # Large results are read from the DB while the response is sent. Pages
+            # and responses to be cached are read at once to free the connection.
+            # The radius is checked while reading, so a page stops after limit + 1 rows
+            result = self.pool.rows(query, variables, stream=(limit is None and self.cache is None),
+                                    rowfilter=inradius if circle is not None else None,
+                                    limit=limit + 1 if limit is not None else None)
+            streamed = not isinstance(result, list)
+
+        # Point to the next page if there are more rows
+        headers = dict()
+        if limit is not None:
+            # At most limit + 1 rows
+            result = list(itertools.islice(result, limit + 1))
+            if len(result) > limit:
+                result = result[:limit]
+                headers = nextpage(encodetoken([result[-1][field] for field in self.pagekey]))
+
+        # The serializers keep only the fields requested
+        if outformat == 'xml':
+            contenttype = 'application/xml'
+            chunks = self.routing.routes(result, stations=True)
+        else:
+            serializer = Serializer.get('station', fields, outformat)
+            contenttype = serializer.contenttype
+            chunks = serializer.chunks(result)
+
+        # Compress while streaming. Headers are saved with the body in the cache
+        headers['Vary'] = 'Accept-Encoding'
+        if coding is not None:
+            headers['Content-Encoding'] = coding
+            chunks = Compressor(coding).chunks(chunks)
+
+        cherrypy.response.headers['Content-Type'] = contenttype
+        cherrypy.response.headers.update(headers)
+        if self.cache is not None:
+            chunks = self.cache.tee(cachekey, contenttype, chunks, headers)
+        if not streamed:
+            # Rendered before the status is sent, so that an error is not sent as a truncated body
+            return b''.join(chunks)
+        # Send the body while it is being generated
+        cherrypy.response.stream = True
+        return chunks
+
+    def query(self, fields: set, net: CodeMatcher = None, sta: CodeMatcher = None, restricted: int = None,
+              archive: str = None, shared: int = None, starttime: str = None, endtime: str = None,
+              overlap: bool = False, region: tuple = None, circle: tuple = None, after: list = None,
+              limit: int = None) -> tuple:
+        """Query selecting the stations which match the filters, sorted by the key of the pages.
+
+        The filters are the same as in InventorySnapshot.getstations. Only the
+        bounding box of the radius is checked in the query.
+
+        :param fields: Fields to select
+        :type fields: set
+        :returns: The query and the values of its parameters
+        :rtype: tuple
+        """
+        # Expression in the query of every field
+        columns = {'network': 'N.code as network', 'code': 'S.code as code', 'latitude': 'latitude',
+                   'longitude': 'longitude', 'elevation': 'elevation', 'place': 'place', 'country': 'country',
+                   'start': 'S.start', 'end': 'S.end', 'restricted': 'S.restricted', 'shared': 'S.shared',
+                   'netstart': 'N.start as netstart', '_oid': 'S._oid as _oid'}
+        query = ('select ' + ', '.join(columns[field] for field in columns if field in fields) +
+                 ' from Station as S join Network as N')
 
         whereclause = ['S._parent_oid=N._oid']
         variables = []
         if net is not None:
-            if net[0] in '0123456789XYZ':
-                try:
-                    net, year = net.split('_')
-                except ValueError:
-                    # Send Error 400
-                    messdict = {'code': 0,
-                                'message': 'Wrong network code (%s). Temporary codes must include the start year (e.g. 4C_2011).' % net}
-                    message = json.dumps(messdict)
-                    self.log.error(message)
-                    raise cherrypy.HTTPError(400, message)
-
-                whereclause.append('YEAR(N.start)=%s')
-                variables.append(int(year))
-
-            whereclause.append('N.code=%s')
-            variables.append(net)
+            clause, clausevars = net.sqlclause('N.code', 'N.start')
+            whereclause.append(clause)
+            variables.extend(clausevars)
 
         if sta is not None:
-            whereclause.append('S.code=%s')
-            variables.append(sta)
+            clause, clausevars = sta.sqlclause('S.code')
+            whereclause.append(clause)
+            variables.extend(clausevars)
 
         if restricted is not None:
             whereclause.append('S.restricted=%s')
@@ -503,65 +3084,63 @@ class StationsAPI(object):
             whereclause.append('S.shared=%s')
             variables.append(shared)
 
-        if starttime is not None:
-            whereclause.append('S.start>=%s')
-            variables.append(starttime)
+        if overlap:
+            if endtime is not None:
+                whereclause.append('S.start<=%s')
+                variables.append(endtime)
+
+            if starttime is not None:
+                whereclause.append('(S.end>=%s or S.end is NULL)')
+                variables.append(starttime)
+        else:
+            if starttime is not None:
+                whereclause.append('S.start>=%s')
+                variables.append(starttime)
+
+            if endtime is not None:
+                whereclause.append('S.end<=%s')
+                variables.append(endtime)
+
+        # The radius is applied over the rows inside its bounding box
+        for box in [b for b in (region, radiusbox(*circle) if circle is not None else None) if b is not None]:
+            if box[0] is not None:
+                whereclause.append('latitude>=%s')
+                variables.append(box[0])
+
+            if box[1] is not None:
+                whereclause.append('latitude<=%s')
+                variables.append(box[1])
+
+            if box[2] is not None and box[3] is not None and box[2] > box[3]:
+                whereclause.append('(longitude>=%s or longitude<=%s)')
+                variables.extend([box[2], box[3]])
+            else:
+                if box[2] is not None:
+                    whereclause.append('longitude>=%s')
+                    variables.append(box[2])
 
-        if endtime is not None:
-            whereclause.append('S.end<=%s')
-            variables.append(endtime)
+                if box[3] is not None:
+                    whereclause.append('longitude<=%s')
+                    variables.append(box[3])
+
+        # Keyset pagination. Only the rows after the last one returned
+        if after is not None:
+            whereclause.append('(%s)>(%s)' % (', '.join(self.pagecolumns), ', '.join(['%s'] * len(after))))
+            variables.extend(after)
 
         if len(whereclause):
             query = query + ' where ' + ' and '.join(whereclause)
 
-        # self.cursor = self.conn.cursor()
-        self.conn.execute(query, variables)
-
-        # Complete SC3 data with local data
-        result = self.conn.fetchall()
-        # cursta = self.conn.fetchall()
-
-        if outformat == 'json':
-            cherrypy.response.headers['Content-Type'] = 'application/json'
-
-            return json.dumps(result, default=datetime.datetime.isoformat).encode('utf-8')
-        elif outformat == 'text':
-            cherrypy.response.headers['Content-Type'] = 'text/plain'
-
-            fout = io.StringIO("")
-            writer = csv.DictWriter(fout, fieldnames=fields, delimiter='|')
-            writer.writeheader()
-            writer.writerows(result)
-            fout.seek(0)
-            cherrypy.response.headers['Content-Type'] = 'text/plain'
-            return fout.read().encode('utf-8')
-        elif outformat == 'xml':
-            cherrypy.response.headers['Content-Type'] = 'application/xml'
-
-            header = """<?xml version="1.0" encoding="utf-8"?>
-  <ns0:routing xmlns:ns0="http://geofon.gfz-potsdam.de/ns/Routing/1.0/">
-            """
-            footer = """</ns0:routing>"""
-
-            outxml = [header]
-            for sta in result:
-                routetext = """
- <ns0:route networkCode="{netcode}" stationCode="{stacode}" locationCode="*" streamCode="*">
-  <ns0:station address="https://geofon.gfz.de/fdsnws/station/1/query" priority="1" start="{stastart}" end="{staend}" />
-  <ns0:wfcatalog address="https://geofon.gfz.de/eidaws/wfcatalog/1/query" priority="1" start="{stastart}" end="{staend}" />
-  <ns0:dataselect address="https://geofon.gfz.de/fdsnws/dataselect/1/query" priority="1" start="{stastart}" end="{staend}" />
-  <ns0:availability address="https://geofon.gfz.de/fdsnws/availability/1/query" priority="1" start="{stastart}" end="{staend}" />
- </ns0:route>
- """
-                nc = sta['network']
-                sc = sta['code']
-                ss = sta['start'].isoformat()
-                se = sta['end'].isoformat() if sta['end'] is not None else ''
-                outxml.append(routetext.format(netcode=nc, stacode=sc, stastart=ss, staend=se))
+        # Always in the same order, also without pages
+        query = query + ' order by ' + ', '.join(self.pagecolumns)
 
-            outxml.append(footer)
+        # The radius is checked after the query, so the rows are counted later
+        if limit is not None and circle is None:
+            # One more row to know if there is a next page
+            query = query + ' limit %s'
+            variables.append(limit + 1)
 
-            return ''.join(outxml).encode('utf-8')
+        return query, variables
 
 
 @cherrypy.expose
@@ -569,10 +3148,22 @@ class StationsAPI(object):
 class NetworksAPI(object):
     """Object dispatching methods related to networks."""
 
-    def __init__(self, host: str, user: str, password: str, db: str):
+    # Key of the rows to page through the results and its columns in the query.
+    # The _oid makes the key unique
+    pagekey = ['code', 'start', '_oid']
+    pagecolumns = ['code', 'start', '_oid']
+
+    def __init__(self, pool: SC3dbpool, inventory: Inventory = None, cache: ResponseCache = None,
+                 routing: RoutingXML = None):
         """Constructor of the NetworksAPI class."""
-        # Save connection
-        self.conn = SC3dbconnection(host, user, password, db)
+        # Save the pool of connections
+        self.pool = pool
+        # Snapshot of the inventory in memory (if configured)
+        self.inventory = inventory
+        # Cache of rendered responses (if configured)
+        self.cache = cache
+        # Renderer of the XML output with the services of the data center
+        self.routing = routing if routing is not None else RoutingXML()
         self.log = logging.getLogger('NetworksAPI')
 
         # Get extra fields from the cfg file
@@ -586,12 +3177,14 @@ class NetworksAPI(object):
 
     @cherrypy.expose
     def index(self, net: str = None, outformat: str = 'json', restricted: str = None, archive: str = None,
-              netclass: str = None, shared: str = None, starttime: str = None, endtime: str = None, **kwargs):
+              netclass: str = None, shared: str = None, starttime: str = None, endtime: str = None,
+              timematch: str = 'contained', limit: str = None, after: str = None, fields: str = None,
+              **kwargs):
         """List available networks in the system.
 
-        :param net: Network code
+        :param net: Network codes separated by commas (wildcards "*" and "?" are allowed)
         :type net: str
-        :param outformat: Output format (json, text, xml)
+        :param outformat: Output format (json, text, xml, ndjson, geojson)
         :type outformat: str
         :param restricted: Restricted status of the Network ('0' or '1')
         :type restricted: str
@@ -605,6 +3198,14 @@ class NetworksAPI(object):
         :type starttime: str
         :param endtime: End time in isoformat
         :type endtime: str
+        :param timematch: Epochs contained in the time window ('contained') or overlapping it ('overlap')
+        :type timematch: str
+        :param limit: Maximum number of networks to return
+        :type limit: str
+        :param after: Continuation token received with the previous page
+        :type after: str
+        :param fields: Fields to include in the output separated by commas (not in XML)
+        :type fields: str
         :returns: Data related to the available networks.
         :rtype: utf-8 encoded string
         :raises: cherrypy.HTTPError
@@ -646,7 +3247,7 @@ class NetworksAPI(object):
                 self.log.error(message)
                 raise cherrypy.HTTPError(400, message)
 
-        if outformat not in ['json', 'text', 'xml']:
+        if outformat not in ['json', 'text', 'xml', 'ndjson', 'geojson']:
             # Send Error 400
             messdict = {'code': 0,
                         'message': 'Wrong value in the "outformat" parameter.'}
@@ -676,30 +3277,185 @@ class NetworksAPI(object):
                 self.log.error(message)
                 raise cherrypy.HTTPError(400, message)
 
+        if timematch not in ['contained', 'overlap']:
+            # Send Error 400
+            messdict = {'code': 0,
+                        'message': 'Wrong value in the "timematch" parameter.'}
+            message = json.dumps(messdict)
+            self.log.error(message)
+            raise cherrypy.HTTPError(400, message)
+
+        if limit is not None:
+            try:
+                limit = int(limit)
+                if limit < 1:
+                    raise Exception
+            except Exception:
+                # Send Error 400
+                messdict = {'code': 0,
+                            'message': 'Wrong value in the "limit" parameter (%s).' % limit}
+                message = json.dumps(messdict)
+                self.log.error(message)
+                raise cherrypy.HTTPError(400, message)
+
+        afterkey = None
+        if after is not None:
+            try:
+                afterkey = decodetoken(after, self.pagekey)
+            except ValueError:
+                # Send Error 400
+                messdict = {'code': 0,
+                            'message': 'Wrong value in the "after" parameter.'}
+                message = json.dumps(messdict)
+                self.log.error(message)
+                raise cherrypy.HTTPError(400, message)
+
         # try:
-        query = 'select code, start, end, netClass, archive, restricted, shared from Network'
-        fields = ['code', 'start', 'end', 'netClass', 'archive', 'restricted', 'shared']
-        fields.extend(self.extrafields)
+        available = ['code', 'start', 'end', 'netClass', 'archive', 'restricted', 'shared']
+        available.extend(self.extrafields)
+
+        if fields is not None and outformat != 'xml':
+            try:
+                fields = projection(fields, available)
+            except ValueError:
+                # Send Error 400
+                messdict = {'code': 0,
+                            'message': 'Wrong value in the "fields" parameter (%s).' % fields}
+                message = json.dumps(messdict)
+                self.log.error(message)
+                raise cherrypy.HTTPError(400, message)
+        else:
+            # XML always needs the same fields
+            fields = available
+
+        # Select also the fields needed to page through the results and to add the extra fields
+        needed = set(fields)
+        if limit is not None or afterkey is not None:
+            needed.update(self.pagekey)
+        if len(self.extrafields):
+            needed.update(['code', 'start'])
+
+        netmatcher = None
+        if net is not None:
+            # List of codes and patterns (e.g. GE,4C_2011,Z*)
+            try:
+                netmatcher = CodeMatcher(net, extended=True)
+                if any(istemporary(code) and year is None for code, year in netmatcher.exact):
+                    raise ValueError
+            except ValueError:
+                # Send Error 400
+                messdict = {'code': 0,
+                            'message': 'Wrong network code (%s). Temporary codes must include the start year (e.g. 4C_2011).' % net}
+                message = json.dumps(messdict)
+                self.log.error(message)
+                raise cherrypy.HTTPError(400, message)
+
+        query, variables = self.query(needed, code=netmatcher, restricted=restricted, archive=archive,
+                                      netclass=netclass, shared=shared, starttime=starttime, endtime=endtime,
+                                      overlap=(timematch == 'overlap'), after=afterkey, limit=limit)
+
+        # Content coding accepted by the client. Every coding is a different representation
+        coding = Compressor.accepted()
+        # Canonical key of the request for the cache and the ETag
+        cachekey = ResponseCache.key('network', net=net, outformat=outformat, restricted=restricted,
+                                     archive=archive, netclass=netclass, shared=shared, starttime=starttime,
+                                     endtime=endtime, timematch=timematch, limit=limit, after=after,
+                                     fields=','.join(fields),
+                                     encoding=coding)
+        # Answer with a 304 if the client already has the current version
+        if self.inventory is not None:
+            self.inventory.validate(cachekey)
+
+        # Serve the response from the cache if it was already rendered
+        if self.cache is not None:
+            cached = self.cache.get(cachekey)
+            if cached is not None:
+                cherrypy.response.headers['Content-Type'] = cached[0]
+                cherrypy.response.headers.update(cached[2])
+                return cached[1]
+
+        # Only large results read from the DB while the response is sent are streamed
+        streamed = False
+        snapshot = self.inventory.snapshot if self.inventory is not None else None
+        if snapshot is not None:
+            result = snapshot.getnetworks(code=netmatcher, restricted=restricted, archive=archive,
+                                          netclass=netclass, shared=shared, starttime=naivedate(starttime),
+                                          endtime=naivedate(endtime), overlap=(timematch == 'overlap'),
+                                          after=afterkey, limit=limit)
+        else:
+            # Large results are read from the DB while the response is sent. Pages
+            # and responses to be cached are read at once to free the connection
+            result = self.pool.rows(query, variables, stream=(limit is None and self.cache is None))
+            streamed = not isinstance(result, list)
+
+        # Point to the next page if there are more rows
+        headers = dict()
+        if limit is not None:
+            # At most limit + 1 rows
+            result = list(itertools.islice(result, limit + 1))
+            if len(result) > limit:
+                result = result[:limit]
+                headers = nextpage(encodetoken([result[-1][field] for field in self.pagekey]))
+
+        # Complete SC3 data with local data
+        if len(self.extrafields):
+            result = (self.__complete(curnet) for curnet in result)
+
+        # The serializers keep only the fields requested
+        if outformat == 'xml':
+            contenttype = 'application/xml'
+            chunks = self.routing.routes(result)
+        else:
+            serializer = Serializer.get('network', fields, outformat)
+            contenttype = serializer.contenttype
+            chunks = serializer.chunks(result)
+
+        # Compress while streaming. Headers are saved with the body in the cache
+        headers['Vary'] = 'Accept-Encoding'
+        if coding is not None:
+            headers['Content-Encoding'] = coding
+            chunks = Compressor(coding).chunks(chunks)
+
+        cherrypy.response.headers['Content-Type'] = contenttype
+        cherrypy.response.headers.update(headers)
+        if self.cache is not None:
+            chunks = self.cache.tee(cachekey, contenttype, chunks, headers)
+        if not streamed:
+            # Rendered before the status is sent, so that an error is not sent as a truncated body
+            return b''.join(chunks)
+        # Send the body while it is being generated
+        cherrypy.response.stream = True
+        return chunks
+
+        # except:
+        #     # Send Error 404
+        #     messDict = {'code': 0,
+        #                 'message': 'Could not query the available networks'}
+        #     message = json.dumps(messDict)
+        #     self.log.error(message)
+        #     raise cherrypy.HTTPError(404, message)
+
+    def query(self, fields: set, code: CodeMatcher = None, restricted: int = None, archive: str = None,
+              netclass: str = None, shared: int = None, starttime: str = None, endtime: str = None,
+              overlap: bool = False, after: list = None, limit: int = None) -> tuple:
+        """Query selecting the networks which match the filters, sorted by the key of the pages.
+
+        The filters are the same as in InventorySnapshot.getnetworks.
+
+        :param fields: Fields to select
+        :type fields: set
+        :returns: The query and the values of its parameters
+        :rtype: tuple
+        """
+        columns = ['code', 'start', 'end', 'netClass', 'archive', 'restricted', 'shared', '_oid']
+        query = 'select ' + ', '.join(field for field in columns if field in fields) + ' from Network'
 
         whereclause = []
         variables = []
-        if net is not None:
-            if net[0] in '0123456789XYZ':
-                try:
-                    net, year = net.split('_')
-                except ValueError:
-                    # Send Error 400
-                    messdict = {'code': 0,
-                                'message': 'Wrong network code (%s). Temporary codes must include the start year (e.g. 4C_2011).' % net}
-                    message = json.dumps(messdict)
-                    self.log.error(message)
-                    raise cherrypy.HTTPError(400, message)
-
-                whereclause.append('YEAR(start)=%s')
-                variables.append(int(year))
-
-            whereclause.append('code=%s')
-            variables.append(net)
+        if code is not None:
+            clause, clausevars = code.sqlclause('code', 'start')
+            whereclause.append(clause)
+            variables.extend(clausevars)
 
         if restricted is not None:
             whereclause.append('restricted=%s')
@@ -717,78 +3473,46 @@ class NetworksAPI(object):
             whereclause.append('shared=%s')
             variables.append(shared)
 
-        if starttime is not None:
-            whereclause.append('start>=%s')
-            variables.append(starttime)
-
-        if endtime is not None:
-            whereclause.append('end<=%s')
-            variables.append(endtime)
+        if overlap:
+            if endtime is not None:
+                whereclause.append('start<=%s')
+                variables.append(endtime)
 
-        if len(whereclause):
-            query = query + ' where ' + ' and '.join(whereclause)
+            if starttime is not None:
+                whereclause.append('(end>=%s or end is NULL)')
+                variables.append(starttime)
+        else:
+            if starttime is not None:
+                whereclause.append('start>=%s')
+                variables.append(starttime)
 
-        # self.cursor = self.conn.cursor()
-        self.conn.execute(query, variables)
+            if endtime is not None:
+                whereclause.append('end<=%s')
+                variables.append(endtime)
 
-        # Complete SC3 data with local data
-        result = []
-        curnet = self.conn.fetchone()
-        while curnet:
-            for field in self.extrafields:
-                curnet[field] = self.netsuppl.get(curnet['code'] + '-' + str(curnet['start'].year),
-                                                  field, fallback=None)
-            result.append(curnet)
-            curnet = self.conn.fetchone()
+        # Keyset pagination. Only the rows after the last one returned
+        if after is not None:
+            whereclause.append('(%s)>(%s)' % (', '.join(self.pagecolumns), ', '.join(['%s'] * len(after))))
+            variables.extend(after)
 
-        if outformat == 'json':
-            cherrypy.response.headers['Content-Type'] = 'application/json'
+        if len(whereclause):
+            query = query + ' where ' + ' and '.join(whereclause)
 
-            return json.dumps(result, default=datetime.datetime.isoformat).encode('utf-8')
-        elif outformat == 'text':
-            cherrypy.response.headers['Content-Type'] = 'text/plain'
+        # Always in the same order, also without pages
+        query = query + ' order by ' + ', '.join(self.pagecolumns)
 
-            fout = io.StringIO("")
-            writer = csv.DictWriter(fout, fieldnames=fields, delimiter='|')
-            writer.writeheader()
-            writer.writerows(result)
-            fout.seek(0)
-            cherrypy.response.headers['Content-Type'] = 'text/plain'
-            return fout.read().encode('utf-8')
-        elif outformat == 'xml':
-            cherrypy.response.headers['Content-Type'] = 'application/xml'
+        if limit is not None:
+            # One more row to know if there is a next page
+            query = query + ' limit %s'
+            variables.append(limit + 1)
 
-            header = """<?xml version="1.0" encoding="utf-8"?>
-  <ns0:routing xmlns:ns0="http://geofon.gfz-potsdam.de/ns/Routing/1.0/">
-            """
-            footer = """</ns0:routing>"""
-
-            outxml = [header]
-            for net in result:
-                routetext = """
- <ns0:route networkCode="{netcode}" stationCode="*" locationCode="*" streamCode="*">
-  <ns0:station address="https://geofon.gfz.de/fdsnws/station/1/query" priority="1" start="{netstart}" end="{netend}" />
-  <ns0:wfcatalog address="https://geofon.gfz.de/eidaws/wfcatalog/1/query" priority="1" start="{netstart}" end="{netend}" />
-  <ns0:dataselect address="https://geofon.gfz.de/fdsnws/dataselect/1/query" priority="1" start="{netstart}" end="{netend}" />
-  <ns0:availability address="https://geofon.gfz.de/fdsnws/availability/1/query" priority="1" start="{netstart}" end="{netend}" />
- </ns0:route>
- """
-                nc = net['code']
-                ns = net['start'].isoformat()
-                ne = net['end'].isoformat() if net['end'] is not None else ''
-                outxml.append(routetext.format(netcode=nc, netstart=ns, netend=ne))
-
-            outxml.append(footer)
-
-            return ''.join(outxml).encode('utf-8')
+        return query, variables
 
-        # except:
-        #     # Send Error 404
-        #     messDict = {'code': 0,
-        #                 'message': 'Could not query the available networks'}
-        #     message = json.dumps(messDict)
-        #     self.log.error(message)
-        #     raise cherrypy.HTTPError(404, message)
+    def __complete(self, curnet: dict) -> dict:
+        for field in self.extrafields:
+            curnet[field] = self.netsuppl.get(curnet['code'] + '-' + str(curnet['start'].year),
+                                              field, fallback=None)
+        return curnet
 
 
 @cherrypy.expose
@@ -796,10 +3520,22 @@ class NetworksAPI(object):
 class VirtualNetsAPI(object):
     """Object dispatching methods related to virtual networks."""
 
-    def __init__(self, host: str, user: str, password: str, db: str):
-        """Constructor of the NetworksAPI class."""
-        # Save connection
-        self.conn = SC3dbconnection(host, user, password, db)
+    # Key of the rows to page through the results and its columns in the query.
+    # The _oid makes the key unique
+    pagekey = ['code', 'start', '_oid']
+    pagecolumns = ['code', 'start', '_oid']
+
+    def __init__(self, pool: SC3dbpool, inventory: Inventory = None, cache: ResponseCache = None,
+                 routing: RoutingXML = None):
+        """Constructor of the VirtualNetsAPI class."""
+        # Save the pool of connections
+        self.pool = pool
+        # Snapshot of the inventory in memory (if configured)
+        self.inventory = inventory
+        # Cache of rendered responses (if configured)
+        self.cache = cache
+        # Renderer of the XML output with the services of the data center
+        self.routing = routing if routing is not None else RoutingXML()
         self.log = logging.getLogger('VirtualNetAPI')
 
         # Get extra fields from the cfg file
@@ -808,10 +3544,11 @@ class VirtualNetsAPI(object):
 
     @cherrypy.expose
     def index(self, net: str = None, outformat: str = 'json', typevn: str = None,
-              starttime: str=None, endtime: str = None, **kwargs):
+              starttime: str=None, endtime: str = None, timematch: str = 'contained', limit: str = None,
+              after: str = None, fields: str = None, **kwargs):
         """List available networks in the system.
 
-        :param net: Network code
+        :param net: Virtual network codes separated by commas (wildcards "*" and "?" are allowed)
         :type net: str
         :param outformat: Output format (json, text)
         :type outformat: str
@@ -821,6 +3558,14 @@ class VirtualNetsAPI(object):
         :type starttime: str
         :param endtime: End time in isoformat
         :type endtime: str
+        :param timematch: Epochs contained in the time window ('contained') or overlapping it ('overlap')
+        :type timematch: str
+        :param limit: Maximum number of virtual networks to return
+        :type limit: str
+        :param after: Continuation token received with the previous page
+        :type after: str
+        :param fields: Fields to include in the output separated by commas (not in XML)
+        :type fields: str
         :returns: Data related to the available networks.
         :rtype: utf-8 encoded string
         :raises: cherrypy.HTTPError
@@ -869,77 +3614,154 @@ class VirtualNetsAPI(object):
                 self.log.error(message)
                 raise cherrypy.HTTPError(400, message)
 
-        # try:
-        query = 'select code, start, end, type from StationGroup'
-        fields = ['code', 'start', 'end', 'type']
-
-        whereclause = []
-        variables = []
-        if net is not None:
-            whereclause.append('code=%s')
-            variables.append(net)
-
-        if typevn is not None:
-            whereclause.append('type=%s')
-            variables.append(typevn)
-
-        if starttime is not None:
-            whereclause.append('start>=%s')
-            variables.append(starttime)
-
-        if endtime is not None:
-            whereclause.append('end<=%s')
-            variables.append(endtime)
-
-        if len(whereclause):
-            query = query + ' where ' + ' and '.join(whereclause)
+        if timematch not in ['contained', 'overlap']:
+            # Send Error 400
+            messdict = {'code': 0,
+                        'message': 'Wrong value in the "timematch" parameter.'}
+            message = json.dumps(messdict)
+            self.log.error(message)
+            raise cherrypy.HTTPError(400, message)
 
-        # self.cursor = self.conn.cursor()
-        self.conn.execute(query, variables)
+        if limit is not None:
+            try:
+                limit = int(limit)
+                if limit < 1:
+                    raise Exception
+            except Exception:
+                # Send Error 400
+                messdict = {'code': 0,
+                            'message': 'Wrong value in the "limit" parameter (%s).' % limit}
+                message = json.dumps(messdict)
+                self.log.error(message)
+                raise cherrypy.HTTPError(400, message)
 
-        # Retrieve all virtual networks
-        result = self.conn.fetchall()
+        afterkey = None
+        if after is not None:
+            try:
+                afterkey = decodetoken(after, self.pagekey)
+            except ValueError:
+                # Send Error 400
+                messdict = {'code': 0,
+                            'message': 'Wrong value in the "after" parameter.'}
+                message = json.dumps(messdict)
+                self.log.error(message)
+                raise cherrypy.HTTPError(400, message)
 
-        if outformat == 'json':
-            return json.dumps(result,
-                              default=datetime.datetime.isoformat).encode('utf-8')
-        elif outformat == 'text':
-            fout = io.StringIO("")
-            writer = csv.DictWriter(fout, fieldnames=fields, delimiter='|')
-            writer.writeheader()
-            writer.writerows(result)
-            fout.seek(0)
-            cherrypy.response.headers['Content-Type'] = 'text/plain'
-            return fout.read().encode('utf-8')
-        elif outformat == 'xml':
-            cherrypy.response.headers['Content-Type'] = 'application/xml'
+        # try:
+        available = ['code', 'start', 'end', 'type']
 
-            header = """<?xml version="1.0" encoding="utf-8"?>
-     <ns0:routing xmlns:ns0="http://geofon.gfz-potsdam.de/ns/Routing/1.0/">
-               """
-            footer = """</ns0:routing>"""
+        if fields is not None and outformat != 'xml':
+            try:
+                fields = projection(fields, available)
+            except ValueError:
+                # Send Error 400
+                messdict = {'code': 0,
+                            'message': 'Wrong value in the "fields" parameter (%s).' % fields}
+                message = json.dumps(messdict)
+                self.log.error(message)
+                raise cherrypy.HTTPError(400, message)
+        else:
+            # XML always needs the same fields
+            fields = available
 
-            outxml = [header]
-            for vn in result:
-                routetext = """
-    <ns0:vnetwork networkCode="{vncode}">
-    </ns0:vnetwork>
-    """
-                vncode = vn['code']
-                outxml.append(routetext.format(vncode=vncode))
+        # Select also the fields needed to page through the results
+        needed = set(fields)
+        if limit is not None or afterkey is not None:
+            needed.update(self.pagekey)
 
-            outxml.append(footer)
+        vnetmatcher = None
+        if net is not None:
+            try:
+                vnetmatcher = CodeMatcher(net)
+            except ValueError:
+                # Send Error 400
+                messdict = {'code': 0,
+                            'message': 'Wrong virtual network code (%s).' % net}
+                message = json.dumps(messdict)
+                self.log.error(message)
+                raise cherrypy.HTTPError(400, message)
 
-            return ''.join(outxml).encode('utf-8')
+        query, variables = self.query(needed, code=vnetmatcher, typevn=typevn, starttime=starttime,
+                                      endtime=endtime, overlap=(timematch == 'overlap'), after=afterkey,
+                                      limit=limit)
+
+        # Content coding accepted by the client. Every coding is a different representation
+        coding = Compressor.accepted()
+        # Canonical key of the request for the cache and the ETag
+        cachekey = ResponseCache.key('virtualnet', net=net, outformat=outformat, typevn=typevn, starttime=starttime,
+                                     endtime=endtime, timematch=timematch, limit=limit, after=after,
+                                     fields=','.join(fields),
+                                     encoding=coding)
+        # Answer with a 304 if the client already has the current version
+        if self.inventory is not None:
+            self.inventory.validate(cachekey)
+
+        # Serve the response from the cache if it was already rendered
+        if self.cache is not None:
+            cached = self.cache.get(cachekey)
+            if cached is not None:
+                cherrypy.response.headers['Content-Type'] = cached[0]
+                cherrypy.response.headers.update(cached[2])
+                return cached[1]
+
+        # Only large results read from the DB while the response is sent are streamed
+        streamed = False
+        snapshot = self.inventory.snapshot if self.inventory is not None else None
+        if snapshot is not None:
+            result = snapshot.getvnets(code=vnetmatcher, typevn=typevn, starttime=naivedate(starttime),
+                                       endtime=naivedate(endtime), overlap=(timematch == 'overlap'),
+                                       after=afterkey, limit=limit)
+        else:
+            # Large results are read from the DB while the response is sent. Pages
+            # and responses to be cached are read at once to free the connection
+            result = self.pool.rows(query, variables, stream=(limit is None and self.cache is None))
+            streamed = not isinstance(result, list)
+
+        # Point to the next page if there are more rows
+        headers = dict()
+        if limit is not None:
+            # At most limit + 1 rows
+            result = list(itertools.islice(result, limit + 1))
+            if len(result) > limit:
+                result = result[:limit]
+                headers = nextpage(encodetoken([result[-1][field] for field in self.pagekey]))
+
+        # The serializers keep only the fields requested
+        if outformat == 'xml':
+            contenttype = 'application/xml'
+            chunks = self.routing.vnetworks(result)
+        else:
+            serializer = Serializer.get('virtualnet', fields, outformat)
+            contenttype = serializer.contenttype
+            chunks = serializer.chunks(result)
+
+        # Compress while streaming. Headers are saved with the body in the cache
+        headers['Vary'] = 'Accept-Encoding'
+        if coding is not None:
+            headers['Content-Encoding'] = coding
+            chunks = Compressor(coding).chunks(chunks)
+
+        cherrypy.response.headers['Content-Type'] = contenttype
+        cherrypy.response.headers.update(headers)
+        if self.cache is not None:
+            chunks = self.cache.tee(cachekey, contenttype, chunks, headers)
+        if not streamed:
+            # Rendered before the status is sent, so that an error is not sent as a truncated body
+            return b''.join(chunks)
+        # Send the body while it is being generated
+        cherrypy.response.stream = True
+        return chunks
 
     @cherrypy.expose
-    def stations(self, net: str, outformat: str = 'json', **kwargs):
+    def stations(self, net: str, outformat: str = 'json', fields: str = None, **kwargs):
         """List available networks in the system.
 
         :param net: Network code
         :type net: str
-        :param outformat: Output format (json, text)
+        :param outformat: Output format (json, text, xml, ndjson, geojson)
         :type outformat: str
+        :param fields: Fields to include in the output separated by commas (not in XML)
+        :type fields: str
         :returns: List of stations in the virtual network.
         :rtype: utf-8 encoded string
         :raises: cherrypy.HTTPError
@@ -956,7 +3778,7 @@ class VirtualNetsAPI(object):
         cherrypy.response.headers['Content-Type'] = 'application/json'
 
         try:
-            if outformat not in ['json', 'text', 'xml']:
+            if outformat not in ['json', 'text', 'xml', 'ndjson', 'geojson']:
                 raise Exception
         except Exception:
             # Send Error 400
@@ -967,82 +3789,449 @@ class VirtualNetsAPI(object):
             raise cherrypy.HTTPError(400, message)
 
         # try:
-        query = 'select ne.code as network, st.code as station, st.start as start, st.end as end ' + \
+        available = ['network', 'station', 'start', 'end']
+
+        if fields is not None and outformat != 'xml':
+            try:
+                fields = projection(fields, available)
+            except ValueError:
+                # Send Error 400
+                messdict = {'code': 0,
+                            'message': 'Wrong value in the "fields" parameter (%s).' % fields}
+                message = json.dumps(messdict)
+                self.log.error(message)
+                raise cherrypy.HTTPError(400, message)
+        else:
+            # XML always needs the same fields
+            fields = available
+
+        # Select also the coordinates for the geometry in GeoJSON
+        selected = [field for field in available if field in fields]
+        if outformat == 'geojson':
+            selected.extend(['latitude', 'longitude'])
+        query, variables = self.stationsquery(net, selected)
+
+        # Content coding accepted by the client. Every coding is a different representation
+        coding = Compressor.accepted()
+        # Canonical key of the request for the cache and the ETag
+        cachekey = ResponseCache.key('vnetstations', net=net, outformat=outformat, fields=','.join(fields),
+                                     encoding=coding)
+        # Answer with a 304 if the client already has the current version
+        if self.inventory is not None:
+            self.inventory.validate(cachekey)
+
+        # Serve the response from the cache if it was already rendered
+        if self.cache is not None:
+            cached = self.cache.get(cachekey)
+            if cached is not None:
+                cherrypy.response.headers['Content-Type'] = cached[0]
+                cherrypy.response.headers.update(cached[2])
+                return cached[1]
+
+        # Only large results read from the DB while the response is sent are streamed
+        streamed = False
+        snapshot = self.inventory.snapshot if self.inventory is not None else None
+        if snapshot is not None:
+            result = snapshot.getvnetstations(net, coordinates=(outformat == 'geojson'))
+        else:
+            # Large results are read from the DB while the response is sent. Responses
+            # to be cached are read at once to free the connection
+            result = self.pool.rows(query, variables, stream=(self.cache is None))
+            streamed = not isinstance(result, list)
+
+        # The serializers keep only the fields requested
+        if outformat == 'xml':
+            contenttype = 'application/xml'
+            chunks = self.routing.vnetstreams(net, result)
+        else:
+            serializer = Serializer.get('vnetstations', fields, outformat)
+            contenttype = serializer.contenttype
+            chunks = serializer.chunks(result)
+
+        # Compress while streaming. Headers are saved with the body in the cache
+        headers = {'Vary': 'Accept-Encoding'}
+        if coding is not None:
+            headers['Content-Encoding'] = coding
+            chunks = Compressor(coding).chunks(chunks)
+
+        cherrypy.response.headers['Content-Type'] = contenttype
+        cherrypy.response.headers.update(headers)
+        if self.cache is not None:
+            chunks = self.cache.tee(cachekey, contenttype, chunks, headers)
+        if not streamed:
+            # Rendered before the status is sent, so that an error is not sent as a truncated body
+            return b''.join(chunks)
+        # Send the body while it is being generated
+        cherrypy.response.stream = True
+        return chunks
+
+
+    def query(self, fields: set, code: CodeMatcher = None, typevn: str = None, starttime: str = None,
+              endtime: str = None, overlap: bool = False, after: list = None, limit: int = None) -> tuple:
+        """Query selecting the virtual networks which match the filters, sorted by the key of the pages.
+
+        The filters are the same as in InventorySnapshot.getvnets.
+
+        :param fields: Fields to select
+        :type fields: set
+        :returns: The query and the values of its parameters
+        :rtype: tuple
+        """
+        columns = ['code', 'start', 'end', 'type', '_oid']
+        query = 'select ' + ', '.join(field for field in columns if field in fields) + ' from StationGroup'
+
+        whereclause = []
+        variables = []
+        if code is not None:
+            clause, clausevars = code.sqlclause('code')
+            whereclause.append(clause)
+            variables.extend(clausevars)
+
+        if typevn is not None:
+            whereclause.append('type=%s')
+            variables.append(typevn)
+
+        if overlap:
+            if endtime is not None:
+                whereclause.append('start<=%s')
+                variables.append(endtime)
+
+            if starttime is not None:
+                whereclause.append('(end>=%s or end is NULL)')
+                variables.append(starttime)
+        else:
+            if starttime is not None:
+                whereclause.append('start>=%s')
+                variables.append(starttime)
+
+            if endtime is not None:
+                whereclause.append('end<=%s')
+                variables.append(endtime)
+
+        # Keyset pagination. Only the rows after the last one returned
+        if after is not None:
+            whereclause.append('(%s)>(%s)' % (', '.join(self.pagecolumns), ', '.join(['%s'] * len(after))))
+            variables.extend(after)
+
+        if len(whereclause):
+            query = query + ' where ' + ' and '.join(whereclause)
+
+        # Always in the same order, also without pages
+        query = query + ' order by ' + ', '.join(self.pagecolumns)
+
+        if limit is not None:
+            # One more row to know if there is a next page
+            query = query + ' limit %s'
+            variables.append(limit + 1)
+
+        return query, variables
+
+    def stationsquery(self, code: str, fields: list) -> tuple:
+        """Query selecting the stations of a virtual network in the order of its members.
+
+        :param code: Code of the virtual network
+        :type code: str
+        :param fields: Fields to select (network, station, start, end, latitude, longitude)
+        :type fields: list
+        :returns: The query and the values of its parameters
+        :rtype: tuple
+        """
+        # Expression in the query of every field
+        columns = {'network': 'ne.code as network', 'station': 'st.code as station',
+                   'start': 'st.start as start', 'end': 'st.end as end',
+                   'latitude': 'st.latitude as latitude', 'longitude': 'st.longitude as longitude'}
+        query = 'select ' + ', '.join(columns[field] for field in fields) + ' ' + \
             'from StationGroup as sg join StationReference as sr join PublicObject as po ' + \
             'join Station as st join  Network as ne'
 
-        fields = ['network', 'station', 'start', 'end']
-
         whereclause = ['sg._oid = sr._parent_oid',
                        'po.publicID = sr.stationID',
                        'st._oid = po._oid',
                        'st._parent_oid = ne._oid']
         variables = []
         whereclause.append('sg.code=%s')
-        variables.append(net)
+        variables.append(code)
 
         if len(whereclause):
             query = query + ' where ' + ' and '.join(whereclause)
+        # Same order as the members in the snapshot
+        query = query + ' order by sg._oid, sr._oid'
 
-        # self.cursor = self.conn.cursor()
-        self.conn.execute(query, variables)
+        return query, variables
 
-        # Retrieve all VNs
-        result = self.conn.fetchall()
+@cherrypy.expose
+class RoutingAPI(object):
+    """Object dispatching the routing document of the data center."""
+
+    def __init__(self, pool: SC3dbpool, inventory: Inventory = None, cache: ResponseCache = None,
+                 routing: RoutingXML = None, rules: RoutingRules = None):
+        """Constructor of the RoutingAPI class."""
+        # Save the pool of connections
+        self.pool = pool
+        # Snapshot of the inventory in memory (if configured)
+        self.inventory = inventory
+        # Cache of rendered responses (if configured)
+        self.cache = cache
+        # Renderer of the XML output with the services of the data center
+        self.routing = routing if routing is not None else RoutingXML()
+        # Rules applied if none are sent in the request
+        self.rules = rules if rules is not None else RoutingRules()
+        self.log = logging.getLogger('RoutingAPI')
 
-        if outformat == 'json':
-            return json.dumps(result,
-                              default=datetime.datetime.isoformat).encode('utf-8')
-        elif outformat == 'text':
-            fout = io.StringIO("")
-            writer = csv.DictWriter(fout, fieldnames=fields, delimiter='|')
-            writer.writeheader()
-            writer.writerows(result)
-            fout.seek(0)
-            cherrypy.response.headers['Content-Type'] = 'text/plain'
-            return fout.read().encode('utf-8')
-        elif outformat == 'xml':
-            cherrypy.response.headers['Content-Type'] = 'application/xml'
+    @cherrypy.expose
+    def index(self, archive: str = None, shared: str = None, vnets: str = None, **kwargs):
+        """Return the document for a Routing Service with all the routes of the data center.
 
-            header = """<?xml version="1.0" encoding="utf-8"?>
-     <ns0:routing xmlns:ns0="http://geofon.gfz-potsdam.de/ns/Routing/1.0/">
-     <ns0:vnetwork networkCode="%s">
-               """
-            footer = """</ns0:vnetwork>\n</ns0:routing>"""
+        It includes the routes to the networks, to the stations listed in the
+        rules and, if requested, the virtual networks, as routesfromSC3 does.
+        The rules (the content of a rules.cfg file) can be sent as plain text in
+        the body of a POST request. Otherwise, the configured ones are applied.
+
+        :param archive: Keep only networks and stations from this archive
+        :type archive: str
+        :param shared: Keep only networks and stations shared (1) or not (0)
+        :type shared: str
+        :param vnets: Include the virtual networks (1) or not (0)
+        :type vnets: str
+        :returns: Routing document in XML format
+        :rtype: utf-8 encoded string
+        :raises: cherrypy.HTTPError
+        """
+        if len(kwargs):
+            # Send Error 400
+            messdict = {'code': 0,
+                        'message': 'Unknown parameter(s) "{}".'.format(kwargs.items())}
+            message = json.dumps(messdict)
+            self.log.error(message)
+            raise cherrypy.HTTPError(400, message)
+
+        # Check parameters
+        if shared is not None:
+            try:
+                shared = int(shared)
+                if shared not in [0, 1]:
+                    raise Exception
+            except Exception:
+                # Send Error 400
+                messdict = {'code': 0,
+                            'message': 'Shared does not seem to be 0 or 1.'}
+                message = json.dumps(messdict)
+                self.log.error(message)
+                raise cherrypy.HTTPError(400, message)
 
-            outxml = [header % net]
-            for stream in result:
-                streamtext = '<ns0:stream networkCode="{netcode}" stationCode="{stacode}" locationCode="*" streamCode="*" start="{starttime}" end="{endtime}" />\n'
-                netcode = stream['network']
-                stacode = stream['station']
-                starttime = stream['start'].isoformat()
-                try:
-                    str2date(stream['end'])
-                    endtime = stream['end'].isoformat()
-                except Exception:
-                    endtime = ''
-                outxml.append(streamtext.format(netcode=netcode, stacode=stacode, starttime=starttime, endtime=endtime))
+        try:
+            vnets = int(vnets) if vnets is not None else 0
+            if vnets not in [0, 1]:
+                raise Exception
+        except Exception:
+            # Send Error 400
+            messdict = {'code': 0,
+                        'message': 'Wrong value in the "vnets" parameter (%s).' % vnets}
+            message = json.dumps(messdict)
+            self.log.error(message)
+            raise cherrypy.HTTPError(400, message)
 
-            outxml.append(footer)
+        rules = self.rules
+        if cherrypy.request.method == 'POST':
+            try:
+                rules = RoutingRules(cherrypy.request.body.read().decode('utf-8'))
+            except (ValueError, UnicodeDecodeError) as e:
+                # Send Error 400
+                messdict = {'code': 0,
+                            'message': 'Wrong rules in the body of the request. %s' % e}
+                message = json.dumps(messdict)
+                self.log.error(message)
+                raise cherrypy.HTTPError(400, message)
 
-            return ''.join(outxml).encode('utf-8')
+        # Content coding accepted by the client. Every coding is a different representation
+        coding = Compressor.accepted()
+        # Canonical key of the request for the cache and the ETag
+        cachekey = ResponseCache.key('routing', archive=archive, shared=shared, vnets=vnets, rules=rules.digest,
+                                     encoding=coding)
+        # Answer with a 304 if the client already has the current version
+        if self.inventory is not None:
+            self.inventory.validate(cachekey)
+
+        # Serve the response from the cache if it was already rendered
+        if self.cache is not None:
+            cached = self.cache.get(cachekey)
+            if cached is not None:
+                cherrypy.response.headers['Content-Type'] = cached[0]
+                cherrypy.response.headers.update(cached[2])
+                return cached[1]
+
+        snapshot = self.inventory.snapshot if self.inventory is not None else None
+        if snapshot is not None:
+            networks, stations, vnetworks = self.__fromsnapshot(snapshot, rules, archive, shared, vnets)
+        else:
+            networks, stations, vnetworks = self.__fromdb(rules, archive, shared, vnets)
+
+        contenttype = 'application/xml'
+        chunks = self.__xmlchunks(networks, stations, vnetworks, rules, archive, shared)
+
+        # Headers are saved with the body in the cache
+        headers = {'Vary': 'Accept-Encoding'}
+        if coding is not None:
+            headers['Content-Encoding'] = coding
+            chunks = Compressor(coding).chunks(chunks)
+
+        cherrypy.response.headers['Content-Type'] = contenttype
+        cherrypy.response.headers.update(headers)
+        if self.cache is not None:
+            chunks = self.cache.tee(cachekey, contenttype, chunks, headers)
+        # All rows are already in memory. Rendered before the status is sent
+        return b''.join(chunks)
+
+    @staticmethod
+    def __netmatcher(rules: RoutingRules) -> Union[CodeMatcher, None]:
+        # Networks of all the stations to include, to preselect them
+        if not len(rules.stations2add):
+            return None
+        return CodeMatcher(','.join(netsta.split('.')[0] for netsta, _, _ in rules.stations2add), extended=True)
+
+    def __fromsnapshot(self, snapshot: InventorySnapshot, rules: RoutingRules, archive: str, shared: int,
+                       vnets: int) -> tuple:
+        networks = snapshot.getnetworks()
+
+        netmatcher = self.__netmatcher(rules)
+        stations = list()
+        if netmatcher is not None:
+            stations = snapshot.getstations(net=netmatcher, archive=archive, shared=shared, netstart=True)
+
+        vnetworks = list()
+        if vnets:
+            for code in sorted(set(vnet['code'] for vnet in snapshot.getvnets())):
+                vnetworks.append((code, snapshot.getvnetstations(code)))
+
+        return networks, stations, vnetworks
+
+    def __fromdb(self, rules: RoutingRules, archive: str, shared: int, vnets: int) -> tuple:
+        # All the queries with the same connection
+        with self.pool.connection() as conn:
+            # All networks are needed to find the start year of the temporary ones. Sorted
+            # as in the "network" method
+            conn.execute('select code, start, end, archive, shared from Network order by code, start, _oid', [])
+            networks = list(conn.fetchall())
+
+            netmatcher = self.__netmatcher(rules)
+            stations = list()
+            if netmatcher is not None:
+                whereclause = ['S._parent_oid=N._oid']
+                clause, variables = netmatcher.sqlclause('N.code', 'N.start')
+                whereclause.append(clause)
+
+                if archive is not None:
+                    whereclause.append('S.archive=%s')
+                    variables.append(archive)
+
+                if shared is not None:
+                    whereclause.append('S.shared=%s')
+                    variables.append(shared)
+
+                # Sorted as in the "station" method
+                conn.execute('select N.code as network, N.start as netstart, S.code as code, S.start as start, '
+                             'S.end as end '
+                             'from Station as S join Network as N where ' + ' and '.join(whereclause) +
+                             ' order by N.code, S.code, S.start, N.start, S._oid', variables)
+                stations = list(conn.fetchall())
+
+            vnetworks = list()
+            if vnets:
+                conn.execute('select code from StationGroup', [])
+                members = {row['code']: [] for row in conn.fetchall()}
+                # Same order as the "stations" method of virtualnet
+                conn.execute('select sg.code as vnet, ne.code as network, st.code as station, st.start as start '
+                             'from StationGroup as sg join StationReference as sr join PublicObject as po '
+                             'join Station as st join Network as ne where sg._oid = sr._parent_oid and '
+                             'po.publicID = sr.stationID and st._oid = po._oid and st._parent_oid = ne._oid '
+                             'order by sg._oid, sr._oid', [])
+                for row in conn.fetchall():
+                    members.setdefault(row['vnet'], []).append(row)
+                vnetworks = sorted(members.items())
+
+        return networks, stations, vnetworks
+
+    def __xmlchunks(self, networks: list, stations: list, vnetworks: list, rules: RoutingRules,
+                    archive: str = None, shared: int = None, size: int = 1000):
+        routing = self.routing
+
+        outxml = [routing.header]
+        # Networks and stations are already sorted by the key of their pages
+        for net in networks:
+            if archive is not None and net['archive'] != archive:
+                continue
+            if shared is not None and net['shared'] != shared:
+                continue
+            netcode = extendedcode(net['code'], net['start'])
+            if netcode in rules.nets2skip:
+                continue
+            outxml.append(routing.route(net['code'], '*', net['start'], net['end'], rules.priority(netcode)))
+            if len(outxml) >= size:
+                yield ''.join(outxml).encode('utf-8')
+                outxml = []
+
+        # Stations are included by the year of the network epoch they belong to (as in
+        # the "station" method), but skipped and prioritized by their extended code
+        # with the year of their own start (as in routesfromSC3)
+        candidates = list()
+        for sta in stations:
+            candidates.append((sta, sta['netstart'].year,
+                               '%s.%s' % (extendedcode(sta['network'], sta['start']), sta['code'])))
+
+        # Routes to the stations in the same order as the rules to include them
+        for netsta, netmatcher, stamatcher in rules.stations2add:
+            for sta, year, stacode in candidates:
+                if not netmatcher.match(sta['network'], year) or not stamatcher.match(sta['code']):
+                    continue
+                if stacode in rules.stations2skip:
+                    continue
+                outxml.append(routing.route(sta['network'], sta['code'], sta['start'], sta['end'],
+                                            rules.priority(stacode)))
+                if len(outxml) >= size:
+                    yield ''.join(outxml).encode('utf-8')
+                    outxml = []
+
+        # Once per code, with the streams of all its epochs
+        for code, members in vnetworks:
+            if code in rules.vnets2skip:
+                continue
+            outxml.append(routing.vnetwork(code, members))
+            if len(outxml) >= size:
+                yield ''.join(outxml).encode('utf-8')
+                outxml = []
+
+        outxml.append(routing.footer)
+        yield ''.join(outxml).encode('utf-8')
 
 
 class SC3MicroApi(object):
     """Main class including the dispatcher."""
 
-    def __init__(self, host, user, password, db):
+    def __init__(self, pool: SC3dbpool, inventory: Inventory = None, cache: ResponseCache = None,
+                 accesscache: AccessCache = None, routing: RoutingXML = None, rules: RoutingRules = None):
         """Constructor of the SC3MicroApi object."""
         # config = configparser.RawConfigParser()
         # here = os.path.dirname(__file__)
         # config.read(os.path.join(here, 'sc3microapi.cfg'))
 
-        self.network = NetworksAPI(host, user, password, db)
-        self.station = StationsAPI(host, user, password, db)
-        self.virtualnet = VirtualNetsAPI(host, user, password, db)
-        self.access = AccessAPI(host, user, password, db)
+        # All APIs share the same pool of connections, inventory snapshot, cache and routing renderer
+        routing = routing if routing is not None else RoutingXML()
+        self.network = NetworksAPI(pool, inventory, cache, routing)
+        self.station = StationsAPI(pool, inventory, cache, routing)
+        self.virtualnet = VirtualNetsAPI(pool, inventory, cache, routing)
+        self.access = AccessAPI(pool, accesscache, inventory)
+        self.routing = RoutingAPI(pool, inventory, cache, routing, rules)
+        self.cache = cache
+        self.accesscache = accesscache
         self.log = logging.getLogger('SC3MicroAPI')
 
+        # Rendered responses are not valid anymore after a change in the inventory
+        if inventory is not None and cache is not None:
+            inventory.register(cache.invalidate)
+        # Decisions are not valid anymore after a change in the permissions or networks
+        if inventory is not None and accesscache is not None:
+            inventory.register(accesscache.invalidate, ['Access', 'Network'])
+
     @cherrypy.expose
     def index(self):
         cherrypy.response.headers['Content-Type'] = 'text/html'
@@ -1061,6 +4250,23 @@ class SC3MicroApi(object):
 
         return texthelp.encode('utf-8')
 
+    @cherrypy.expose
+    def stats(self):
+        """Return the counters of the caches used by the service.
+
+        :returns: Entries, size, hits, misses and evictions of every cache
+        :rtype: utf-8 encoded string
+        """
+        result = dict()
+        if self.cache is not None:
+            result['responses'] = self.cache.stats()
+        if self.accesscache is not None:
+            result['access'] = self.accesscache.stats()
+        result['serializers'] = Serializer.registry.stats()
+
+        cherrypy.response.headers['Content-Type'] = 'application/json'
+        return json.dumps(result).encode('utf-8')
+
     @cherrypy.expose
     def version(self):
         """Return the version of this implementation.
@@ -1093,7 +4299,56 @@ def main():
     user = config.get('mysql', 'user')
     password = config.get('mysql', 'password')
     db = config.get('mysql', 'db')
-    
+    poolmin = config.getint('mysql', 'poolmin', fallback=1)
+    poolmax = config.getint('mysql', 'poolmax', fallback=10)
+    pooltimeout = config.getfloat('mysql', 'pooltimeout', fallback=30.0)
+    poolstreams = config.getint('mysql', 'poolstreams', fallback=poolmax // 2)
+    pool = SC3dbpool(host, user, password, db, minsize=poolmin, maxsize=poolmax, timeout=pooltimeout,
+                     maxstreams=poolstreams)
+
+    # Cache of rendered responses
+    cache = None
+    if config.getboolean('Cache', 'enabled', fallback=False):
+        ttl = config.getfloat('Cache', 'ttl', fallback=300.0)
+        ttls = {endpoint: config.getfloat('Cache', endpoint, fallback=ttl)
+                for endpoint in ['network', 'station', 'virtualnet', 'vnetstations', 'routing']}
+        cache = ResponseCache(maxentries=config.getint('Cache', 'maxentries', fallback=1000),
+                              maxbytes=config.getint('Cache', 'maxbytes', fallback=64 * 1024 * 1024),
+                              ttl=ttl, ttls=ttls)
+
+    # Cache of access decisions
+    accesscache = None
+    if config.getboolean('AccessCache', 'enabled', fallback=False):
+        accesscache = AccessCache(maxentries=config.getint('AccessCache', 'maxentries', fallback=10000),
+                                  allow=config.getfloat('AccessCache', 'allow', fallback=300.0),
+                                  deny=config.getfloat('AccessCache', 'deny', fallback=60.0),
+                                  notfound=config.getfloat('AccessCache', 'notfound', fallback=60.0))
+
+    # Library encoding the JSON formats (json, orjson or auto to use orjson if installed)
+    jsonbackend = config.get('Output', 'jsonbackend', fallback='json')
+    if jsonbackend == 'auto':
+        jsonbackend = 'orjson' if orjson is not None else 'json'
+    if jsonbackend == 'json' or (jsonbackend == 'orjson' and orjson is not None):
+        Serializer.backend = jsonbackend
+    else:
+        logging.getLogger('main').warning('JSON backend %s not available. Using %s.' %
+                                          (jsonbackend, Serializer.backend))
+
+    # Services of the data center in the routes of the XML output
+    routing = RoutingXML.fromconfig(config)
+    # Rules applied to the routing document if none are sent with the request
+    rulesfile = config.get('Routing', 'rules', fallback=None)
+    rules = RoutingRules.fromfile(rulesfile) if rulesfile else None
+
+    # Track the changes in the inventory to invalidate the caches and build the ETags.
+    # Keep the inventory in memory if requested. The tables are polled only if needed
+    snapshot = config.getboolean('Inventory', 'snapshot', fallback=False)
+    entitlements = config.getboolean('Inventory', 'entitlements', fallback=False)
+    inventory = None
+    if snapshot or entitlements or cache is not None or accesscache is not None:
+        inventory = Inventory(pool, config.getfloat('Inventory', 'refresh', fallback=300.0), snapshot,
+                              entitlements)
+
     server_config = {
         'global': {
             'tools.proxy.on': True,
@@ -1104,7 +4359,10 @@ def main():
     }
     # Update the global CherryPy configuration
     cherrypy.config.update(server_config)
-    cherrypy.tree.mount(SC3MicroApi(host, user, password, db), '/sc3microapi')
+    cherrypy.tree.mount(SC3MicroApi(pool, inventory, cache, accesscache, routing, rules), '/sc3microapi')
+    if inventory is not None:
+        inventory.subscribe(cherrypy.engine)
+    cherrypy.engine.subscribe('stop', pool.close)
 
     # plugins.Daemonizer(cherrypy.engine).subscribe()
     if hasattr(cherrypy.engine, 'signal_handler'):
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+"""Microbenchmarks of the serializers of the listing methods
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2017 Javier Quinteros, GEOFON, GFZ Potsdam <geofon@gfz-potsdam.de>
+   :License:
+       GPLv3
+   :Platform:
+       Linux
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import sys
+import os
+import io
+import csv
+import json
+import time
+import datetime
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sc3microapi'))
+from sc3microapi import Serializer
+from sc3microapi import orjson
+
+fields = ['network', 'code', 'latitude', 'longitude', 'elevation',
+          'place', 'country', 'start', 'end', 'restricted', 'shared']
+
+
+def stations(numrows: int) -> list:
+    """Rows like the ones returned for the stations."""
+    result = list()
+    for num in range(numrows):
+        start = datetime.datetime(1990 + num % 30, 1 + num % 12, 1 + num % 28)
+        result.append({'network': 'GE', 'code': 'S%04d' % num,
+                       'latitude': -90.0 + (num * 0.37) % 180, 'longitude': -180.0 + (num * 0.71) % 360,
+                       'elevation': float(num % 3000), 'place': 'Place %d' % num, 'country': 'Germany',
+                       'start': start, 'end': None if num % 3 else start + datetime.timedelta(days=365),
+                       'restricted': num % 2, 'shared': 1})
+    return result
+
+
+def jsonbaseline(rows: list, selected: list) -> bytes:
+    """Previous encoding of the JSON output."""
+    if selected != fields:
+        rows = [{field: row[field] for field in selected} for row in rows]
+    return json.dumps(rows, default=datetime.datetime.isoformat).encode('utf-8')
+
+
+def textbaseline(rows: list, selected: list) -> bytes:
+    """Previous encoding of the text output."""
+    if selected != fields:
+        rows = [{field: row[field] for field in selected} for row in rows]
+    fout = io.StringIO("")
+    writer = csv.DictWriter(fout, fieldnames=selected, delimiter='|')
+    writer.writeheader()
+    writer.writerows(rows)
+    return fout.getvalue().encode('utf-8')
+
+
+def rate(encode, rows: list, repeat: int) -> float:
+    """Return the best rate in rows per second (of CPU time) of some runs of an encoder."""
+    best = None
+    for _ in range(repeat):
+        start = time.process_time()
+        encode(rows)
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(rows) / best
+
+
+def main():
+    msg = 'Measure the rows per second encoded by the serializers of the listing methods.'
+    parser = argparse.ArgumentParser(description=msg)
+    parser.add_argument('-n', '--rows', type=int, default=50000,
+                        help='Number of rows to encode.')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Number of runs of every benchmark. The best one is reported.')
+    args = parser.parse_args()
+
+    rows = stations(args.rows)
+    backends = ['json'] if orjson is None else ['json', 'orjson']
+
+    print('%-8s %-8s %-20s %12s' % ('fields', 'format', 'encoder', 'rows/s'))
+    # All the fields and only some of them (e.g. fields=code,start,end)
+    for name, selected in [('all', fields), ('some', ['code', 'start', 'end'])]:
+        benchmarks = [('json', 'baseline', lambda rows: jsonbaseline(rows, selected)),
+                      ('text', 'baseline', lambda rows: textbaseline(rows, selected))]
+        for outformat in ['json', 'ndjson', 'geojson', 'text']:
+            for backend in (backends if outformat != 'text' else ['json']):
+                serializer = Serializer(selected, outformat, backend=backend)
+                encoder = 'serializer' if outformat == 'text' else 'serializer (%s)' % backend
+                benchmarks.append((outformat, encoder, serializer.dumps))
+
+        for outformat, encoder, encode in benchmarks:
+            print('%-8s %-8s %-20s %12.0f' % (name, outformat, encoder, rate(encode, rows, args.repeat)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1805 @@
+#!/usr/bin/env python3
+
+"""Unit tests of the classes of sc3microapi which do not need a running service
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2017 Javier Quinteros, GEOFON, GFZ Potsdam <geofon@gfz-potsdam.de>
+   :License:
+       GPLv3
+   :Platform:
+       Linux
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import sys
+import os
+import io
+import csv
+import json
+import random
+import datetime
+import time
+import tempfile
+import configparser
+import contextlib
+import urllib.parse
+import zlib
+import logging
+import unittest
+from unittest import mock
+import xml.etree.ElementTree as ET
+import MySQLdb
+import cherrypy
+from unittestTools import WITestRunner
+from unittestTools import SQLitePool
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sc3microapi'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tools'))
+import sc3microapi as api
+import routesfromSC3
+
+
+def randompoints(num: int, seed: int = 1) -> list:
+    """Points (latitude, longitude, oid) all over the world, also on the dateline and the poles."""
+    rnd = random.Random(seed)
+    points = [(rnd.uniform(-90.0, 90.0), rnd.uniform(-180.0, 180.0), oid) for oid in range(num)]
+    points.extend([(0.0, 180.0, num), (0.0, -180.0, num + 1), (90.0, 0.0, num + 2), (-90.0, 179.5, num + 3)])
+    return points
+
+
+def randominventory(numnets: int = 30, numstas: int = 3000, seed: int = 1) -> dict:
+    """Rows of the inventory tables, indexed by _oid, as read by InventorySnapshot.load."""
+    rnd = random.Random(seed)
+    codes = ['GE', 'CX', 'II', 'ZS', 'X7', '4C', '2F', 'Z3']
+    netrows = dict()
+    for oid in range(1, numnets + 1):
+        start = datetime.datetime(rnd.randint(1990, 2020), rnd.randint(1, 12), 1)
+        end = None if rnd.random() < 0.4 else start + datetime.timedelta(days=rnd.randint(100, 4000))
+        netrows[oid] = {'_oid': oid, 'code': rnd.choice(codes), 'start': start, 'end': end,
+                        'netClass': rnd.choice('pt'), 'archive': rnd.choice(['GFZ', 'ODC']),
+                        'restricted': rnd.randint(0, 1), 'shared': rnd.randint(0, 1)}
+
+    starows = dict()
+    for oid in range(1000, 1000 + numstas):
+        parent = rnd.choice(list(netrows))
+        # Epochs of the stations may start before the epoch of their network
+        start = netrows[parent]['start'] + datetime.timedelta(days=rnd.randint(-400, 2000))
+        end = None if rnd.random() < 0.5 else start + datetime.timedelta(days=rnd.randint(1, 3000))
+        starows[oid] = {'_oid': oid, '_parent_oid': parent, 'code': 'S%03d' % rnd.randint(0, 300),
+                        'latitude': rnd.uniform(-90.0, 90.0), 'longitude': rnd.uniform(-180.0, 180.0),
+                        'elevation': rnd.uniform(-100.0, 4000.0), 'place': 'Place %d' % oid, 'country': 'Country',
+                        'start': start, 'end': end, 'restricted': rnd.randint(0, 1), 'shared': rnd.randint(0, 1),
+                        'archive': rnd.choice(['GFZ', 'ODC'])}
+
+    vnetrows = dict()
+    refrows = dict()
+    for oid, code in enumerate(['_GEALL', '_CHILE', '_EMPTY', '_GEALL'], start=100000):
+        vnetrows[oid] = {'_oid': oid, 'code': code, 'start': datetime.datetime(2000 + oid % 10, 1, 1), 'end': None,
+                         'type': 'vnet'}
+        if code == '_EMPTY':
+            continue
+        for staoid in rnd.sample(list(starows), 50):
+            refrows[200000 + len(refrows)] = {'_oid': 200000 + len(refrows), 'vnet': oid, 'station': staoid}
+
+    return {'netrows': netrows, 'starows': starows, 'vnetrows': vnetrows, 'refrows': refrows}
+
+
+def call(method, *args, headers: dict = None, body: bytes = None, **kwargs) -> tuple:
+    """Call a method of the API as in a request and return the status, the headers and the body."""
+    request = cherrypy.serving.request
+    request.method = 'GET' if body is None else 'POST'
+    request.headers = cherrypy.lib.httputil.HeaderMap(headers or {})
+    request.body = io.BytesIO(body) if body is not None else None
+    request.query_string = urllib.parse.urlencode(kwargs)
+    cherrypy.serving.response = cherrypy._cprequest.Response()
+    try:
+        result = method(*args, **kwargs)
+    except (cherrypy.HTTPError, cherrypy.HTTPRedirect) as e:
+        return e.status, cherrypy.serving.response.headers, e._message
+
+    if result is not None and not isinstance(result, bytes):
+        result = b''.join(result)
+    return 200, cherrypy.serving.response.headers, result
+
+
+class APISession(object):
+    """Session of requests answered by the methods of the API instead of a running service."""
+
+    class Response(object):
+        def __init__(self, status_code: int, content: bytes):
+            self.status_code = status_code
+            self.content = content
+
+    def __init__(self, microapi, urlbase: str = 'http://localhost/sc3microapi'):
+        self.microapi = microapi
+        self.urlbase = urlbase
+
+    def get(self, url: str, params: dict = None):
+        parts = [part for part in url[len(self.urlbase):].split('/') if len(part)]
+        params = {key: str(value) for key, value in (params or {}).items()}
+        if parts[:2] == ['virtualnet', 'stations']:
+            status, headers, body = call(self.microapi.virtualnet.stations, *parts[2:], **params)
+        else:
+            status, headers, body = call(getattr(self.microapi, parts[0]).index, *parts[1:], **params)
+        return self.Response(status, body.encode('utf-8') if isinstance(body, str) else body)
+
+
+def routesfromsc3(*args) -> bytes:
+    """Output of routesfromSC3 with the arguments given."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output = os.path.join(tmpdir, 'routing.xml')
+        with mock.patch.object(sys, 'argv', ['routesfromSC3.py', '-o', output] + list(args)):
+            routesfromSC3.main()
+        with open(output, 'rb') as fin:
+            return fin.read()
+
+
+class SnapshotTests(unittest.TestCase):
+    """Test the listings served from the snapshot against the ones queried from the DB."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.rows = randominventory()
+        cls.pool = SQLitePool(**cls.rows)
+        cls.sqlapi = api.SC3MicroApi(cls.pool)
+        cls.snapapi = api.SC3MicroApi(cls.pool, api.Inventory(cls.pool))
+
+    def compare(self, endpoint: str, method: str, *args, **kwargs) -> tuple:
+        """Same status and rows from the DB and from the snapshot."""
+        sql = call(getattr(getattr(self.sqlapi, endpoint), method), *args, **kwargs)
+        snap = call(getattr(getattr(self.snapapi, endpoint), method), *args, **kwargs)
+        self.assertEqual(sql[0], snap[0], (endpoint, args, kwargs))
+        if sql[0] == 200:
+            self.assertEqual(sorted(json.loads(sql[2]), key=json.dumps), sorted(json.loads(snap[2]), key=json.dumps),
+                             (endpoint, args, kwargs))
+        return snap
+
+    def test_load(self):
+        """All the rows of the tables are in the snapshot."""
+        snapshot = self.snapapi.network.inventory.snapshot
+        self.assertEqual(len(snapshot.netrows), len(self.rows['netrows']))
+        self.assertEqual(len(snapshot.starows), len(self.rows['starows']))
+        self.assertEqual(len(snapshot.vnetrows), len(self.rows['vnetrows']))
+        self.assertEqual(sum(len(members) for members in snapshot.members.values()), len(self.rows['refrows']))
+
+    def test_networks(self):
+        """Same networks with every filter."""
+        temporary = next(net for net in self.rows['netrows'].values() if net['code'] == 'X7')
+        for kwargs in [{}, {'net': 'GE'}, {'net': 'X7_%d' % temporary['start'].year}, {'net': 'AA'},
+                       {'restricted': '1'}, {'archive': 'GFZ'}, {'netclass': 't'}, {'shared': '0'},
+                       {'starttime': '2005-01-01'}, {'endtime': '2010-01-01T00:00:00'},
+                       {'net': 'CX', 'shared': '1', 'starttime': '2000-01-01'}, {'net': 'X7'}, {'restricted': '2'}]:
+            self.compare('network', 'index', **kwargs)
+
+    def test_stations(self):
+        """Same stations with every filter."""
+        temporary = next(net for net in self.rows['netrows'].values() if net['code'] == 'ZS')
+        for kwargs in [{}, {'net': 'GE'}, {'net': 'ZS_%d' % temporary['start'].year}, {'sta': 'S001'},
+                       {'net': 'II', 'sta': 'S100'}, {'restricted': '0'}, {'archive': 'ODC'}, {'shared': '1'},
+                       {'starttime': '2005-01-01', 'endtime': '2015-01-01'}, {'net': 'ZS'}, {'shared': 'x'}]:
+            self.compare('station', 'index', **kwargs)
+
+    def test_extended(self):
+        """Temporary networks are found by their code and start year, also on the limits of the year."""
+        self.assertEqual([api.extendedcode(code, datetime.datetime(2011, 12, 31)) for code in ['4C', 'X7', 'GE', 'ZS']],
+                         ['4C_2011', 'X7_2011', 'GE', 'ZS_2011'])
+        for net in self.rows['netrows'].values():
+            if api.istemporary(net['code']):
+                code = api.extendedcode(net['code'], net['start'])
+                status, headers, body = self.compare('network', 'index', net=code)
+                self.assertIn(net['start'].isoformat(), [row['start'] for row in json.loads(body)])
+                self.compare('station', 'index', net=code)
+        for code in ['X7_abc', 'X7_1800', 'GE_2011']:
+            self.compare('network', 'index', net=code)
+            self.compare('station', 'index', net=code)
+
+        rows = {'netrows': dict(), 'starows': dict(), 'vnetrows': dict(), 'refrows': dict()}
+        for oid, start in enumerate([datetime.datetime(2011, 12, 31, 23, 59, 59), datetime.datetime(2012, 1, 1)],
+                                    start=1):
+            rows['netrows'][oid] = {'_oid': oid, 'code': 'X7', 'start': start, 'end': None, 'netClass': 't',
+                                    'archive': 'GFZ', 'restricted': 0, 'shared': 1}
+        pool = SQLitePool(**rows)
+        for microapi in [api.SC3MicroApi(pool), api.SC3MicroApi(pool, api.Inventory(pool))]:
+            for year in [2011, 2012]:
+                body = call(microapi.network.index, net='X7_%d' % year)[2]
+                self.assertEqual([row['start'][:4] for row in json.loads(body)], [str(year)])
+
+    def test_vnets(self):
+        """Same virtual networks and members."""
+        for kwargs in [{}, {'net': '_GEALL'}, {'typevn': 'vnet'}, {'starttime': '2003-01-01'}]:
+            self.compare('virtualnet', 'index', **kwargs)
+        for code in ['_GEALL', '_CHILE', '_EMPTY', '_NONE']:
+            status, headers, body = self.compare('virtualnet', 'stations', code)
+            self.assertEqual(len(json.loads(body)), 100 if code == '_GEALL' else 50 if code == '_CHILE' else 0)
+
+    def test_formats(self):
+        """Same text and XML output from the DB and from the snapshot."""
+        for method, kwargs in [('network', {'net': 'GE'}), ('station', {'net': 'GE'}),
+                               ('virtualnet', {'net': '_GEALL'})]:
+            for outformat in ['text', 'xml']:
+                sql = call(getattr(self.sqlapi, method).index, outformat=outformat, **kwargs)
+                snap = call(getattr(self.snapapi, method).index, outformat=outformat, **kwargs)
+                self.assertEqual(sql[0], 200, sql[2])
+                self.assertEqual(sorted(sql[2].splitlines()), sorted(snap[2].splitlines()), (method, outformat))
+
+
+class InventoryTests(unittest.TestCase):
+    """Test the incremental refresh of the snapshot against a full reload."""
+
+    def setUp(self):
+        self.pool = SQLitePool(**randominventory(numstas=300))
+        self.inventory = api.Inventory(self.pool)
+
+    def assertReloaded(self):
+        """The refreshed snapshot has the same rows as one loaded from scratch."""
+        with self.pool.connection() as conn:
+            expected = api.InventorySnapshot.load(conn)
+        for attr in ['netrows', 'starows', 'vnetrows', 'refrows', 'members']:
+            self.assertEqual(getattr(self.inventory.snapshot, attr), getattr(expected, attr), attr)
+
+    def test_unchanged(self):
+        """The snapshot is kept if no table changed."""
+        snapshot = self.inventory.snapshot
+        self.inventory.refresh()
+        self.assertIs(self.inventory.snapshot, snapshot)
+
+    def test_changes(self):
+        """Modified, added and deleted rows are applied."""
+        modified = datetime.datetime(2021, 1, 1)
+        self.pool.conn.execute('update Station set place=?, _last_modified=? where _oid=1001', ('New place', modified))
+        self.pool.conn.execute('update Network set code=?, _last_modified=? where _oid=3', ('NE', modified))
+        self.pool.conn.execute('insert into Network values (1000, 0, ?, ?, ?, NULL, ?, ?, 0, 1)',
+                               (modified, 'NW', datetime.datetime(2021, 1, 1), 'p', 'GFZ'))
+        self.pool.conn.execute('delete from Station where _oid=1002')
+        self.pool.conn.execute('delete from StationReference where _oid=200000')
+        self.pool.conn.execute('insert into StationReference values (300000, 100002, ?, ?)',
+                               (modified, 'Station/1003'))
+        self.pool.conn.commit()
+
+        snapshot = self.inventory.snapshot
+        self.inventory.refresh()
+        self.assertIsNot(self.inventory.snapshot, snapshot)
+        self.assertReloaded()
+        self.assertEqual(self.inventory.snapshot.starows[1001]['place'], 'New place')
+        self.assertNotIn(1002, self.inventory.snapshot.starows)
+        status, headers, body = call(api.SC3MicroApi(self.pool, self.inventory).network.index, net='NW')
+        self.assertEqual([net['archive'] for net in json.loads(body)], ['GFZ'])
+
+    def test_error(self):
+        """The previous snapshot is kept if the DB fails."""
+        snapshot = self.inventory.snapshot
+        self.pool.conn.execute('insert into Network values (1000, 0, ?, ?, ?, NULL, ?, ?, 0, 1)',
+                               (datetime.datetime(2021, 1, 1), 'NW', datetime.datetime(2021, 1, 1), 'p', 'GFZ'))
+        self.pool.conn.commit()
+        with mock.patch.object(api.InventorySnapshot, 'update', side_effect=MySQLdb.Error()):
+            self.inventory.refresh()
+        self.assertIs(self.inventory.snapshot, snapshot)
+
+        # The changes are applied with the next refresh
+        self.inventory.refresh()
+        self.assertReloaded()
+
+    def test_first_load(self):
+        """The service does not start without the first snapshot."""
+        with mock.patch.object(api.InventorySnapshot, 'load', side_effect=MySQLdb.Error()):
+            self.assertRaises(MySQLdb.Error, api.Inventory, self.pool)
+
+
+class CodeMatcherTests(unittest.TestCase):
+    """Test the selectors of codes with lists and wildcards."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.rows = randominventory()
+        cls.pool = SQLitePool(**cls.rows)
+
+    def test_match(self):
+        """Exact codes, wildcards and temporary networks with their start year."""
+        matcher = api.CodeMatcher('GE, II,S1?0,A*Z', extended=True)
+        for code in ['GE', 'II', 'S100', 'S1X0', 'AZ', 'ABCZ']:
+            self.assertTrue(matcher.match(code), code)
+        for code in ['G', 'GEO', 'S10', 'S1000', 'ZA', 'ge']:
+            self.assertFalse(matcher.match(code), code)
+
+        matcher = api.CodeMatcher('4C_2011,ZS_201?,X*_2005', extended=True)
+        for code, year in [('4C', 2011), ('ZS', 2010), ('ZS', 2019), ('X7', 2005), ('XZ', 2005)]:
+            self.assertTrue(matcher.match(code, year), (code, year))
+        for code, year in [('4C', 2012), ('4C', None), ('ZS', 2020), ('X7', 2006), ('GE', 2011)]:
+            self.assertFalse(matcher.match(code, year), (code, year))
+
+        # Only temporary networks have a year. Without "extended" the underscore is part of the code
+        self.assertEqual(api.CodeMatcher('GE_2011', extended=True).exact, [('GE_2011', None)])
+        self.assertTrue(api.CodeMatcher('_GE*').match('_GEALL'))
+
+    def test_wrong(self):
+        """Empty items or wrong years are rejected."""
+        for selector in ['', 'GE,,II', ' ,GE', '4C_20x1', '4C_0', '4C_', 'ZS_99999']:
+            self.assertRaises(ValueError, api.CodeMatcher, selector, True)
+
+    def test_codes(self):
+        """Codes of an index which could be selected."""
+        available = {'GE': 1, 'GEO': 2, 'II': 3, 'S100': 4, 'S200': 5}
+        self.assertEqual(api.CodeMatcher('II,GE*,XX').codes(available), ['GE', 'GEO', 'II'])
+        self.assertEqual(api.CodeMatcher('S?00').codes(available), ['S100', 'S200'])
+        self.assertEqual(api.CodeMatcher('XX').codes(available), [])
+
+    def test_sqlclause(self):
+        """The SQL condition selects the same networks and stations as the matcher."""
+        netrows = self.rows['netrows']
+        for selector in ['GE', 'GE,II', 'G*', '?X', '*', 'X7_20*', '4C_2011,ZS_201?,2F_199?,CX',
+                         ','.join(api.extendedcode(net['code'], net['start']) for net in list(netrows.values())[:5]),
+                         'G%*,G_*,GE', 'Z3_%s' % netrows[1]['start'].year]:
+            matcher = api.CodeMatcher(selector, extended=True)
+            clause, variables = matcher.sqlclause('N.code', 'N.start')
+            with self.pool.connection() as conn:
+                conn.execute('select _oid from Network as N where ' + clause, variables)
+                found = sorted(row['_oid'] for row in conn.fetchall())
+            expected = sorted(oid for oid, net in netrows.items() if matcher.match(net['code'], net['start'].year))
+            self.assertEqual(found, expected, selector)
+
+        for selector in ['S001', 'S001,S002,S003', 'S1*', 'S?0?', 'S1*,S200']:
+            matcher = api.CodeMatcher(selector)
+            clause, variables = matcher.sqlclause('S.code')
+            with self.pool.connection() as conn:
+                conn.execute('select _oid from Station as S where ' + clause, variables)
+                found = sorted(row['_oid'] for row in conn.fetchall())
+            expected = sorted(oid for oid, sta in self.rows['starows'].items() if matcher.match(sta['code']))
+            self.assertEqual(found, expected, selector)
+
+    def test_snapshot_sql(self):
+        """Same networks, stations and virtual networks selected from the DB and from the snapshot."""
+        sqlapi = api.SC3MicroApi(self.pool)
+        snapapi = api.SC3MicroApi(self.pool, api.Inventory(self.pool))
+        for endpoint, param, selectors in [('network', 'net', ['GE,II', 'G?', 'C*,Z*', 'X7_20*', 'AA']),
+                                           ('station', 'net', ['GE,CX', '?I', 'ZS_*,4C_*']),
+                                           ('station', 'sta', ['S001,S002', 'S1?0', 'S2*,S003']),
+                                           ('virtualnet', 'net', ['_GEALL,_CHILE', '_*', '_GE*'])]:
+            for selector in selectors:
+                sql = call(getattr(sqlapi, endpoint).index, **{param: selector})
+                snap = call(getattr(snapapi, endpoint).index, **{param: selector})
+                self.assertEqual(sql[0], snap[0], selector)
+                if sql[0] == 200:
+                    self.assertEqual(json.loads(sql[2]), json.loads(snap[2]), '%s %s' % (endpoint, selector))
+
+        # Temporary networks need their year and the selectors must be valid
+        self.assertEqual(call(sqlapi.network.index, net='X7')[0], 400)
+        self.assertEqual(call(sqlapi.station.index, sta='S001,,S002')[0], 400)
+
+
+class EpochIndexTests(unittest.TestCase):
+    """Test the interval tree of the epochs against the filters applied in the SQL path."""
+
+    @classmethod
+    def setUpClass(cls):
+        rnd = random.Random(6)
+        cls.epochs = list()
+        for oid in range(2000):
+            start = datetime.datetime(1990, 1, 1) + datetime.timedelta(days=rnd.randint(0, 12000))
+            end = None if rnd.random() < 0.3 else start + datetime.timedelta(days=rnd.randint(0, 3000))
+            cls.epochs.append((start, end, oid))
+        cls.index = api.EpochIndex(cls.epochs)
+
+    def expected(self, starttime, endtime) -> list:
+        return sorted(oid for start, end, oid in self.epochs
+                      if (endtime is None or start <= endtime) and
+                      (starttime is None or end is None or end >= starttime))
+
+    def test_overlap(self):
+        """Time windows, also with one of the limits open or on the limits of the epochs."""
+        rnd = random.Random(7)
+        windows = [(None, None), (datetime.datetime(2000, 1, 1), None), (None, datetime.datetime(2000, 1, 1)),
+                   (datetime.datetime(1900, 1, 1), datetime.datetime(1901, 1, 1)),
+                   (datetime.datetime(2100, 1, 1), None)]
+        windows.extend((start, end) for start, end, oid in self.epochs[:20])
+        for _ in range(200):
+            starttime = datetime.datetime(1985, 1, 1) + datetime.timedelta(days=rnd.randint(0, 15000))
+            windows.append((starttime, starttime + datetime.timedelta(days=rnd.randint(0, 2000))))
+
+        for starttime, endtime in windows:
+            self.assertEqual(self.index.overlap(starttime, endtime), self.expected(starttime, endtime),
+                             'Window %s - %s' % (starttime, endtime))
+
+    def test_active(self):
+        """Epochs active at a given time."""
+        for start, end, oid in self.epochs[:50]:
+            self.assertIn(oid, self.index.active(start))
+            self.assertEqual(self.index.active(start), self.expected(start, start))
+
+    def test_empty(self):
+        """Index without epochs."""
+        self.assertEqual(api.EpochIndex([]).overlap(datetime.datetime(2000, 1, 1)), [])
+
+    def test_snapshot_sql(self):
+        """Same networks, stations and virtual networks in a time window from the DB and from the snapshot."""
+        pool = SQLitePool(**randominventory())
+        sqlapi = api.SC3MicroApi(pool)
+        snapapi = api.SC3MicroApi(pool, api.Inventory(pool))
+        for endpoint in ['network', 'station', 'virtualnet']:
+            for timematch in ['overlap', 'contained']:
+                for window in [{'starttime': '2005-01-01'}, {'endtime': '2001-06-01T12:00:00'},
+                               {'starttime': '2003-01-01', 'endtime': '2008-01-01'},
+                               {'starttime': '2010-01-01', 'endtime': '2010-01-01'},
+                               {'starttime': '2010-01-01', 'endtime': '2005-01-01'}]:
+                    sql = call(getattr(sqlapi, endpoint).index, timematch=timematch, **window)
+                    snap = call(getattr(snapapi, endpoint).index, timematch=timematch, **window)
+                    self.assertEqual(sql[0], 200, sql[2])
+                    self.assertEqual(json.loads(sql[2]), json.loads(snap[2]),
+                                     '%s %s %s' % (endpoint, timematch, window))
+            self.assertEqual(call(getattr(sqlapi, endpoint).index, timematch='wrong')[0], 400)
+
+
+class GeoIndexTests(unittest.TestCase):
+    """Test the spatial index of the stations against the filter applied in the SQL path."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.points = randompoints(5000)
+        cls.index = api.GeoIndex(cls.points)
+
+    def expected(self, minlat, maxlat, minlon, maxlon) -> list:
+        return sorted(oid for lat, lon, oid in self.points if api.inbox(lat, lon, minlat, maxlat, minlon, maxlon))
+
+    def test_box(self):
+        """Boxes not crossing the dateline."""
+        rnd = random.Random(2)
+        for _ in range(200):
+            lats = sorted(rnd.uniform(-90.0, 90.0) for _ in range(2))
+            lons = sorted(rnd.uniform(-180.0, 180.0) for _ in range(2))
+            self.assertEqual(self.index.box(lats[0], lats[1], lons[0], lons[1]), self.expected(*lats, *lons))
+
+    def test_box_dateline(self):
+        """Boxes crossing the dateline (minlon > maxlon), also with both ends in the same cell."""
+        boxes = [(-25.2, 51.07, 62.317, 62.240), (-10.0, 10.0, 170.0, -170.0), (-90.0, 90.0, 179.9, -179.9),
+                 (0.0, 1.0, 0.9, 0.1), (-90.0, 90.0, -179.5, -179.8), (-90.0, 90.0, 179.8, 179.5)]
+        rnd = random.Random(3)
+        for _ in range(200):
+            minlon = rnd.uniform(-180.0, 180.0)
+            # Half of them with both longitudes in the same cell of one degree
+            maxlon = minlon - rnd.uniform(0.0, 0.9) if rnd.random() < 0.5 else rnd.uniform(-180.0, minlon)
+            boxes.append(tuple(sorted(rnd.uniform(-90.0, 90.0) for _ in range(2))) + (minlon, maxlon))
+
+        for box in boxes:
+            self.assertEqual(self.index.box(*box), self.expected(*box), 'Box %s' % (box,))
+
+    def test_box_open(self):
+        """Boxes without some of the limits."""
+        for box in [(None, None, None, None), (10.0, None, None, None), (None, None, 170.0, None),
+                    (None, None, None, -170.0), (None, 0.0, 170.0, -170.0)]:
+            self.assertEqual(self.index.box(*box), self.expected(*box), 'Box %s' % (box,))
+
+    def test_near(self):
+        """Circles, also around the dateline and the poles."""
+        centres = [(0.0, 180.0), (0.0, -179.9), (89.5, 0.0), (-89.9, 45.0), (45.0, 62.3)]
+        rnd = random.Random(4)
+        centres.extend((rnd.uniform(-90.0, 90.0), rnd.uniform(-180.0, 180.0)) for _ in range(100))
+        for lat, lon in centres:
+            for maxradius in [10.0, 500.0, 3000.0, 20000.0]:
+                expected = sorted(oid for plat, plon, oid in self.points
+                                  if api.distance(lat, lon, plat, plon) <= maxradius)
+                self.assertEqual(self.index.near(lat, lon, maxradius), expected,
+                                 'Circle %s, %s, %s' % (lat, lon, maxradius))
+
+    def test_snapshot_region(self):
+        """Stations of the snapshot in a region, also crossing the dateline, against the filter of the SQL path."""
+        rows = randominventory()
+        snapshot = api.InventorySnapshot(**rows)
+        for box in [(-25.2, 51.07, 62.317, 62.240), (-60.0, 60.0, 150.0, -150.0), (-90.0, 90.0, 179.0, 178.9),
+                    (10.0, 50.0, -20.0, 40.0)]:
+            # Sorted by the key of the pages
+            expected = [(sta['code'], sta['start']) for oid, sta in
+                        sorted(rows['starows'].items(),
+                               key=lambda item: (rows['netrows'][item[1]['_parent_oid']]['code'], item[1]['code'],
+                                                 item[1]['start'], rows['netrows'][item[1]['_parent_oid']]['start'],
+                                                 item[0]))
+                        if api.inbox(sta['latitude'], sta['longitude'], *box)]
+            result = [(sta['code'], sta['start']) for sta in snapshot.getstations(region=box)]
+            self.assertEqual(result, expected, 'Region %s' % (box,))
+
+
+class SerializerTests(unittest.TestCase):
+    """Test the serializers against the encoders of the standard library."""
+
+    fields = ['network', 'code', 'latitude', 'longitude', 'elevation', 'place', 'start', 'end', 'restricted']
+
+    @classmethod
+    def setUpClass(cls):
+        cls.rows = [{'network': 'GE', 'code': 'S%04d' % num, 'latitude': -45.0 + num * 0.37,
+                     'longitude': 170.0 - num * 0.71, 'elevation': None if num % 5 == 0 else float(num),
+                     'place': ['Potsdam', 'Zürich', 'a|b', 'with "quotes"', '', 'línea\nnueva'][num % 6],
+                     'start': datetime.datetime(2000, 1, 1, 0, 0, num % 60),
+                     'end': None if num % 3 else datetime.datetime(2010, 1, 1), 'restricted': num % 2}
+                    for num in range(2500)]
+
+    def expected(self, rows: list, fields: list) -> list:
+        return [{field: row[field] for field in fields} for row in rows]
+
+    def test_default_backend(self):
+        """The default output of JSON is the one of json.dumps."""
+        self.assertEqual(api.Serializer.backend, 'json')
+        for fields in [self.fields, ['code', 'start', 'end'], ['place']]:
+            for rows in [self.rows, self.rows[:1000], self.rows[:1], []]:
+                expected = json.dumps(self.expected(rows, fields), default=datetime.datetime.isoformat)
+                self.assertEqual(api.Serializer(fields, 'json').dumps(rows), expected.encode('utf-8'))
+
+    def test_text(self):
+        """The text output is the one of the csv module."""
+        for fields in [self.fields, ['code', 'start', 'end'], ['place']]:
+            for rows in [self.rows, self.rows[:1000], []]:
+                fout = io.StringIO()
+                writer = csv.DictWriter(fout, fieldnames=fields, delimiter='|')
+                writer.writeheader()
+                writer.writerows(self.expected(rows, fields))
+                self.assertEqual(api.Serializer(fields, 'text').dumps(rows), fout.getvalue().encode('utf-8'))
+
+    def test_backends(self):
+        """All the formats encode the same values with all the backends."""
+        backends = ['json'] if api.orjson is None else ['json', 'orjson']
+        for backend in backends:
+            for fields in [self.fields, ['code', 'start']]:
+                expected = json.loads(json.dumps(self.expected(self.rows, fields),
+                                                 default=datetime.datetime.isoformat))
+                result = api.Serializer(fields, 'json', backend=backend).dumps(self.rows)
+                self.assertEqual(json.loads(result), expected)
+
+                result = api.Serializer(fields, 'ndjson', backend=backend).dumps(self.rows).decode('utf-8')
+                self.assertTrue(result.endswith('\n'))
+                self.assertEqual([json.loads(line) for line in result.splitlines()], expected)
+
+                result = json.loads(api.Serializer(fields, 'geojson', backend=backend).dumps(self.rows))
+                self.assertEqual(result['type'], 'FeatureCollection')
+                self.assertEqual([feature['properties'] for feature in result['features']], expected)
+                for row, feature in zip(self.rows, result['features']):
+                    coordinates = [row['longitude'], row['latitude']] + \
+                        ([row['elevation']] if row['elevation'] is not None else [])
+                    self.assertEqual(feature['geometry'], {'type': 'Point', 'coordinates': coordinates})
+
+    def test_chunks(self):
+        """The output is the same whatever the size of the chunks."""
+        for outformat in ['json', 'text', 'ndjson', 'geojson']:
+            serializer = api.Serializer(self.fields, outformat)
+            expected = serializer.dumps(self.rows)
+            for size in [1, 7, 1000, 2500, 5000]:
+                self.assertEqual(b''.join(serializer.chunks(self.rows, size)), expected, (outformat, size))
+
+    def test_registry(self):
+        """Serializers are compiled once per endpoint, fields and format."""
+        serializer = api.Serializer.get('test', ['code', 'start'], 'json')
+        self.assertIs(api.Serializer.get('test', ['code', 'start'], 'json'), serializer)
+        self.assertIsNot(api.Serializer.get('test', ['code', 'start'], 'text'), serializer)
+        self.assertRaises(ValueError, api.Serializer, ['code'], 'xml')
+
+
+class ProjectionTests(unittest.TestCase):
+    """Test the selection of the fields returned by the listing methods."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.rows = randominventory()
+        cls.pool = SQLitePool(**cls.rows)
+        cls.sqlapi = api.SC3MicroApi(cls.pool)
+        cls.snapapi = api.SC3MicroApi(cls.pool, api.Inventory(cls.pool))
+
+    def test_projection(self):
+        """Fields in the order given without duplicates."""
+        available = ['network', 'code', 'start', 'end']
+        self.assertEqual(api.projection('start,code', available), ['start', 'code'])
+        self.assertEqual(api.projection(' code , start,code', available), ['code', 'start'])
+        for selector in ['', 'code,', 'code,place', 'Code']:
+            self.assertRaises(ValueError, api.projection, selector, available)
+
+    def test_fields(self):
+        """Only the fields requested are returned, with the same values as in the full output."""
+        for method, args, kwargs, fields in [('station', [], {}, 'code,network,start'),
+                                             ('station', [], {'lat': '0', 'lon': '0', 'maxradius': '5000'}, 'end'),
+                                             ('station', [], {'limit': '20'}, 'place,code'),
+                                             ('network', [], {}, 'code,archive,shared'),
+                                             ('network', [], {'limit': '5'}, 'end'),
+                                             ('virtualnet', [], {}, 'type,code'),
+                                             ('vnetstations', ['_GEALL'], {}, 'station,start')]:
+            fields = fields.split(',')
+            for microapi in [self.sqlapi, self.snapapi]:
+                index = microapi.virtualnet.stations if method == 'vnetstations' else getattr(microapi, method).index
+                status, headers, body = call(index, *args, **kwargs)
+                full = json.loads(body)
+                status, headers, body = call(index, *args, fields=','.join(fields), **kwargs)
+                self.assertEqual(status, 200, body)
+                self.assertEqual(json.loads(body), [{field: row[field] for field in fields} for row in full],
+                                 '%s %s' % (method, kwargs))
+                self.assertEqual(list(json.loads(body)[0]), fields)
+
+                status, headers, body = call(index, *args, outformat='text', fields=','.join(fields), **kwargs)
+                self.assertEqual(body.decode('utf-8').splitlines()[0], '|'.join(fields))
+
+    def test_query(self):
+        """Only the columns needed are selected from the DB."""
+        with mock.patch.object(self.pool, 'rows', wraps=self.pool.rows) as rows:
+            call(self.sqlapi.station.index, fields='code,network')
+            self.assertEqual(rows.call_args[0][0].split(' from ')[0], 'select N.code as network, S.code as code')
+            call(self.sqlapi.station.index, fields='code', lat='0', lon='0', maxradius='10')
+            self.assertEqual(rows.call_args[0][0].split(' from ')[0], 'select S.code as code, latitude, longitude')
+            call(self.sqlapi.network.index, fields='archive')
+            self.assertEqual(rows.call_args[0][0].split(' from ')[0], 'select archive')
+
+    def test_wrong(self):
+        """Unknown fields are rejected with an error 400."""
+        for index, fields in [(self.sqlapi.station.index, 'code,archive'), (self.sqlapi.network.index, 'latitude'),
+                              (self.sqlapi.virtualnet.index, ''), (self.snapapi.station.index, 'code,,start')]:
+            self.assertEqual(call(index, fields=fields)[0], 400, fields)
+
+
+class StreamingFormatsTests(unittest.TestCase):
+    """Test the NDJSON and GeoJSON output formats."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = SQLitePool(**randominventory())
+        cls.apis = [api.SC3MicroApi(cls.pool), api.SC3MicroApi(cls.pool, api.Inventory(cls.pool))]
+
+    def methods(self, microapi) -> list:
+        return [(microapi.station.index, [], {}), (microapi.station.index, [], {'fields': 'code,start'}),
+                (microapi.station.index, [], {'net': 'GE', 'limit': '10'}), (microapi.network.index, [], {}),
+                (microapi.virtualnet.stations, ['_GEALL'], {}), (microapi.virtualnet.stations, ['_EMPTY'], {})]
+
+    def test_ndjson(self):
+        """One object per line with the same content as the JSON array."""
+        for microapi in self.apis:
+            for index, args, kwargs in self.methods(microapi):
+                expected = json.loads(call(index, *args, **kwargs)[2])
+                status, headers, body = call(index, *args, outformat='ndjson', **kwargs)
+                self.assertEqual(status, 200, body)
+                self.assertEqual(headers['Content-Type'], 'application/x-ndjson')
+                self.assertEqual([json.loads(line) for line in body.decode('utf-8').splitlines()], expected)
+                self.assertTrue(body.endswith(b'\n') or not len(body))
+
+    def test_geojson(self):
+        """A FeatureCollection with the rows as properties and the stations as points."""
+        for microapi in self.apis:
+            for index, args, kwargs in self.methods(microapi):
+                expected = json.loads(call(index, *args, **kwargs)[2])
+                status, headers, body = call(index, *args, outformat='geojson', **kwargs)
+                self.assertEqual(status, 200, body)
+                self.assertEqual(headers['Content-Type'], 'application/geo+json')
+                collection = json.loads(body)
+                self.assertEqual(collection['type'], 'FeatureCollection')
+                self.assertEqual([feature['properties'] for feature in collection['features']], expected)
+                for feature in collection['features']:
+                    self.assertEqual(feature['type'], 'Feature')
+                    if index == microapi.network.index:
+                        self.assertIsNone(feature['geometry'])
+                    else:
+                        self.assertEqual(feature['geometry']['type'], 'Point')
+
+            # Coordinates of the stations even if they are not requested in the properties
+            full = json.loads(call(microapi.station.index, outformat='geojson')[2])['features']
+            short = json.loads(call(microapi.station.index, outformat='geojson', fields='code')[2])['features']
+            self.assertEqual([feature['geometry'] for feature in full], [feature['geometry'] for feature in short])
+            for feature in full:
+                props = feature['properties']
+                self.assertEqual(feature['geometry']['coordinates'],
+                                 [props['longitude'], props['latitude'], props['elevation']])
+
+    def test_incremental(self):
+        """Large results are encoded in many chunks and never as one string."""
+        rows = [{'network': 'GE', 'code': 'S%04d' % num, 'latitude': 1.0, 'longitude': 2.0, 'elevation': 3.0,
+                 'start': datetime.datetime(2000, 1, 1)} for num in range(2500)]
+        for outformat in ['ndjson', 'geojson']:
+            serializer = api.Serializer.get('station', ['network', 'code', 'start'], outformat)
+            chunks = list(serializer.chunks(iter(rows), size=100))
+            self.assertGreaterEqual(len(chunks), 25, outformat)
+            self.assertLess(max(len(chunk) for chunk in chunks), len(b''.join(chunks)) // 10)
+
+
+class CompressorTests(unittest.TestCase):
+    """Test the negotiation of the content coding and the compression of the responses."""
+
+    def decompress(self, coding: str, data: bytes) -> bytes:
+        if coding == 'gzip':
+            return zlib.decompress(data, 31)
+        if coding == 'zstd':
+            return api.zstandard.ZstdDecompressor().decompressobj().decompress(data)
+        return api.brotli.decompress(data)
+
+    def test_negotiate(self):
+        """Preferred coding accepted by the client."""
+        for header, expected in [('', None), ('gzip', 'gzip'), ('GZIP, deflate', 'gzip'), ('gzip;q=0', None),
+                                 ('identity', None), ('deflate, compress', None), ('gzip;q=wrong', None),
+                                 (' , gzip ; q=0.5', 'gzip'), ('*', api.Compressor.codings[0]),
+                                 ('*;q=0.5, gzip;q=0', ([c for c in api.Compressor.codings if c != 'gzip'] + [None])[0])]:
+            self.assertEqual(api.Compressor.negotiate(header), expected, header)
+
+    def test_chunks(self):
+        """The body compressed in chunks is recovered with every coding."""
+        chunks = [('<route networkCode="GE" stationCode="S%03d"/>\n' % num).encode('utf-8') for num in range(3000)]
+        for coding in api.Compressor.codings:
+            data = b''.join(api.Compressor(coding).chunks(iter(chunks)))
+            self.assertLess(len(data), len(b''.join(chunks)) // 5)
+            self.assertEqual(self.decompress(coding, data), b''.join(chunks), coding)
+            self.assertEqual(self.decompress(coding, b''.join(api.Compressor(coding).chunks(iter([])))), b'')
+        self.assertRaises(ValueError, api.Compressor, 'deflate')
+
+    def test_response(self):
+        """Compressed responses, also from the cache, have the same content as the identity ones."""
+        pool = SQLitePool(**randominventory())
+        cache = api.ResponseCache()
+        for microapi in [api.SC3MicroApi(pool), api.SC3MicroApi(pool, api.Inventory(pool), cache)]:
+            for index, args, kwargs in [(microapi.station.index, [], {'outformat': 'xml'}),
+                                        (microapi.network.index, [], {}),
+                                        (microapi.virtualnet.stations, ['_GEALL'], {'outformat': 'text'}),
+                                        (microapi.routing.index, [], {})]:
+                status, headers, identity = call(index, *args, **kwargs)
+                self.assertNotIn('Content-Encoding', headers)
+                for coding in api.Compressor.codings:
+                    bodies = list()
+                    for _ in range(2):
+                        status, headers, body = call(index, *args, headers={'Accept-Encoding': coding}, **kwargs)
+                        self.assertEqual(status, 200)
+                        self.assertEqual(headers['Content-Encoding'], coding)
+                        self.assertIn('Accept-Encoding', headers['Vary'])
+                        self.assertEqual(self.decompress(coding, body), identity)
+                        bodies.append(body)
+                    self.assertEqual(bodies[0], bodies[1])
+
+        # The compressed and the identity variants are cached apart and the compressed ones are reused
+        self.assertEqual(cache.stats()['entries'], 4 * (len(api.Compressor.codings) + 1))
+        self.assertEqual(cache.stats()['hits'], 4 * len(api.Compressor.codings))
+
+
+class PagingTests(unittest.TestCase):
+    """Test the keyset pagination from the DB and from the snapshot."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.rows = randominventory()
+        # A temporary code reused with the same station code and start in both networks
+        for oid, year in [(90, 2005), (91, 2010)]:
+            cls.rows['netrows'][oid] = dict(cls.rows['netrows'][1], _oid=oid, code='X7',
+                                            start=datetime.datetime(year, 1, 1), end=None)
+            cls.rows['starows'][oid] = dict(cls.rows['starows'][1000], _oid=oid, _parent_oid=oid, code='DUP',
+                                            start=datetime.datetime(2010, 6, 1), end=None)
+        cls.pool = SQLitePool(**cls.rows)
+        cls.sqlapi = api.SC3MicroApi(cls.pool)
+        cls.snapapi = api.SC3MicroApi(cls.pool, api.Inventory(cls.pool))
+
+    def pages(self, method, limit: int, **kwargs) -> list:
+        """Follow the continuation tokens and return the rows of all the pages."""
+        pages = list()
+        after = None
+        while True:
+            params = dict(kwargs, limit=str(limit))
+            if after is not None:
+                params['after'] = after
+            status, headers, body = call(method, **params)
+            self.assertEqual(status, 200, body)
+            pages.append(json.loads(body))
+            self.assertLessEqual(len(pages[-1]), limit)
+            after = headers.get('X-Continuation-Token')
+            if after is None:
+                return pages
+            self.assertEqual(len(pages[-1]), limit)
+
+    def checkpages(self, endpoint: str, keyfields: list, params: list):
+        for kwargs in params:
+            status, headers, body = call(getattr(self.sqlapi, endpoint).index, **kwargs)
+            self.assertEqual(status, 200, body)
+            # Also without pages in the order of the key
+            expected = json.loads(body)
+            for limit in [1, 7, 100, 10000]:
+                sql = self.pages(getattr(self.sqlapi, endpoint).index, limit, **kwargs)
+                snap = self.pages(getattr(self.snapapi, endpoint).index, limit, **kwargs)
+                self.assertEqual(sql, snap, 'Parameters: %s, limit: %d' % (kwargs, limit))
+                # Sorted by key and without rows skipped or repeated at the end of the pages
+                rows = [row for page in sql for row in page]
+                self.assertEqual(rows, sorted(rows, key=lambda row: [row[field] for field in keyfields]))
+                self.assertEqual(rows, expected, kwargs)
+
+    def test_tokens(self):
+        """Keys are recovered from the tokens and wrong tokens are rejected."""
+        keyfields = ['network', 'code', 'start', 'netstart', '_oid']
+        key = ['GE', 'APE', datetime.datetime(2010, 3, 1, 12, 30), datetime.datetime(1993, 1, 1), 1234]
+        self.assertEqual(api.decodetoken(api.encodetoken(key), keyfields), key)
+        for token in ['', 'xx', api.encodetoken(key[:4]), api.encodetoken(['GE', 'APE', 2010, '1993-01-01', 1]),
+                      api.encodetoken(['GE', 'APE', 'yesterday', '1993-01-01', 1]),
+                      api.encodetoken(['GE', 'APE', '2010-03-01', '1993-01-01', '1']),
+                      api.encodetoken(['GE', 'APE', '2010-03-01', '1993-01-01', True]), 'eyJhIjogMX0=']:
+            self.assertRaises(ValueError, api.decodetoken, token, keyfields)
+
+        for microapi in [self.sqlapi, self.snapapi]:
+            self.assertEqual(call(microapi.station.index, after='xx')[0], 400)
+            self.assertEqual(call(microapi.network.index, limit='0')[0], 400)
+
+    def test_stations(self):
+        """Same pages of stations from the DB and from the snapshot."""
+        self.checkpages('station', ['network', 'code', 'start'],
+                        [{}, {'net': 'GE,CX'}, {'sta': 'S0*'}, {'net': 'Z*', 'sta': 'S1?0,S2*', 'archive': 'GFZ'},
+                         {'minlat': '-20', 'maxlat': '60', 'minlon': '150', 'maxlon': '-120'},
+                         {'starttime': '2005-01-01', 'endtime': '2012-01-01', 'timematch': 'overlap'},
+                         {'fields': 'code,network,start'}])
+
+    def test_reusedcode(self):
+        """Stations with the same code and start in two networks with a reused code are not skipped."""
+        for microapi in [self.sqlapi, self.snapapi]:
+            for limit in [1, 2]:
+                rows = [row for page in self.pages(microapi.station.index, limit, net='X7_2005,X7_2010', sta='DUP')
+                        for row in page]
+                self.assertEqual(len(rows), 2)
+
+    def test_radius(self):
+        """A page with a radius stops reading the rows after the extra one."""
+        pool = mock.Mock(wraps=self.pool)
+        microapi = api.SC3MicroApi(pool)
+        self.pages(microapi.station.index, 5, lat='0', lon='0', maxradius='8000')
+        for args, kwargs in pool.rows.call_args_list:
+            self.assertEqual(kwargs['limit'], 6)
+            self.assertIsNotNone(kwargs['rowfilter'])
+
+    def test_networks(self):
+        """Same pages of networks from the DB and from the snapshot."""
+        self.checkpages('network', ['code', 'start'],
+                        [{}, {'net': 'GE,X*'}, {'restricted': '0'},
+                         {'starttime': '2005-01-01', 'endtime': '2012-01-01', 'timematch': 'overlap'}])
+
+    def test_vnets(self):
+        """Same pages of virtual networks from the DB and from the snapshot."""
+        self.checkpages('virtualnet', ['code', 'start'], [{}, {'net': '_GE*'}])
+
+
+class ResponseCacheTests(unittest.TestCase):
+    """Test the cache of rendered responses and its invalidation."""
+
+    def test_lru(self):
+        """The least recently used entries are evicted first, by number and by size."""
+        cache = api.LRUCache(maxentries=3, maxbytes=100)
+        for key in 'abc':
+            cache.set(key, key.upper(), size=10)
+        self.assertEqual(cache.get('a'), 'A')
+        cache.set('d', 'D', size=10)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual([cache.get(key) for key in 'acd'], ['A', 'C', 'D'])
+
+        cache.set('e', 'E', size=85)
+        self.assertEqual([cache.get(key) for key in 'acde'], [None, None, 'D', 'E'])
+        # Larger than the whole cache
+        cache.set('f', 'F', size=101)
+        self.assertIsNone(cache.get('f'))
+        self.assertEqual(cache.stats(), {'entries': 2, 'bytes': 95, 'hits': 6, 'misses': 4, 'evictions': 3})
+
+    def test_expiration(self):
+        """Entries expire after the time configured for their method."""
+        cache = api.ResponseCache(ttl=10.0, ttls={'network': 100.0})
+        with mock.patch.object(api.time, 'monotonic', return_value=1000.0):
+            cache.setresponse(('network',), 'application/json', b'[]')
+            cache.setresponse(('station',), 'application/json', b'[]')
+        with mock.patch.object(api.time, 'monotonic', return_value=1050.0):
+            self.assertEqual(cache.get(('network',)), ('application/json', b'[]', {}))
+            self.assertIsNone(cache.get(('station',)))
+        self.assertEqual(cache.stats()['bytes'], 2)
+
+    def test_tee(self):
+        """Streamed bodies are saved once complete, unless too large or invalidated meanwhile."""
+        cache = api.ResponseCache(maxbytes=10)
+        chunks = cache.tee(('a',), 'text/plain', iter([b'12', b'34']), {'Vary': 'Accept-Encoding'})
+        self.assertEqual(next(chunks), b'12')
+        self.assertIsNone(cache.get(('a',)))
+        self.assertEqual(list(chunks), [b'34'])
+        self.assertEqual(cache.get(('a',)), ('text/plain', b'1234', {'Vary': 'Accept-Encoding'}))
+
+        self.assertEqual(b''.join(cache.tee(('b',), 'text/plain', iter([b'123456', b'78901']))), b'12345678901')
+        self.assertIsNone(cache.get(('b',)))
+
+        chunks = cache.tee(('c',), 'text/plain', iter([b'12', b'34']))
+        next(chunks)
+        cache.invalidate()
+        list(chunks)
+        self.assertIsNone(cache.get(('c',)))
+
+    def test_key(self):
+        """The key does not depend on the order of the parameters nor on the ones not given."""
+        self.assertEqual(api.ResponseCache.key('station', net='GE', sta=None, restricted=1),
+                         api.ResponseCache.key('station', restricted='1', net='GE'))
+        self.assertNotEqual(api.ResponseCache.key('station', net='GE'), api.ResponseCache.key('network', net='GE'))
+
+    def test_api(self):
+        """Responses are served from the cache until the inventory changes."""
+        pool = SQLitePool(**randominventory(numstas=300))
+        for snapshot in [False, True]:
+            cache = api.ResponseCache()
+            inventory = api.Inventory(pool, snapshot=snapshot)
+            microapi = api.SC3MicroApi(pool, inventory, cache)
+            expected = call(microapi.station.index, net='GE')
+            with mock.patch.object(pool, 'connection', side_effect=AssertionError):
+                self.assertEqual(call(microapi.station.index, net='GE')[2], expected[2])
+            self.assertEqual(json.loads(call(microapi.stats)[2])['responses']['hits'], 1)
+
+            pool.conn.execute('update Station set place=?, _last_modified=? where _oid=1000',
+                              ('Place %d' % snapshot, datetime.datetime(2021 + snapshot, 1, 1)))
+            pool.conn.commit()
+            inventory.refresh()
+            self.assertEqual(cache.stats()['entries'], 0)
+
+
+class ConditionalTests(unittest.TestCase):
+    """Test the validators of the listings and the conditional requests."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = SQLitePool(**randominventory(numstas=300))
+
+    def test_snapshot(self):
+        """Responses from the snapshot are validated with their ETag or their modification time."""
+        microapi = api.SC3MicroApi(self.pool, api.Inventory(self.pool))
+        for method in [microapi.network.index, microapi.station.index, microapi.virtualnet.index]:
+            status, headers, body = call(method)
+            self.assertEqual(status, 200)
+            etag, lastmod = headers['ETag'], headers['Last-Modified']
+
+            self.assertEqual(call(method, headers={'If-None-Match': 'W/"x", ' + etag})[0], 304)
+            self.assertEqual(call(method, headers={'If-Modified-Since': lastmod})[0], 304)
+            # If-None-Match has precedence and "*" does not match a GET
+            self.assertEqual(call(method, headers={'If-None-Match': '*', 'If-Modified-Since': lastmod})[0], 200)
+            # Other parameters are another response
+            self.assertEqual(call(method, headers={'If-None-Match': etag}, outformat='text')[0], 200)
+
+    def test_db(self):
+        """Responses read from the DB have no validators, because it could have changed since the last check."""
+        microapi = api.SC3MicroApi(self.pool, api.Inventory(self.pool, snapshot=False))
+        for method in [microapi.network.index, microapi.station.index, microapi.virtualnet.index]:
+            status, headers, body = call(method)
+            self.assertEqual(status, 200)
+            self.assertNotIn('ETag', headers)
+            self.assertNotIn('Last-Modified', headers)
+            self.assertEqual(call(method, headers={'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})[0], 200)
+
+
+class SC3dbconnectionTests(unittest.TestCase):
+    """Test the buffered and server-side cursors of a connection."""
+
+    def setUp(self):
+        patcher = mock.patch.object(api.MySQLdb, 'connect')
+        self.connect = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.conn = api.SC3dbconnection('host', 'user', 'password')
+        self.cursor = self.connect.return_value.cursor.return_value
+
+    def test_cursors(self):
+        """Short queries use a buffered cursor and the streamed ones an unbuffered one."""
+        self.conn.execute('query', [1])
+        self.connect.return_value.cursor.assert_called_with(api.DictCursor)
+        self.conn.execute('query', [1], serverside=True)
+        self.connect.return_value.cursor.assert_called_with(api.SSDictCursor)
+        # The cursor of the previous query is released
+        self.assertEqual(self.cursor.close.call_count, 1)
+        self.cursor.execute.assert_called_with('query', [1])
+
+    def test_iterrows(self):
+        """The rows are read in batches until there are no more."""
+        self.cursor.fetchmany.side_effect = [[1, 2], [3, 4], [5], []]
+        self.conn.execute('query', [], serverside=True)
+        self.assertEqual(list(self.conn.iterrows(2)), [1, 2, 3, 4, 5])
+        self.cursor.fetchmany.assert_called_with(2)
+
+
+class FakeConnection(object):
+    """Connection returning as many rows as the first variable of the query."""
+
+    def __init__(self, host: str, user: str, password: str, db: str = 'seiscomp3'):
+        self.rows = iter([])
+        self.closed = False
+
+    def ping(self):
+        pass
+
+    def execute(self, query: str, variables, serverside: bool = False):
+        self.rows = iter(range(variables[0]))
+
+    def iterrows(self, batch_size: int = 1000):
+        yield from self.rows
+
+    def release(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class SC3dbpoolTests(unittest.TestCase):
+    """Test that the connections go back to the pool also when the rows are streamed."""
+
+    def setUp(self):
+        patcher = mock.patch.object(api, 'SC3dbconnection', FakeConnection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = api.SC3dbpool('host', 'user', 'password', minsize=0, maxsize=4, timeout=0.1, maxstreams=1)
+
+    def assertAvailable(self, num: int):
+        """Exactly num connections can be checked out."""
+        with contextlib.ExitStack() as stack:
+            for _ in range(num):
+                stack.enter_context(self.pool.connection())
+            with self.assertRaises(cherrypy.HTTPError):
+                stack.enter_context(self.pool.connection())
+
+    def test_size(self):
+        """Wrong sizes are rejected and the connections of minsize are opened at startup."""
+        for minsize, maxsize in [(-1, 4), (0, 0), (5, 4)]:
+            self.assertRaises(ValueError, api.SC3dbpool, 'host', 'user', 'password', minsize=minsize,
+                              maxsize=maxsize)
+        self.assertRaises(ValueError, api.SC3dbpool, 'host', 'user', 'password', maxsize=4, maxstreams=4)
+        pool = api.SC3dbpool('host', 'user', 'password', minsize=2, maxsize=4)
+        with pool.connection() as first, pool.connection() as second:
+            self.assertIsNot(first, second)
+
+    def test_reuse(self):
+        """The last connection given back is the next one checked out."""
+        with self.pool.connection() as conn:
+            first = conn
+        with self.pool.connection() as conn:
+            self.assertIs(conn, first)
+        self.assertAvailable(4)
+
+    def test_busy(self):
+        """No more than maxsize connections at the same time. The next request gets an error 503."""
+        with contextlib.ExitStack() as stack:
+            for _ in range(4):
+                stack.enter_context(self.pool.connection())
+            with self.assertRaises(cherrypy.HTTPError) as error:
+                stack.enter_context(self.pool.connection())
+            self.assertEqual(error.exception.status, 503)
+        self.assertAvailable(4)
+
+    def test_error(self):
+        """A connection failing with an error of the DB is closed and not given back to the pool."""
+        with self.assertRaises(MySQLdb.Error):
+            with self.pool.connection() as conn:
+                failed = conn
+                raise MySQLdb.Error()
+        self.assertTrue(failed.closed)
+        self.assertAvailable(4)
+        with self.pool.connection() as conn:
+            self.assertIsNot(conn, failed)
+
+    def test_close(self):
+        """Idle connections are closed."""
+        with self.pool.connection() as first, self.pool.connection() as second:
+            pass
+        self.pool.close()
+        self.assertTrue(first.closed)
+        self.assertTrue(second.closed)
+
+    def test_small(self):
+        """Results fitting in one chunk or not to be streamed are read at once."""
+        self.assertEqual(self.pool.rows('query', [5], size=10), list(range(5)))
+        self.assertEqual(self.pool.rows('query', [25], size=10, stream=False), list(range(25)))
+        self.assertAvailable(4)
+
+    def test_limit(self):
+        """Rows are filtered while they are read and no more than the limit are read."""
+        conn = FakeConnection('host', 'user', 'password')
+        with mock.patch.object(api, 'SC3dbconnection', return_value=conn):
+            self.assertEqual(self.pool.rows('query', [1000], size=10, rowfilter=lambda row: row % 2, limit=3),
+                             [1, 3, 5])
+        self.assertEqual(next(conn.rows), 6)
+        self.assertAvailable(4)
+
+    def test_stream(self):
+        """Large results are streamed holding a connection until they are consumed."""
+        rows = self.pool.rows('query', [25], size=10)
+        self.assertNotIsInstance(rows, list)
+        self.assertAvailable(3)
+        self.assertEqual(list(rows), list(range(25)))
+        self.assertAvailable(4)
+
+        # The connection is reused
+        with self.pool.connection() as conn:
+            self.assertFalse(conn.closed)
+
+    def test_maxstreams(self):
+        """Large results are read at once if all slots for streaming are in use."""
+        rows = self.pool.rows('query', [25], size=10)
+        self.assertEqual(self.pool.rows('query', [25], size=10), list(range(25)))
+        self.assertAvailable(3)
+        rows.close()
+        self.assertNotIsInstance(self.pool.rows('query', [25], size=10), list)
+
+    def test_disconnect(self):
+        """A connection with rows pending is closed and not given back to the pool."""
+        rows = self.pool.rows('query', [25], size=10)
+        next(rows)
+        with self.pool.connection() as conn:
+            other = conn
+        rows.close()
+        self.assertAvailable(4)
+        with self.pool.connection() as conn:
+            self.assertIs(conn, other)
+
+        # Never consumed
+        rows = self.pool.rows('query', [25], size=10)
+        del rows
+        self.assertAvailable(4)
+
+
+class StreamingTests(unittest.TestCase):
+    """Test that only the rows read from the DB while the response is sent are streamed."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = SQLitePool(**randominventory(numstas=300))
+
+    def streamed(self, pool, method: str, **kwargs) -> bool:
+        microapi = api.SC3MicroApi(pool)
+        status, headers, body = call(getattr(microapi, method).index, **kwargs)
+        self.assertEqual(status, 200, body)
+        return cherrypy.serving.response.stream
+
+    def test_lists(self):
+        """Rows read at once are rendered before the status is sent."""
+        for method in ['network', 'station', 'virtualnet']:
+            self.assertFalse(self.streamed(self.pool, method))
+            self.assertFalse(self.streamed(self.pool, method, limit='5'))
+
+    def test_generators(self):
+        """Rows read from the DB while the response is sent are streamed."""
+        pool = mock.Mock(wraps=self.pool)
+        pool.rows.side_effect = lambda *args, **kwargs: iter(self.pool.rows(*args, **kwargs))
+        for method in ['network', 'station', 'virtualnet']:
+            self.assertTrue(self.streamed(pool, method))
+
+
+class AccessTests(unittest.TestCase):
+    """Test the decision about the access of a user to a stream."""
+
+    @classmethod
+    def setUpClass(cls):
+        netrows = dict()
+        for oid, (code, start, end, restricted) in enumerate([('GE', 1990, None, 0), ('ZS', 1990, None, 1),
+                                                              ('X7', 2000, 2010, 1), ('X7', 2012, None, 0)],
+                                                             start=1):
+            netrows[oid] = {'_oid': oid, 'code': code, 'start': datetime.datetime(start, 1, 1),
+                            'end': datetime.datetime(end, 1, 1) if end is not None else None, 'netClass': 'p',
+                            'archive': 'GFZ', 'restricted': restricted, 'shared': 1}
+        access = [('X7', '', '', '', '@gfz-potsdam.de', datetime.datetime(1990, 1, 1), None),
+                  ('ZS', 'S001', '', '', 'user@gfz-potsdam.de', datetime.datetime(1990, 1, 1), None),
+                  ('ZS', 'S002', '00', 'HHZ', 'other@x.org', datetime.datetime(2000, 1, 1),
+                   datetime.datetime(2015, 1, 1)),
+                  ('ZS', 'S003', '', '', 'a_b%@x.org', datetime.datetime(1990, 1, 1), None)]
+        cls.pool = SQLitePool(netrows, dict(), dict(), dict(), accessrows=access)
+        cls.microapi = api.SC3MicroApi(cls.pool)
+        cls.indexapi = api.SC3MicroApi(cls.pool, api.Inventory(cls.pool, snapshot=False, entitlements=True))
+
+    def assertDecision(self, decision: str, nslc: str, email: str, **kwargs):
+        # Same decision from the DB and from the index of the Access table
+        for microapi in [self.microapi, self.indexapi]:
+            status, headers, body = call(microapi.access.index, nslc=nslc, email=email, **kwargs)
+            if decision == 'denied':
+                self.assertEqual(status, 403, nslc)
+            elif decision in ('ambiguous', 'notfound'):
+                self.assertEqual(status, 400, nslc)
+            else:
+                self.assertEqual(status, 200, nslc)
+                self.assertEqual(headers['X-Access-Level'], decision, nslc)
+                self.assertEqual(body, b'')
+
+    def test_levels(self):
+        """Access is granted at the level of the network, the station or the channel."""
+        self.assertDecision('open', 'GE.APE..BHZ', 'nobody@x.org')
+        self.assertDecision('station', 'ZS.S001..BHZ', 'user@gfz-potsdam.de')
+        self.assertDecision('denied', 'ZS.S001..BHZ', 'other@x.org')
+        self.assertDecision('channel', 'ZS.S002.00.HHZ', 'other@x.org')
+        self.assertDecision('denied', 'ZS.S002.00.BHZ', 'other@x.org')
+        self.assertDecision('denied', 'ZS.S002', 'other@x.org')
+        self.assertDecision('network', 'X7.S003..BHZ', 'any@gfz-potsdam.de', starttime='2001-01-01',
+                            endtime='2002-01-01')
+
+    def test_windows(self):
+        """Grants and epochs of the network must match the time window."""
+        self.assertDecision('channel', 'ZS.S002.00.HHZ', 'other@x.org', starttime='2001-01-01',
+                            endtime='2002-01-01')
+        self.assertDecision('denied', 'ZS.S002.00.HHZ', 'other@x.org', starttime='2001-01-01',
+                            endtime='2016-01-01')
+        self.assertDecision('denied', 'ZS.S002.00.HHZ', 'other@x.org', starttime='1995-01-01')
+        self.assertDecision('open', 'X7.S003..BHZ', 'nobody@x.org', starttime='2013-01-01', endtime='2014-01-01')
+        self.assertDecision('ambiguous', 'X7.S003..BHZ', 'any@gfz-potsdam.de')
+        self.assertDecision('notfound', 'AA.XXX..BHZ', 'user@gfz-potsdam.de')
+
+    def test_queries(self):
+        """The restricted flag and the grants at all levels are read with one query."""
+        with self.pool.connection() as conn:
+            with mock.patch.object(conn, 'execute', wraps=conn.execute) as execute:
+                self.assertEqual(self.microapi.access.decide(conn, 'other@x.org', 'ZS', 'S002', '00', 'HHZ'),
+                                 'channel')
+        self.assertEqual(execute.call_count, 1)
+
+    def test_wildcards(self):
+        """Users are substrings of the email and can contain the wildcards of LIKE."""
+        self.assertDecision('station', 'ZS.S003..BHZ', 'xa-bc@x.org')
+        self.assertDecision('station', 'ZS.S003..BHZ', 'a_b@x.org')
+        self.assertDecision('denied', 'ZS.S003..BHZ', 'ab@x.org')
+        self.assertDecision('denied', 'ZS.S003..BHZ', 'a-b@y.org')
+
+    def test_bundle(self):
+        """Same open networks and grants from the DB and from the index of the Access table."""
+        for email in ['user@gfz-potsdam.de', 'other@x.org', 'xa-bc@x.org', 'nobody@x.org']:
+            status, headers, body = call(self.microapi.access.bundle, email=email)
+            self.assertEqual(status, 200)
+            self.assertNotIn('ETag', headers)
+            index = call(self.indexapi.access.bundle, email=email)
+            self.assertEqual(json.loads(body), json.loads(index[2]), email)
+
+        bundle = json.loads(body)
+        self.assertEqual([(net['network'], net['start']) for net in bundle['open']],
+                         [('GE', '1990-01-01T00:00:00'), ('X7', '2012-01-01T00:00:00')])
+        self.assertEqual(bundle['grants'], [])
+        bundle = json.loads(call(self.microapi.access.bundle, email='user@gfz-potsdam.de')[2])
+        self.assertEqual([(grant['network'], grant['station']) for grant in bundle['grants']],
+                         [('X7', ''), ('ZS', 'S001')])
+
+    def test_bundle_conditional(self):
+        """The bundle from the index of the Access table can be validated with its ETag."""
+        status, headers, body = call(self.indexapi.access.bundle, email='user@gfz-potsdam.de')
+        self.assertEqual(call(self.indexapi.access.bundle, email='user@gfz-potsdam.de',
+                              headers={'If-None-Match': headers['ETag']})[0], 304)
+        self.assertEqual(call(self.indexapi.access.bundle, email='user@gfz-potsdam.de',
+                              headers={'If-Modified-Since': headers['Last-Modified']})[0], 304)
+        self.assertEqual(call(self.indexapi.access.bundle, email='other@x.org',
+                              headers={'If-None-Match': headers['ETag']})[0], 200)
+        self.assertEqual(call(self.indexapi.access.bundle, email='user@gfz-potsdam.de', wrongparam='1')[0], 400)
+
+    def test_entitlements(self):
+        """The index of the Access table decides without queries and is rebuilt when Access changes."""
+        pool = SQLitePool(**randominventory(numstas=100))
+        pool.conn.execute("update Network set restricted=1 where code='ZS'")
+        pool.conn.commit()
+        inventory = api.Inventory(pool, snapshot=False, entitlements=True)
+        microapi = api.SC3MicroApi(pool, inventory)
+        with mock.patch.object(pool, 'connection', side_effect=AssertionError):
+            self.assertEqual(call(microapi.access.index, nslc='ZS.S002..BHZ', email='user@gfz-potsdam.de')[0], 403)
+            self.assertEqual(call(microapi.access.index, nslc='AA.XXX..BHZ', email='user@gfz-potsdam.de')[0], 400)
+
+        pool.conn.execute("insert into Access values (1, 0, ?, 'ZS', '', '', '', '@gfz-potsdam.de', ?, NULL)",
+                          (datetime.datetime(2021, 1, 1), datetime.datetime(1990, 1, 1)))
+        pool.conn.commit()
+        inventory.refresh()
+        with mock.patch.object(pool, 'connection', side_effect=AssertionError):
+            status, headers, body = call(microapi.access.index, nslc='ZS.S002..BHZ', email='user@gfz-potsdam.de')
+        self.assertEqual((status, headers['X-Access-Level']), (200, 'network'))
+
+    def test_cache_expiration(self):
+        """Decisions expire after the time configured for their result."""
+        cache = api.AccessCache(allow=100.0, deny=10.0, notfound=5.0)
+        with mock.patch.object(api.time, 'monotonic', return_value=1000.0):
+            for decision in ['network', 'denied', 'notfound', 'ambiguous']:
+                cache.setdecision((decision,), decision)
+        with mock.patch.object(api.time, 'monotonic', return_value=1008.0):
+            self.assertEqual([cache.get((decision,)) for decision in ['network', 'denied', 'notfound', 'ambiguous']],
+                             ['network', 'denied', None, None])
+        with mock.patch.object(api.time, 'monotonic', return_value=1050.0):
+            self.assertEqual([cache.get((decision,)) for decision in ['network', 'denied']], ['network', None])
+
+    def test_cache_api(self):
+        """Decisions are served from the cache until Access changes."""
+        pool = SQLitePool(**randominventory(numstas=100), accessrows=[
+            ('ZS', 'S001', '', '', 'user@gfz-potsdam.de', datetime.datetime(1990, 1, 1), None)])
+        pool.conn.execute("update Network set restricted=1 where code='ZS'")
+        pool.conn.commit()
+        cache = api.AccessCache()
+        inventory = api.Inventory(pool, snapshot=False)
+        microapi = api.SC3MicroApi(pool, inventory, accesscache=cache)
+
+        self.assertEqual(call(microapi.access.index, nslc='ZS.S002..BHZ', email='user@gfz-potsdam.de')[0], 403)
+        with mock.patch.object(pool, 'connection', side_effect=AssertionError):
+            self.assertEqual(call(microapi.access.index, nslc='ZS.S002..BHZ', email='user@gfz-potsdam.de')[0], 403)
+        self.assertEqual(json.loads(call(microapi.stats)[2])['access']['hits'], 1)
+
+        pool.conn.execute("insert into Access values (2, 0, ?, 'ZS', 'S002', '', '', 'user@gfz-potsdam.de', ?, NULL)",
+                          (datetime.datetime(2021, 1, 1), datetime.datetime(1990, 1, 1)))
+        pool.conn.commit()
+        inventory.refresh()
+        self.assertEqual(cache.stats()['entries'], 0)
+        self.assertEqual(call(microapi.access.index, nslc='ZS.S002..BHZ', email='user@gfz-potsdam.de')[0], 200)
+
+
+class AccessBatchTests(unittest.TestCase):
+    """Test the batch method to check access to many streams."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.rows = randominventory()
+        access = [('X7', '', '', '', '@gfz-potsdam.de', datetime.datetime(1990, 1, 1), None),
+                  ('ZS', 'S001', '', '', 'user@gfz-potsdam.de', datetime.datetime(1990, 1, 1), None),
+                  ('4C', 'S002', '00', 'HHZ', 'other@x.org', datetime.datetime(2000, 1, 1),
+                   datetime.datetime(2015, 1, 1))]
+        cls.pool = SQLitePool(accessrows=access, **cls.rows)
+        cls.sqlapi = api.SC3MicroApi(cls.pool)
+        cls.indexapi = api.SC3MicroApi(cls.pool, api.Inventory(cls.pool, snapshot=False, entitlements=True))
+
+    def test_batch(self):
+        """Same decisions from the DB and from the index of the Access table."""
+        stations = sorted(self.rows['starows'].values(), key=lambda sta: sta['_oid'])[:300]
+        items = [{'nslc': '%s.%s.00.HHZ' % (self.rows['netrows'][sta['_parent_oid']]['code'], sta['code'])}
+                 for sta in stations]
+        items.extend([{'nslc': 'ZS.S001..BHZ', 'starttime': '2010-01-01T00:00:00'}, {'nslc': 'AA.XXX..BHZ'},
+                      {'nslc': '4C.S002.00.HHZ', 'starttime': '2001-01-01', 'endtime': '2002-01-01'}])
+        for email in ['user@gfz-potsdam.de', 'other@x.org', 'nobody@x.org']:
+            body = json.dumps({'email': email, 'items': items}).encode('utf-8')
+            sql = call(self.sqlapi.access.batch, body=body)
+            index = call(self.indexapi.access.batch, body=body)
+            self.assertEqual(sql[0], 200, sql[2])
+            self.assertEqual(json.loads(sql[2]), json.loads(index[2]), email)
+            self.assertEqual([item['nslc'] for item in json.loads(sql[2])], [item['nslc'] for item in items])
+
+    def test_single(self):
+        """Same decisions as the method checking a single stream."""
+        window = {'starttime': '1993-01-01', 'endtime': '1994-01-01'}
+        items = [{'nslc': 'X7.S001..BHZ'}, dict(nslc='ZS.S001..BHZ', **window), dict(nslc='ZS.S002..BHZ', **window),
+                 {'nslc': 'GE.APE..BHZ', 'starttime': '1998-01-01', 'endtime': '1999-01-01'},
+                 {'nslc': 'ZS.S001..BHZ', 'starttime': '2010-01-01T00:00:00'}, {'nslc': 'AA.XXX..BHZ'}]
+        for email in ['user@gfz-potsdam.de', 'other@x.org']:
+            body = json.dumps({'email': email, 'items': items}).encode('utf-8')
+            for item, result in zip(items, json.loads(call(self.sqlapi.access.batch, body=body)[2])):
+                status, headers, message = call(self.sqlapi.access.index, email=email, **item)
+                self.assertEqual(result['access'], status == 200, item)
+                if status == 200:
+                    self.assertEqual(result['level'], headers['X-Access-Level'], item)
+                else:
+                    self.assertIn(result['level'], ['denied'] if status == 403 else ['notfound', 'ambiguous'], item)
+
+    def test_batch_wrong(self):
+        """Wrong parameters or items are rejected with an error 400."""
+        item = {'nslc': 'GE.APE..BHZ'}
+        for request in [{'items': [item]}, {'email': 12, 'items': [item]}, {'email': ['a@b.c'], 'items': [item]},
+                        {'email': ' ', 'items': [item]}, {'email': 'a@b.c', 'items': item},
+                        {'email': 'a@b.c', 'items': 'GE.APE..BHZ'}, {'email': 'a@b.c', 'items': [12]},
+                        {'email': 'a@b.c', 'items': [{'nslc': 12}]}, {'email': 'a@b.c', 'items': [{'nslc': ''}]},
+                        {'email': 'a@b.c', 'items': [{'nslc': 'GE.APE..BHZ', 'starttime': 2010}]}, []]:
+            body = json.dumps(request).encode('utf-8')
+            self.assertEqual(call(self.sqlapi.access.batch, body=body)[0], 400, request)
+
+        body = json.dumps({'email': 'a@b.c', 'items': [item]}).encode('utf-8')
+        self.assertEqual(call(self.sqlapi.access.batch, body=body, wrongparam='1')[0], 400)
+        self.assertEqual(call(self.sqlapi.access.batch, body=body)[0], 200)
+
+
+class RoutingXMLTests(unittest.TestCase):
+    """Test the renderer of the routes with the services of the data center."""
+
+    # Route of the original hardcoded template with the services of GEOFON
+    geofonroute = """
+ <ns0:route networkCode="GE" stationCode="APE" locationCode="*" streamCode="*">
+  <ns0:station address="https://geofon.gfz.de/fdsnws/station/1/query" priority="1" start="2010-01-01T00:00:00" end="" />
+  <ns0:wfcatalog address="https://geofon.gfz.de/eidaws/wfcatalog/1/query" priority="1" start="2010-01-01T00:00:00" end="" />
+  <ns0:dataselect address="https://geofon.gfz.de/fdsnws/dataselect/1/query" priority="1" start="2010-01-01T00:00:00" end="" />
+  <ns0:availability address="https://geofon.gfz.de/fdsnws/availability/1/query" priority="1" start="2010-01-01T00:00:00" end="" />
+ </ns0:route>
+ """
+
+    @staticmethod
+    def parse(routing, route: str):
+        """Element of a route in a complete document."""
+        return ET.fromstring(routing.header + route + routing.footer)[0]
+
+    def config(self, services: str) -> configparser.RawConfigParser:
+        config = configparser.RawConfigParser()
+        config.read_string('[Routing]\nservices = %s\n' % services)
+        return config
+
+    def test_default(self):
+        """Same route as the original template without configuration."""
+        for routing in [api.RoutingXML(), api.RoutingXML.fromconfig(self.config('')),
+                        api.RoutingXML.fromconfig(configparser.RawConfigParser())]:
+            self.assertEqual(routing.route('GE', 'APE', datetime.datetime(2010, 1, 1), None), self.geofonroute)
+
+    def test_fromconfig(self):
+        """Services configured with and without priority."""
+        routing = api.RoutingXML.fromconfig(self.config('\n  station https://x.org/fdsnws/station/1/query 2'
+                                                        '\n  dataselect https://x.org/fdsnws/dataselect/1/query'))
+        self.assertEqual(routing.services, [('station', 'https://x.org/fdsnws/station/1/query', 2),
+                                            ('dataselect', 'https://x.org/fdsnws/dataselect/1/query', 1)])
+        route = self.parse(routing, routing.route('CX', '*', datetime.datetime(2000, 1, 1),
+                                                   datetime.datetime(2001, 1, 1)))
+        self.assertEqual([(service.tag.split('}')[-1], service.get('address'), service.get('priority'),
+                           service.get('start'), service.get('end')) for service in route],
+                         [('station', 'https://x.org/fdsnws/station/1/query', '2', '2000-01-01T00:00:00',
+                           '2001-01-01T00:00:00'),
+                          ('dataselect', 'https://x.org/fdsnws/dataselect/1/query', '1', '2000-01-01T00:00:00',
+                           '2001-01-01T00:00:00')])
+
+        for services in ['station', 'station https://x.org 1 2', 'station https://x.org high', '1station https://x.org',
+                         'sta<tion https://x.org']:
+            self.assertRaises(ValueError, api.RoutingXML.fromconfig, self.config(services))
+        self.assertRaises(ValueError, api.RoutingXML, [])
+
+    def test_escaping(self):
+        """Addresses with special characters of XML or of the formatting of strings."""
+        address = 'https://x.org/query?a=1&b="%s"&c=<100%>'
+        routing = api.RoutingXML([('station', address, 1)])
+        route = self.parse(routing, routing.route('GE', '*', datetime.datetime(2000, 1, 1), None))
+        self.assertEqual(route[0].get('address'), address)
+
+    def test_priority(self):
+        """The priority of all services can be replaced in a route."""
+        routing = api.RoutingXML()
+        start = datetime.datetime(2010, 1, 1)
+        route = self.parse(routing, routing.route('GE', 'APE', start, None, priority=3))
+        self.assertEqual([service.get('priority') for service in route], ['3'] * 4)
+        self.assertEqual(routing.route('GE', 'APE', start, None), self.geofonroute)
+
+    def test_routes(self):
+        """Documents of networks and stations are the same whatever the size of the chunks."""
+        routing = api.RoutingXML()
+        rows = [{'network': 'GE', 'code': 'S%03d' % num, 'start': datetime.datetime(2000, 1, num % 28 + 1),
+                 'end': None if num % 2 else datetime.datetime(2010, 1, 1)} for num in range(250)]
+        document = b''.join(routing.routes(rows, stations=True))
+        for size in [1, 7, 1000]:
+            self.assertEqual(b''.join(routing.routes(rows, stations=True, size=size)), document)
+        routes = [route for route in ET.fromstring(document)]
+        self.assertEqual([(route.get('networkCode'), route.get('stationCode')) for route in routes],
+                         [('GE', row['code']) for row in rows])
+        self.assertEqual(b''.join(routing.routes([])), (routing.header + routing.footer).encode('utf-8'))
+
+        routes = [route for route in ET.fromstring(b''.join(routing.routes(rows)))]
+        self.assertEqual([(route.get('networkCode'), route.get('stationCode')) for route in routes],
+                         [(row['code'], '*') for row in rows])
+
+    def test_api(self):
+        """The configured services are used by all the methods with XML output."""
+        pool = SQLitePool(**randominventory())
+        routing = api.RoutingXML([('dataselect', 'https://x.org/fdsnws/dataselect/1/query', 2)])
+        for microapi in [api.SC3MicroApi(pool, routing=routing),
+                         api.SC3MicroApi(pool, api.Inventory(pool), routing=routing)]:
+            for index, args in [(microapi.station.index, []), (microapi.network.index, []),
+                                (microapi.routing.index, [])]:
+                status, headers, body = call(index, *args, **({} if index == microapi.routing.index
+                                                              else {'outformat': 'xml'}))
+                self.assertEqual(status, 200, body)
+                routes = [route for route in ET.fromstring(body) if route.tag.endswith('route')]
+                self.assertGreater(len(routes), 0)
+                for route in routes:
+                    self.assertEqual([(service.tag.split('}')[-1], service.get('address')) for service in route],
+                                     [('dataselect', 'https://x.org/fdsnws/dataselect/1/query')])
+
+
+class RoutingRulesTests(unittest.TestCase):
+    """Test the parsing of the rules of the routing document."""
+
+    def test_rules(self):
+        """Codes of every rule and the priorities of networks and stations."""
+        rules = api.RoutingRules('[Networks]\nskip = ZS_2007, CX\npriority2 = GE\npriority3 = ZS_2017\n'
+                                 '[Stations]\ninclude = 4C_2011.*, GE.AP?,GE.W*\npriority2 = GE.APE\n'
+                                 'priority3 = GE.WLF, GE\nskip = GE.APE\n[Virtualnets]\nskip = _CHILE,\n')
+        self.assertEqual(rules.nets2skip, {'ZS_2007', 'CX'})
+        self.assertEqual(rules.stations2skip, {'GE.APE'})
+        self.assertEqual(rules.vnets2skip, {'_CHILE'})
+        self.assertEqual([netsta for netsta, netmatcher, stamatcher in rules.stations2add],
+                         ['4C_2011.*', 'GE.AP?', 'GE.W*'])
+        netsta, netmatcher, stamatcher = rules.stations2add[1]
+        self.assertTrue(netmatcher.match('GE') and stamatcher.match('APE') and not stamatcher.match('APEX'))
+
+        # Priority 3 wins if a code is in both lists
+        for code, priority in [('GE', 3), ('ZS_2017', 3), ('GE.APE', 2), ('GE.WLF', 3), ('CX', None),
+                               ('GE.XXX', None)]:
+            self.assertEqual(rules.priority(code), priority, code)
+
+    def test_empty(self):
+        """No rules at all."""
+        rules = api.RoutingRules()
+        self.assertEqual((rules.nets2skip, rules.stations2skip, rules.vnets2skip, rules.stations2add),
+                         (set(), set(), set(), []))
+        self.assertIsNone(rules.priority('GE'))
+        self.assertNotEqual(rules.digest, api.RoutingRules('[Networks]\nskip = GE\n').digest)
+
+    def test_wrong(self):
+        """Rules which cannot be parsed or stations without network or year are rejected."""
+        for text in ['[Networks\nskip = GE', 'skip = GE', '[Stations]\ninclude = GE',
+                     '[Stations]\ninclude = GE.APE.00', '[Stations]\ninclude = ZS.*', '[Stations]\ninclude = ,.APE']:
+            self.assertRaises(ValueError, api.RoutingRules, text)
+
+    def test_fromfile(self):
+        """Rules read from a file."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'rules.cfg')
+            with open(filename, 'w', encoding='utf-8') as fout:
+                fout.write('[Virtualnets]\nskip = _GEALL\n')
+            self.assertEqual(api.RoutingRules.fromfile(filename).vnets2skip, {'_GEALL'})
+
+
+class RoutingAPITests(unittest.TestCase):
+    """Test the routing document built from the DB and from the snapshot."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.rows = randominventory()
+        cls.pool = SQLitePool(**cls.rows)
+        cls.sqlapi = api.SC3MicroApi(cls.pool)
+        cls.snapapi = api.SC3MicroApi(cls.pool, api.Inventory(cls.pool))
+
+    def routes(self, body: bytes) -> list:
+        """Network, station and priority of the routes in a document."""
+        return [(route.get('networkCode'), route.get('stationCode'), route[0].get('start'), route[0].get('priority'))
+                for route in ET.fromstring(body) if route.tag.endswith('route')]
+
+    @staticmethod
+    def vnetworks(body: bytes) -> list:
+        """Virtual networks in a document with the list of their streams."""
+        return [(vnet.get('networkCode'), [(stream.get('networkCode'), stream.get('stationCode'), stream.get('start'))
+                                           for stream in vnet])
+                for vnet in ET.fromstring(body) if vnet.tag.endswith('vnetwork')]
+
+    def test_snapshot_sql(self):
+        """Same document from the DB and from the snapshot."""
+        netcodes = sorted(set(api.extendedcode(net['code'], net['start']) for net in self.rows['netrows'].values()))
+        rnd = random.Random(5)
+        for _ in range(20):
+            rules = '[Networks]\nskip = %s\npriority2 = %s\n[Stations]\ninclude = %s\npriority3 = %s\n' \
+                    '[Virtualnets]\nskip = _CHILE\n' % \
+                    (rnd.choice(netcodes), rnd.choice(netcodes),
+                     ', '.join('%s.%s' % (code, rnd.choice(['*', 'S0*', 'S1?0'])) for code in rnd.sample(netcodes, 4)),
+                     ', '.join('%s.S%03d' % (rnd.choice(netcodes), num) for num in range(0, 300, 7)))
+            for params in [{}, {'archive': 'GFZ'}, {'shared': '1', 'vnets': '1'}, {'archive': 'ODC', 'shared': '0'}]:
+                sql = call(self.sqlapi.routing.index, body=rules.encode('utf-8'), **params)
+                snap = call(self.snapapi.routing.index, body=rules.encode('utf-8'), **params)
+                self.assertEqual(sql[0], 200, sql[2])
+                self.assertEqual(sql[2], snap[2], 'Rules:\n%s\nParameters: %s' % (rules, params))
+
+    def test_routesfromsc3(self):
+        """Same routes as routesfromSC3 applying the rules to the output of the other methods."""
+        netcodes = sorted(set(api.extendedcode(net['code'], net['start']) for net in self.rows['netrows'].values()))
+        # A station of a temporary network starting in another year than its network
+        temporary = [(net, sta) for sta in self.rows['starows'].values()
+                     for net in [self.rows['netrows'][sta['_parent_oid']]]
+                     if api.istemporary(net['code']) and sta['start'].year != net['start'].year][0]
+        include = '%s.*' % api.extendedcode(temporary[0]['code'], temporary[0]['start'])
+        prioritized = '%s.%s' % (api.extendedcode(temporary[0]['code'], temporary[1]['start']), temporary[1]['code'])
+
+        stations = '[Stations]\ninclude = GE.S0*, CX.*, %s, %s.S1?0\npriority2 = %s\npriority3 = GE.S001\n' \
+                   'skip = CX.S100\n' % (include, netcodes[-2], prioritized)
+        # Priorities of networks without any network skipped, and with networks skipped
+        for rules in ['[Networks]\npriority2 = GE\npriority3 = %s\n' % netcodes[-1] + stations,
+                      '[Networks]\nskip = %s\npriority2 = GE\npriority3 = %s\n' % (netcodes[0], netcodes[-1]) +
+                      stations + '[Virtualnets]\nskip = _CHILE\n']:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                filename = os.path.join(tmpdir, 'rules.cfg')
+                with open(filename, 'w', encoding='utf-8') as fout:
+                    fout.write(rules)
+
+                for args in [[], ['-a', 'GFZ'], ['-s', '1', '--vnets'], ['--vnets']]:
+                    params = {param: args[args.index(option) + 1]
+                              for option, param in [('-a', 'archive'), ('-s', 'shared')] if option in args}
+                    if '--vnets' in args:
+                        params['vnets'] = '1'
+                    with mock.patch.object(routesfromSC3, 'httpsession', return_value=APISession(self.sqlapi)):
+                        expected = routesfromsc3('-r', filename, *args)
+                    for microapi in [self.sqlapi, self.snapapi]:
+                        microapi.routing.rules = api.RoutingRules.fromfile(filename)
+                        status, headers, body = call(microapi.routing.index, **params)
+                        microapi.routing.rules = api.RoutingRules()
+                        self.assertEqual(status, 200, body)
+                        self.assertEqual(self.routes(body), self.routes(expected), args)
+                        self.assertEqual(self.vnetworks(body), self.vnetworks(expected), args)
+
+                    routes = self.routes(expected)
+                    self.assertIn(('GE', '*', '2'), [route[:2] + route[3:] for route in routes])
+                    if not len(args):
+                        self.assertIn((temporary[0]['code'], temporary[1]['code'], '2'),
+                                      [route[:2] + route[3:] for route in routes])
+                    if '--vnets' in args:
+                        # Every virtual network once, also the ones with many epochs
+                        vnets = [code for code, members in self.vnetworks(expected)]
+                        self.assertEqual(vnets, sorted(set(vnets)))
+                        self.assertIn('_GEALL', vnets)
+
+    def test_fetchall(self):
+        """routesfromSC3 gets the responses of concurrent requests in the order of the requests."""
+        requests2do = [('http://localhost/sc3microapi/station/GE/S%03d' % num, {'outformat': 'xml'})
+                       for num in range(20)]
+
+        def get(url: str, params: dict) -> tuple:
+            # The first requests are the slowest
+            time.sleep(0.002 * (len(requests2do) - int(url[-3:])))
+            return url, params
+
+        session = mock.Mock(get=get)
+        for workers in [1, 4]:
+            self.assertEqual(routesfromSC3.fetchall(session, requests2do, workers), requests2do)
+
+    def test_parent_network(self):
+        """Stations of a reused temporary code are matched with the network epoch they belong to."""
+        netrows = {1: {'_oid': 1, 'code': 'X7', 'start': datetime.datetime(2005, 1, 1),
+                       'end': datetime.datetime(2008, 12, 31), 'netClass': 't', 'archive': 'GFZ', 'restricted': 0,
+                       'shared': 1},
+                   2: {'_oid': 2, 'code': 'X7', 'start': datetime.datetime(2010, 6, 1), 'end': None,
+                       'netClass': 't', 'archive': 'GFZ', 'restricted': 0, 'shared': 1}}
+        station = {'latitude': 0.0, 'longitude': 0.0, 'elevation': 0.0, 'place': '', 'country': '', 'end': None,
+                   'restricted': 0, 'shared': 1, 'archive': 'GFZ'}
+        # AAA belongs to X7_2010 and starts before it, BBB belongs to X7_2005
+        starows = {10: dict(station, _oid=10, _parent_oid=2, code='AAA', start=datetime.datetime(2010, 1, 1)),
+                   11: dict(station, _oid=11, _parent_oid=1, code='BBB', start=datetime.datetime(2010, 1, 1))}
+        pool = SQLitePool(netrows, starows, {}, {})
+        for microapi in [api.SC3MicroApi(pool), api.SC3MicroApi(pool, api.Inventory(pool))]:
+            status, headers, body = call(microapi.station.index, 'X7_2010', outformat='text', fields='code')
+            self.assertEqual(body.decode('utf-8').split(), ['code', 'AAA'])
+
+            for rules, expected in [('X7_2010.*', [('X7', 'AAA')]), ('X7_2005.*', [('X7', 'BBB')]),
+                                    ('X7_2010.BBB', [])]:
+                status, headers, body = call(microapi.routing.index,
+                                             body=('[Stations]\ninclude = %s\n' % rules).encode('utf-8'))
+                self.assertEqual([route[:2] for route in self.routes(body) if route[1] != '*'], expected, rules)
+
+            # Skipped and prioritized with the year of the station, as in routesfromSC3
+            rules = '[Stations]\ninclude = X7_2010.*, X7_2005.*\npriority2 = X7_2010.AAA\nskip = X7_2010.BBB\n'
+            status, headers, body = call(microapi.routing.index, body=rules.encode('utf-8'))
+            self.assertEqual([route for route in self.routes(body) if route[1] != '*'],
+                             [('X7', 'AAA', '2010-01-01T00:00:00', '2')])
+
+    def test_wrong_rules(self):
+        """Wrong rules or parameters are rejected with an error 400."""
+        for rules in [b'[Networks\nskip = GE', b'[Stations]\ninclude = GE', b'[Stations]\ninclude = ZS.*',
+                      b'\xff\xfe']:
+            self.assertEqual(call(self.sqlapi.routing.index, body=rules)[0], 400, rules)
+        for params in [{'vnets': '2'}, {'shared': 'x'}, {'wrongparam': '1'}]:
+            self.assertEqual(call(self.sqlapi.routing.index, **params)[0], 400, params)
+
+
+class RoutesFromSC3Tests(unittest.TestCase):
+    """Test the routing document built by routesfromSC3 directly from the DB."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.rows = randominventory()
+        cls.pool = SQLitePool(**cls.rows)
+
+    def compare(self, routing: api.RoutingXML, rules: str, args: list):
+        """Same output from the service and from the DB."""
+        session = APISession(api.SC3MicroApi(self.pool, routing=routing))
+        # The connection of the DB is closed at the end
+        dbsource = routesfromSC3.DBSource(SQLitePool(**self.rows), routing)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'rules.cfg')
+            with open(filename, 'w', encoding='utf-8') as fout:
+                fout.write(rules)
+            with mock.patch.object(routesfromSC3, 'httpsession', return_value=session):
+                expected = routesfromsc3('-r', filename, *args)
+            with mock.patch.object(routesfromSC3.DBSource, 'fromconfig', return_value=dbsource):
+                self.assertEqual(routesfromsc3('-r', filename, '--db', 'sc3microapi.cfg', *args), expected,
+                                 'Rules:\n%s\nArguments: %s' % (rules, args))
+
+    def test_db(self):
+        """Byte-identical output with the rules and arguments of the cron job."""
+        netcodes = sorted(set(api.extendedcode(net['code'], net['start']) for net in self.rows['netrows'].values()))
+        rnd = random.Random(8)
+        for rules in ['', '[Stations]\ninclude = GE.*\n',
+                      '[Networks]\nskip = %s\npriority2 = GE\npriority3 = %s\n[Stations]\ninclude = %s, CX.S1?0, '
+                      'GE.S0*\npriority3 = GE.S001\nskip = CX.S100\n[Virtualnets]\nskip = _CHILE\n' %
+                      (netcodes[0], netcodes[-1], ', '.join('%s.*' % code for code in rnd.sample(netcodes, 3)))]:
+            for args in [[], ['-a', 'GFZ'], ['-s', '0', '--vnets'], ['-a', 'ODC', '-s', '1', '--vnets']]:
+                self.compare(api.RoutingXML(), rules, args)
+
+        # Services of another data center
+        routing = api.RoutingXML([('dataselect', 'https://x.org/fdsnws/dataselect/1/query?a=1&b=2', 2)])
+        self.compare(routing, '[Stations]\ninclude = CX.*\n', ['--vnets'])
+
+    def test_trees(self):
+        """The trees are the ones parsed from the XML of the service."""
+        microapi = api.SC3MicroApi(self.pool)
+        dbsource = routesfromSC3.DBSource(self.pool, api.RoutingXML())
+        for tree, index, args, kwargs in [(dbsource.networks(), microapi.network.index, [], {}),
+                                          (dbsource.networks('GFZ', 1), microapi.network.index, [],
+                                           {'archive': 'GFZ', 'shared': '1'}),
+                                          (dbsource.stations('GE', '*'), microapi.station.index, ['GE'], {}),
+                                          (dbsource.stations('CX,GE', 'S1*', 'ODC'), microapi.station.index,
+                                           ['CX,GE', 'S1*'], {'archive': 'ODC'}),
+                                          (dbsource.stations('GE', 'XXXX'), microapi.station.index, ['GE', 'XXXX'],
+                                           {}),
+                                          (dbsource.vnetwork('_GEALL'), microapi.virtualnet.stations, ['_GEALL'],
+                                           {})]:
+            status, headers, body = call(index, *args, outformat='xml', **kwargs)
+            expected = ET.fromstring(body)
+            if index == microapi.virtualnet.stations:
+                expected = expected[0]
+            self.assertEqual(ET.tostring(tree), ET.tostring(expected), args)
+
+        self.assertIsNone(dbsource.stations('ZS', '*'))
+        self.assertIsNone(dbsource.stations('GE', 'S1,,S2'))
+        self.assertEqual(sorted(set(dbsource.vnets())), ['_CHILE', '_EMPTY', '_GEALL'])
+
+    def test_queries(self):
+        """Only the rows needed by the rules are read, with the queries of the service."""
+        pool = mock.Mock(wraps=SQLitePool(**self.rows))
+        dbsource = routesfromSC3.DBSource(pool, api.RoutingXML())
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'rules.cfg')
+            with open(filename, 'w', encoding='utf-8') as fout:
+                fout.write('[Stations]\ninclude = GE.S0*, CX.S100\n')
+            with mock.patch.object(routesfromSC3.DBSource, 'fromconfig', return_value=dbsource), \
+                    mock.patch.object(api.InventorySnapshot, 'load') as load:
+                routesfromsc3('-r', filename, '--db', 'sc3microapi.cfg', '-a', 'GFZ')
+        load.assert_not_called()
+        pool.close.assert_called_once()
+
+        queries = [args[0] for args, kwargs in pool.rows.call_args_list]
+        self.assertEqual(len(queries), 3)
+        self.assertTrue(all(' order by ' in query for query in queries), queries)
+        self.assertIn('archive=%s', queries[0])
+        self.assertNotIn('StationGroup', ' '.join(queries))
+        self.assertEqual([args[1] for args, kwargs in pool.rows.call_args_list][1:],
+                         [['GE', 'S0%', 'GFZ'], ['CX', 'S100', 'GFZ']])
+
+    def test_wrong_station(self):
+        """Stations which cannot be selected stop both paths with the same error."""
+        dbsource = routesfromSC3.DBSource(self.pool, api.RoutingXML())
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'rules.cfg')
+            with open(filename, 'w', encoding='utf-8') as fout:
+                fout.write('[Stations]\ninclude = ZS.*\n')
+            for patcher, args in [(mock.patch.object(routesfromSC3, 'httpsession',
+                                                     return_value=APISession(api.SC3MicroApi(self.pool))), []),
+                                  (mock.patch.object(routesfromSC3.DBSource, 'fromconfig', return_value=dbsource),
+                                   ['--db', 'sc3microapi.cfg'])]:
+                with patcher, mock.patch('builtins.print'):
+                    with self.assertRaises(SystemExit) as exit:
+                        routesfromsc3('-r', filename, *args)
+                    self.assertEqual(exit.exception.code, 2)
+
+
+# ----------------------------------------------------------------------
+class MainTests(unittest.TestCase):
+    """Test the services started depending on the configuration."""
+
+    def runmain(self, config: str) -> mock.Mock:
+        """Run main with a configuration and return the mocked Inventory class."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cfgfile = os.path.join(tmpdir, 'sc3microapi.cfg')
+            with open(cfgfile, 'w') as fout:
+                fout.write('[mysql]\nhost = h\nuser = u\npassword = p\ndb = d\n' + config)
+
+            read = configparser.RawConfigParser.read
+            with mock.patch.object(configparser.RawConfigParser, 'read',
+                                   lambda self, filenames, encoding=None: read(self, cfgfile)), \
+                    mock.patch.object(api, 'SC3dbpool'), mock.patch.object(api, 'Inventory') as inventory, \
+                    mock.patch.object(api.logging.config, 'dictConfig'), \
+                    mock.patch.object(cherrypy, 'engine'), mock.patch.object(cherrypy, 'tree'), \
+                    mock.patch.object(cherrypy.config, 'update'):
+                api.main()
+        return inventory
+
+    def test_nopolling(self):
+        """The tables are not polled if no feature needs it."""
+        self.assertFalse(self.runmain('').called)
+        self.assertFalse(self.runmain('[Inventory]\nsnapshot = false\n').called)
+
+    def test_polling(self):
+        """The tables are polled if the snapshot, the index of Access or a cache is enabled."""
+        for config in ['[Inventory]\nsnapshot = true\n', '[Inventory]\nentitlements = true\n',
+                       '[Cache]\nenabled = true\n', '[AccessCache]\nenabled = true\n']:
+            inventory = self.runmain(config)
+            inventory.assert_called_once()
+            inventory.return_value.subscribe.assert_called_once()
+
+
+def usage():
+    """Print how to use the unit tests."""
+    print('testClasses [-h|--help] [-p|--plain]')
+
+
+if __name__ == '__main__':
+
+    # 0=Plain mode (good for printing); 1=Colourful mode
+    mode = 1
+
+    for ind, arg in enumerate(sys.argv):
+        if ind == 0:
+            continue
+        if arg in ('-p', '--plain'):
+            del sys.argv[ind]
+            mode = 0
+        elif arg in ('-h', '--help'):
+            usage()
+            sys.exit(0)
+
+    # Errors logged by the API while testing wrong requests
+    logging.disable(logging.CRITICAL)
+    unittest.main(testRunner=WITestRunner(mode=mode))
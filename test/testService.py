@@ -184,6 +184,36 @@ class SC3MicroApiTests(unittest.TestCase):
             msg = 'Network GE could not be read/parsed!'
             self.assertTrue(False, e)
 
+    def test_network_not_modified(self):
+        """'network' method with a conditional request (If-None-Match)."""
+
+        msg = 'A request with the current ETag should return a 304 error code.'
+        if self.host.endswith('/'):
+            netmethod = '%snetwork/GE/' % self.host
+        else:
+            raise Exception('Wrong service URL format. A / is expected as last character.')
+
+        req = Request(netmethod)
+        try:
+            u = urlopen(req)
+            u.read()
+            etag = u.headers.get('ETag')
+        except:
+            raise Exception('Error retrieving network list.')
+
+        self.assertIsNotNone(etag, 'No ETag header found in the response.')
+
+        req = Request(netmethod, headers={'If-None-Match': etag})
+        try:
+            u = urlopen(req)
+            u.read()
+        except HTTPError as e:
+            self.assertEqual(e.getcode(), 304, '%s (%s)' % (msg, e.code))
+            return
+
+        self.assertTrue(False, msg)
+        return
+
     def test_access_2F_denied(self):
         """access to network 2F for a non-GFZ email account."""
 
@@ -312,6 +342,53 @@ class SC3MicroApiTests(unittest.TestCase):
         self.assertTrue(True, msg)
         return
 
+    def test_access_batch(self):
+        """access to 2F and GE in one batch request for a non-GFZ email account."""
+
+        msg = 'Access to 2F should be denied and to GE allowed for a non-GFZ account.'
+        if self.host.endswith('/'):
+            accmethod = '{}access/batch'.format(self.host)
+        else:
+            raise Exception('Wrong service URL format. A / is expected as last character.')
+
+        body = {'email': 'none@none.com',
+                'items': [{'nslc': '2F', 'starttime': '2013-01-01', 'endtime': '2013-01-01'},
+                          {'nslc': 'GE', 'starttime': '2013-01-01', 'endtime': '2013-01-01'}]}
+        req = Request(accmethod, data=json.dumps(body).encode('utf-8'),
+                      headers={'Content-Type': 'application/json'})
+        try:
+            u = urlopen(req)
+            buffer = u.read()
+        except HTTPError as e:
+            self.assertTrue(False, '%s (%s)' % (msg, e))
+            return
+
+        result = json.loads(buffer.decode('utf-8'))
+        self.assertEqual([item['access'] for item in result], [False, True], msg)
+        return
+
+    def test_access_bundle(self):
+        """grants and open networks for a GFZ email account."""
+
+        msg = 'The grants of a GFZ account should include network 2F and GE should be open.'
+        if self.host.endswith('/'):
+            accmethod = '{}access/bundle?email=none@gfz-potsdam.de'.format(self.host)
+        else:
+            raise Exception('Wrong service URL format. A / is expected as last character.')
+
+        req = Request(accmethod)
+        try:
+            u = urlopen(req)
+            buffer = u.read()
+        except HTTPError as e:
+            self.assertTrue(False, '%s (%s)' % (msg, e))
+            return
+
+        result = json.loads(buffer.decode('utf-8'))
+        self.assertIn('2F', [grant['network'] for grant in result['grants']], msg)
+        self.assertIn('GE', [net['network'] for net in result['open']], msg)
+        return
+
 
 # ----------------------------------------------------------------------
 def usage():
@@ -17,6 +17,12 @@ any later version.
 
 import sys
 import unittest
+import re
+import sqlite3
+import datetime
+import itertools
+import threading
+import contextlib
 
 
 class WITestRunner(object):
@@ -120,3 +126,165 @@ class WITestResult(unittest.TestResult):
                                   (errorType, test.shortDescription()))
             self.testRunner.write((self.WARNING + '    %s' + self.ENDC) %
                                   err.splitlines(True)[-1])
+
+
+class SQLiteCursor(object):
+    """Cursor of SQLite accepting the parameters of MySQLdb and returning dictionaries."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        """Constructor of the SQLiteCursor class."""
+        self.cursor = conn.cursor()
+
+    @staticmethod
+    def __variable(value):
+        # MySQL converts the dates given as strings when comparing them with
+        # DATETIME columns and MySQLdb ignores the timezone of datetimes
+        if isinstance(value, str) and re.fullmatch(r'\d{4}-\d{2}-\d{2}([T ]\d{2}:\d{2}:\d{2}(\.\d+)?)?', value):
+            return datetime.datetime.fromisoformat(value)
+        if isinstance(value, datetime.datetime):
+            return value.replace(tzinfo=None)
+        return value
+
+    def execute(self, query: str, variables):
+        """Run a query written for MySQL (%s as placeholder)."""
+        self.cursor.execute(query.replace('%s', '?').replace('%%', '%'),
+                            [self.__variable(value) for value in variables or []])
+
+    def __row(self, row):
+        return {desc[0]: value for desc, value in zip(self.cursor.description, row)}
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        return self.__row(row) if row is not None else None
+
+    def fetchall(self):
+        return tuple(self.__row(row) for row in self.cursor.fetchall())
+
+    def fetchmany(self, size: int):
+        return tuple(self.__row(row) for row in self.cursor.fetchmany(size))
+
+    def close(self):
+        self.cursor.close()
+
+
+class SQLiteConnection(object):
+    """Connection with the interface of SC3dbconnection to an in-memory copy of the inventory."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        """Constructor of the SQLiteConnection class."""
+        self.conn = conn
+        self.cursor = None
+
+    def ping(self):
+        pass
+
+    def release(self):
+        if self.cursor is not None:
+            self.cursor.close()
+            self.cursor = None
+
+    def close(self):
+        self.release()
+
+    def execute(self, query: str, variables, serverside: bool = False):
+        self.release()
+        self.cursor = SQLiteCursor(self.conn)
+        self.cursor.execute(query, variables)
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def fetchmany(self, size: int):
+        return self.cursor.fetchmany(size)
+
+    def iterrows(self, batch_size: int = 1000):
+        while True:
+            rows = self.fetchmany(batch_size)
+            if not len(rows):
+                return
+            yield from rows
+
+
+class SQLitePool(object):
+    """Pool with the interface of SC3dbpool over an in-memory SQLite DB with the inventory tables.
+
+    The rows of every table are given as in InventorySnapshot (dictionaries
+    indexed by _oid) so that the SQL path and the snapshot can be compared.
+    """
+
+    schema = """
+        create table PublicObject (_oid integer primary key, publicID text);
+        create table Network (_oid integer primary key, _parent_oid integer, _last_modified timestamp,
+                              code text, start timestamp, end timestamp, netClass text, archive text,
+                              restricted integer, shared integer);
+        create table Station (_oid integer primary key, _parent_oid integer, _last_modified timestamp,
+                              code text, latitude real, longitude real, elevation real, place text,
+                              country text, start timestamp, end timestamp, restricted integer,
+                              shared integer, archive text);
+        create table StationGroup (_oid integer primary key, _parent_oid integer, _last_modified timestamp,
+                                   code text, start timestamp, end timestamp, type text);
+        create table StationReference (_oid integer primary key, _parent_oid integer,
+                                       _last_modified timestamp, stationID text);
+        create table Access (_oid integer primary key, _parent_oid integer, _last_modified timestamp,
+                             networkCode text, stationCode text, locationCode text, streamCode text,
+                             user text, start timestamp, end timestamp);
+        """
+
+    def __init__(self, netrows: dict, starows: dict, vnetrows: dict, refrows: dict, accessrows: list = None):
+        """Constructor of the SQLitePool class.
+
+        :param accessrows: Rows of the Access table (networkCode, stationCode, locationCode, streamCode,
+            user, start, end)
+        :type accessrows: list
+        """
+        self.conn = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+        # Functions of MySQL used in the queries
+        self.conn.create_function('concat', -1, lambda *args: ''.join('' if x is None else str(x) for x in args))
+        self.conn.create_function('YEAR', 1, lambda value: int(str(value)[:4]) if value is not None else None)
+        self.conn.executescript(self.schema)
+        self.lock = threading.Lock()
+
+        modified = datetime.datetime(2020, 1, 1)
+        for oid, row in netrows.items():
+            self.conn.execute('insert into Network values (?, 0, ?, ?, ?, ?, ?, ?, ?, ?)',
+                              (oid, modified, row['code'], row['start'], row['end'], row['netClass'],
+                               row['archive'], row['restricted'], row['shared']))
+        for oid, row in starows.items():
+            self.conn.execute('insert into Station values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                              (oid, row['_parent_oid'], modified, row['code'], row['latitude'], row['longitude'],
+                               row['elevation'], row['place'], row['country'], row['start'], row['end'],
+                               row['restricted'], row['shared'], row['archive']))
+            self.conn.execute('insert into PublicObject values (?, ?)', (oid, 'Station/%d' % oid))
+        for oid, row in vnetrows.items():
+            self.conn.execute('insert into StationGroup values (?, 0, ?, ?, ?, ?, ?)',
+                              (oid, modified, row['code'], row['start'], row['end'], row['type']))
+        for oid, row in refrows.items():
+            self.conn.execute('insert into StationReference values (?, ?, ?, ?)',
+                              (oid, row['vnet'], modified, 'Station/%d' % row['station']))
+        for oid, row in enumerate(accessrows or [], start=1):
+            self.conn.execute('insert into Access values (?, 0, ?, ?, ?, ?, ?, ?, ?, ?)', (oid, modified) + tuple(row))
+        self.conn.commit()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Check out the only connection (one request at a time)."""
+        with self.lock:
+            conn = SQLiteConnection(self.conn)
+            try:
+                yield conn
+            finally:
+                conn.release()
+
+    def rows(self, query: str, variables: list, size: int = 1000, stream: bool = True, rowfilter=None,
+             limit: int = None):
+        """Run a query and return its rows. They are never streamed."""
+        with self.connection() as conn:
+            conn.execute(query, variables)
+            rows = filter(rowfilter, conn.fetchall()) if rowfilter is not None else conn.fetchall()
+            return list(itertools.islice(rows, limit))
+
+    def close(self):
+        self.conn.close()
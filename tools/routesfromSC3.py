@@ -26,17 +26,171 @@
 ##################################################################
 
 import sys
+import os
 import argparse
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import xml.etree.ElementTree as ET
 import configparser
 import json
+from concurrent.futures import ThreadPoolExecutor
+
+# Namespace of the documents of a Routing Service
+NS = 'http://geofon.gfz-potsdam.de/ns/Routing/1.0/'
 
 
 def istemporary(net):
     return net[0] in '0123456789XYZ'
 
 
+def routingtree(routing, rows, stations=False):
+    """Build the tree of the document rendered by sc3microapi with the routes to networks or stations.
+
+    The whitespace in the text and tail of the elements is the same as in the
+    parsed document, so that the output is identical to the one of the service.
+    """
+    root = ET.Element('{%s}routing' % NS)
+    root.text = '\n            '
+    route = None
+    for row in rows:
+        if route is None:
+            root.text += '\n '
+        else:
+            route.tail = '\n \n '
+
+        if stations:
+            netcode, stacode = row['network'], row['code']
+        else:
+            netcode, stacode = row['code'], '*'
+        route = ET.SubElement(root, '{%s}route' % NS, {'networkCode': netcode, 'stationCode': stacode,
+                                                      'locationCode': '*', 'streamCode': '*'})
+        route.text = '\n  '
+        window = {'start': row['start'].isoformat(), 'end': row['end'].isoformat() if row['end'] is not None else ''}
+        for service, address, priority in routing.services:
+            elem = ET.SubElement(route, '{%s}%s' % (NS, service), {'address': address, 'priority': str(priority)})
+            elem.attrib.update(window)
+            elem.tail = '\n  '
+        elem.tail = '\n '
+
+    if route is not None:
+        route.tail = '\n '
+    return root
+
+
+def vnettree(code, rows):
+    """Build the tree of a virtual network with its streams as rendered by sc3microapi."""
+    vnet = ET.Element('{%s}vnetwork' % NS, {'networkCode': code})
+    vnet.text = '\n               '
+    vnet.tail = '\n'
+    for row in rows:
+        stream = ET.SubElement(vnet, '{%s}stream' % NS, {'networkCode': row['network'], 'stationCode': row['station'],
+                                                        'locationCode': '*', 'streamCode': '*',
+                                                        'start': row['start'].isoformat(), 'end': ''})
+        stream.tail = '\n'
+    return vnet
+
+
+def queryapi():
+    """Query layer of sc3microapi, used without the service."""
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sc3microapi'))
+    import sc3microapi as api
+    return api
+
+
+class DBSource(object):
+    """Read the inventory directly from the database configured for sc3microapi."""
+
+    def __init__(self, pool, routing):
+        """Build the routes with the queries of sc3microapi through a pool of connections and a RoutingXML."""
+        self.api = queryapi()
+        self.pool = pool
+        self.routing = routing
+        # Same queries as the methods of the service, without a snapshot of the inventory
+        self.network = self.api.NetworksAPI(pool, routing=routing)
+        self.station = self.api.StationsAPI(pool, routing=routing)
+        self.virtualnet = self.api.VirtualNetsAPI(pool, routing=routing)
+
+    @classmethod
+    def fromconfig(cls, cfgfile):
+        """Connect to the database of a configuration file of sc3microapi."""
+        api = queryapi()
+        config = configparser.RawConfigParser()
+        with open(cfgfile, encoding='utf-8') as c:
+            config.read_file(c)
+
+        # Same services in the routes as the ones of the service
+        routing = api.RoutingXML.fromconfig(config)
+
+        # All the queries are sent through a single connection
+        pool = api.SC3dbpool(config.get('mysql', 'host'), config.get('mysql', 'user'),
+                             config.get('mysql', 'password'), config.get('mysql', 'db'), maxsize=1)
+        return cls(pool, routing)
+
+    def close(self):
+        """Close the connection to the database."""
+        self.pool.close()
+
+    def networks(self, archive=None, shared=None):
+        """Tree with the routes to the networks."""
+        query, variables = self.network.query({'code', 'start', 'end'}, archive=archive, shared=shared)
+        return routingtree(self.routing, self.pool.rows(query, variables, stream=False))
+
+    def stations(self, net, sta, archive=None, shared=None):
+        """Tree with the routes to the stations or None if the codes are not valid."""
+        try:
+            netmatcher = self.api.CodeMatcher(net, extended=True)
+            if any(istemporary(code) and year is None for code, year in netmatcher.exact):
+                return None
+            stamatcher = self.api.CodeMatcher(sta) if sta != '*' else None
+        except ValueError:
+            return None
+
+        query, variables = self.station.query({'network', 'code', 'start', 'end'}, net=netmatcher, sta=stamatcher,
+                                              archive=archive, shared=shared)
+        return routingtree(self.routing, self.pool.rows(query, variables, stream=False), stations=True)
+
+    def vnets(self):
+        """Codes of the virtual networks."""
+        query, variables = self.virtualnet.query({'code'})
+        return [vnet['code'] for vnet in self.pool.rows(query, variables, stream=False)]
+
+    def vnetwork(self, code):
+        """Virtual network with its streams."""
+        query, variables = self.virtualnet.stationsquery(code, ['network', 'station', 'start'])
+        return vnettree(code, self.pool.rows(query, variables, stream=False))
+
+
+def httpsession(workers=1, retries=3, backoff=0.5):
+    """Session keeping the connections alive and shared by all the workers.
+
+    Failed connections and responses with a server error are retried with an
+    exponential backoff.
+    """
+    session = requests.Session()
+    session.headers['User-Agent'] = 'routesfromSC3 python-requests/' + requests.__version__
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=[500, 502, 503, 504],
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(workers, 1), max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def fetchall(session, requests2do, workers=1):
+    """Send GET requests (pairs of URL and parameters) and return the responses in the same order."""
+    def fetch(request):
+        url, params = request
+        return session.get(url, params=params)
+
+    if workers <= 1:
+        return [fetch(request) for request in requests2do]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # map keeps the order of the requests independently of the order in which they finish
+        return list(executor.map(fetch, requests2do))
+
+
 def main():
     # Call the sc3microapi method "networks"
     urlbase = 'http://localhost/sc3microapi'
@@ -56,6 +210,13 @@ def main():
                         help='Filter networks by its "shared" attribute')
     parser.add_argument('--vnets', action='store_true', default=False,
                         help='Include information of virtual networks')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='Number of requests sent concurrently to sc3microapi.')
+    parser.add_argument('--retries', type=int, default=3,
+                        help='Number of retries of a request if the connection fails or a server error is received.')
+    parser.add_argument('--db', default=None,
+                        help='Configuration file of sc3microapi. Read the routes directly from its database '
+                             'instead of the service.')
     parser.add_argument('-l', '--loglevel',
                         help='Verbosity in the output.',
                         choices=['CRITICAL', 'ERROR', 'WARNING', 'INFO',
@@ -104,55 +265,62 @@ def main():
             if 'skip' in config.options('Virtualnets'):
                 vnets2skip = [x.strip() for x in config.get('Virtualnets', 'skip').split(',')]
 
-    # Call the sc3microapi method "networks"
-    url = '%s/network/' % args.url
+    if args.db is not None:
+        # Build the trees from the rows of the database
+        dbsource = DBSource.fromconfig(args.db)
+        session = None
+        elem = dbsource.networks(args.archive, args.shared)
+    else:
+        dbsource = None
+        # All requests are sent through the same connections
+        session = httpsession(args.workers, args.retries)
 
-    # Build query, read result and save to a file
-    headers = {
-        'User-Agent': 'routesfromSC3 python-requests/' + requests.__version__,
-    }
+        # Call the sc3microapi method "networks"
+        url = '%s/network/' % args.url
 
-    params = dict()
-    # Request in XML format ready to get ingested in a Routing Service
-    params['outformat'] = 'xml'
+        params = dict()
+        # Request in XML format ready to get ingested in a Routing Service
+        params['outformat'] = 'xml'
 
-    if args.shared is not None:
-        params['shared'] = args.shared
+        if args.shared is not None:
+            params['shared'] = args.shared
 
-    if args.archive is not None:
-        params['archive'] = args.archive
+        if args.archive is not None:
+            params['archive'] = args.archive
 
-    r = requests.get(url, params, headers=headers)
+        r = session.get(url, params=params)
 
-    if r.status_code != 200:
-        print('Error reading from %s with parameters: %s' % (url, params))
-        sys.exit(2)
+        if r.status_code != 200:
+            print('Error reading from %s with parameters: %s' % (url, params))
+            sys.exit(2)
 
-    # Create the XML for the networks
-    elem = ET.fromstring(r.content)
+        # Create the XML for the networks
+        elem = ET.fromstring(r.content)
     
-    if len(nets2skip):
-        for net in reversed(elem):
-            # Check the type of network
-            if istemporary(net.get('networkCode')):
-                netcode = '%s_%s' % (net.get('networkCode'), net[0].get('start')[:4])
-            else:
-                netcode = net.get('networkCode')
+    # The priorities apply also if no network is skipped
+    for net in reversed(elem):
+        # Check the type of network
+        if istemporary(net.get('networkCode')):
+            netcode = '%s_%s' % (net.get('networkCode'), net[0].get('start')[:4])
+        else:
+            netcode = net.get('networkCode')
 
-            if netcode in nets2skip:
-                elem.remove(net)
-                continue
+        if netcode in nets2skip:
+            elem.remove(net)
+            continue
 
-            # Check if priority should be set to 2
-            if netcode in priority2:
-                for route in net:
-                    route.set('priority', "2")
+        # Check if priority should be set to 2
+        if netcode in priority2:
+            for route in net:
+                route.set('priority', "2")
 
-            # Check if priority should be set to 3
-            if netcode in priority3:
-                for route in net:
-                    route.set('priority', "3")
+        # Check if priority should be set to 3
+        if netcode in priority3:
+            for route in net:
+                route.set('priority', "3")
 
+    # Request all the stations to add and process them in the order of the rules
+    stationrequests = list()
     for netsta in stations2add:
         net, sta = netsta.split('.')
 
@@ -172,16 +340,22 @@ def main():
         if args.archive is not None:
             params['archive'] = args.archive
 
-        r = requests.get(url, params, headers=headers)
+        stationrequests.append((url, params))
 
-        if r.status_code != 200:
+    if dbsource is not None:
+        stationtrees = [dbsource.stations(*netsta.split('.'), args.archive, args.shared) for netsta in stations2add]
+    else:
+        stationtrees = [ET.fromstring(r.content) if r.status_code == 200 else None
+                        for r in fetchall(session, stationrequests, args.workers)]
+
+    for (url, params), elem2 in zip(stationrequests, stationtrees):
+        if elem2 is None:
             print('Error reading from %s with parameters: %s' % (url, params))
             sys.exit(2)
 
         # Filter and modify result based in file with rules
 
         # Create the XML for the stations
-        elem2 = ET.fromstring(r.content)
 
         for sta in elem2:
             # Check the type of network and add start year if temporary
@@ -208,22 +382,33 @@ def main():
 
             elem.append(sta)
 
-    if args.vnets:
+    if args.vnets and dbsource is not None:
+        # Create the XML output for virtual networks from the database
+        for code in sorted(set(dbsource.vnets())):
+            # Check if the Virtual Netowork must be skipped
+            if code in vnets2skip:
+                continue
+            elem.append(dbsource.vnetwork(code))
+
+    elif args.vnets:
         # Create the XML output for virtual networks
         # http://st27dmz.gfz-potsdam.de/sc3microapi/virtualnet/stations/_GEALL/
         url = '%s/virtualnet/' % args.url
-        r = requests.get(url)
-
-        vns = json.loads(r.content.decode('utf-8'))
-        for vn in vns:
-            # Check if the Virtual Netowork must be skipped
-            if vn['code'] in vnets2skip:
-                continue
-            # Retrieve stations in VN
-            r = requests.get(args.url + '/virtualnet/stations/%s/?outformat=xml' % vn['code'])
+        r = session.get(url)
+
+        # Once per code. The streams of all the epochs of a virtual network are in the same request
+        vns = sorted(set(vn['code'] for vn in json.loads(r.content.decode('utf-8'))))
+        # Check if the Virtual Netowork must be skipped
+        vnrequests = [(args.url + '/virtualnet/stations/%s/' % vn, {'outformat': 'xml'})
+                      for vn in vns if vn not in vnets2skip]
+        # Retrieve stations in VN
+        for r in fetchall(session, vnrequests, args.workers):
             vnxml = ET.fromstring(r.content.decode('utf-8'))
             elem.append(vnxml[0])
 
+    if dbsource is not None:
+        dbsource.close()
+
     with open(args.output, 'wb') as fout:
         fout.write(ET.tostring(elem))
 